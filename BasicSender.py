@@ -1,8 +1,15 @@
+import os
 import sys
+import mmap
 import socket
 import random
+import select
+import binascii
+import collections
 
 import Checksum
+import BatchIO
+import BinaryPacket
 
 '''
 This is the basic sender class. Your sender will extend this class and will
@@ -20,21 +27,54 @@ class BasicSender(object):
             self.infile = sys.stdin
         else:
             self.infile = open(filename,"r")
+        # A regular file is also mapped into memory, so that any part of it can be read again without a copy of
+        # our own. stdin, pipes and empty files can't be mapped, and are only read front to back
+        self.infile_map = None
+        if filename != None:
+            try:
+                self.infile_map = mmap.mmap(self.infile.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                pass
+        self.io = BatchIO.BatchIO(self.sock)
+        self.send_queue = []
 
-    # Waits until packet is received to return.
+    # Waits until packet is received to return. The socket itself stays blocking; we wait for it with
+    # select() rather than changing its timeout before every receive.
     def receive(self, timeout=None):
-        self.sock.settimeout(timeout)
         try:
+            if timeout is not None and not select.select([self.sock], [], [], timeout)[0]:
+                return None
             return self.sock.recv(4096)
-        except (socket.timeout, socket.error):
+        except (select.error, socket.error):
             return None
 
+    # Returns every packet already waiting on the socket, without blocking.
+    def receive_many(self):
+        return [message for message, address in self.io.recvmany()]
+
     # Sends a packet to the destination address.
     def send(self, message, address=None):
         if address is None:
             address = (self.dest,self.dport)
         self.sock.sendto(message, address)
 
+    # Queues a packet to be sent to the destination address by the next flush(). This lets a burst of
+    # packets go out in a single system call
+    def enqueue(self, message, address=None):
+        if address is None:
+            address = (self.dest,self.dport)
+        self.send_queue.append((message, address))
+
+    # Sends every queued packet.
+    def flush(self):
+        if self.send_queue:
+            self.io.sendmany(self.send_queue)
+            self.send_queue = []
+
+    # Returns up to 'length' bytes of the mapped input file, starting at 'offset'
+    def read_at(self, offset, length):
+        return self.infile_map[offset:offset + length]
+
     # Prepares a packet
     def make_packet(self,msg_type,seqno,msg):
         # msg_type can be either 'start', 'end', 'data', or 'ack'
@@ -45,6 +85,14 @@ class BasicSender(object):
         packet = "%s%s" % (body,checksum)
         return packet
 
+    # Prepares a packet, and returns it along with its checksum. Passing that checksum back in when building the
+    # same packet again, e.g. to retransmit it, saves computing it again
+    def make_packet_with_checksum(self,msg_type,seqno,msg,checksum=None):
+        body = "%s|%d|%s|" % (msg_type,seqno,msg)
+        if checksum is None:
+            checksum = Checksum.generate_checksum(body)
+        return "%s%s" % (body,checksum), checksum
+
     def split_packet(self, message):
         pieces = message.split('|')
         msg_type, seqno = pieces[0:2] # first two elements always treated as msg type and seqno
@@ -55,3 +103,159 @@ class BasicSender(object):
     # Main sending loop.
     def start(self):
         raise NotImplementedError
+
+
+'''
+Builds packets in place, in the slots of one preallocated bytearray. The file
+chunk is read straight into its slot with readinto(), the header and checksum
+are written around it, and the checksum is computed over a memoryview, so
+building a packet copies the data once and concatenates no strings.
+
+A packet is a memoryview of its slot. The slot for sequence number 'seqno' is
+seqno % slots, so a packet stays valid until the packet 'slots' sequence
+numbers later is built.
+'''
+class PacketBuilder(object):
+    def __init__(self, slots, slot_size):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.buffer = bytearray(slots * slot_size)
+        view = memoryview(self.buffer)
+        # Slicing a memoryview costs about as much as copying a packet's worth of data, so we slice each slot once
+        self.slot_views = [view[i * slot_size:(i + 1) * slot_size] for i in xrange(slots)]
+        # <(data offset, chunk size) -> the view of each slot that the chunk goes in>
+        self.data_views = {}
+
+    # Reads up to 'chunk_size' bytes from 'infile' and builds the packet with sequence number 'seqno' around
+    # them, in the binary packet format if 'binary' is set, with an Adler-32 checksum if 'adler32' is too. Like
+    # our senders, the first packet is a 'start' and an empty chunk makes an 'end'. Returns (msg_type, packet)
+    #
+    # Copying a packet's worth of data costs less than a Python function call, so this path is written to
+    # make as few calls as it can rather than to avoid every copy
+    def build_from_file(self, infile, seqno, chunk_size, binary=False, adler32=False):
+        index = seqno % self.slots
+
+        if binary:
+            offset = BinaryPacket.HEADER_SIZE
+        else:
+            # Where the data starts depends on the header, which depends on whether we read anything. An 'end'
+            # has no data though, so we can read as if this were a 'start' or 'data' and rewrite the header
+            header = "%s|%d|" % ('start' if seqno == 0 else 'data', seqno)
+            offset = len(header)
+
+        views = self.data_views.get((offset, chunk_size))
+        if views is None:
+            views = self.get_data_views(offset, chunk_size)
+        data = views[index]
+        readinto = getattr(infile, 'readinto', None)
+        if readinto is not None:
+            length = readinto(data)
+        else:
+            length = self.read_into(infile, data)
+        if length < chunk_size:
+            data = data[:length]
+
+        if seqno == 0:
+            msg_type = 'start'
+        elif length == 0:
+            msg_type = 'end'
+        else:
+            msg_type = 'data'
+
+        if binary:
+            BinaryPacket.make_packet_into(self.buffer, index * self.slot_size, msg_type, seqno, data, adler32)
+            return msg_type, self.slot_views[index][:offset + length]
+
+        if msg_type == 'end':
+            header = "end|%d|" % seqno
+        slot = self.slot_views[index]
+        slot[:len(header)] = header
+        checksum = binascii.crc32('|', binascii.crc32(data, binascii.crc32(header))) & 0xffffffff
+        trailer = "|%d" % checksum
+        end = len(header) + length
+        slot[end:end + len(trailer)] = trailer
+        return msg_type, slot[:end + len(trailer)]
+
+    # Returns the views of every slot that a chunk of 'chunk_size' bytes starting 'offset' bytes into the slot
+    # is read into
+    def get_data_views(self, offset, chunk_size):
+        views = self.data_views.get((offset, chunk_size))
+        if views is None:
+            if offset + chunk_size > self.slot_size:
+                raise ValueError("a %d byte chunk after a %d byte header doesn't fit in a packet" % (chunk_size, offset))
+            views = [slot[offset:offset + chunk_size] for slot in self.slot_views]
+            self.data_views[(offset, chunk_size)] = views
+        return views
+
+    # Fills 'view' from a file without readinto() (e.g. StringIO), at the cost of an extra copy, and returns how
+    # many bytes it read
+    def read_into(self, infile, view):
+        data = infile.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+
+'''
+Bounded read-ahead for input that can't be memory-mapped, such as stdin or a
+pipe. Reading a chunk straight from such a file blocks until the whole chunk
+has arrived, and everything else a sender does (handling ACKs, retransmitting)
+stalls with it whenever the producer is slow. Instead, an event loop tells us
+when the file is readable, and fill() reads whatever has arrived, which never
+blocks, into a buffer of at most 'limit' bytes. A chunk can be taken from the
+buffer once a whole one has arrived, or the file has ended.
+
+With a 'compressor' (see Compression), the buffer holds the file compressed, so
+the chunks are pieces of the compressed stream.
+'''
+class ReadAhead(object):
+    # Most we read in one go
+    READ_SIZE = 65536
+
+    def __init__(self, infile, limit, compressor=None):
+        self.infile = infile
+        self.limit = limit
+        self.compressor = compressor
+        # What we have read and not yet handed out, as the strings we read it in. The first 'offset' bytes of the
+        # first piece have been handed out already; we don't cut them off, as that would copy the rest of it
+        self.pieces = collections.deque()
+        self.offset = 0
+        self.buffered = 0
+        self.eof = False
+
+    # Returns true or false based on whether there is more to read and room to read it into
+    def wants_more(self):
+        return not self.eof and self.buffered < self.limit
+
+    # Called when the file is readable. Reads what has arrived, up to the limit
+    def fill(self):
+        data = os.read(self.infile.fileno(), min(self.limit - self.buffered, self.READ_SIZE))
+        if not data:
+            self.eof = True
+        if self.compressor is not None:
+            # the compressor holds on to what it can't compress yet, and hands the rest over at the end
+            data = self.compressor.flush() if self.eof else self.compressor.compress(data)
+        if data:
+            self.pieces.append(data)
+            self.buffered += len(data)
+
+    # Returns true or false based on whether read() can return a whole chunk of 'size' bytes, or the last one
+    def has_chunk(self, size):
+        return self.eof or self.buffered >= size
+
+    # Returns up to 'size' bytes from the front of the buffer, like a file's read() would
+    def read(self, size):
+        pieces = []
+        while size and self.pieces:
+            piece = self.pieces[0]
+            end = self.offset + size
+            if end < len(piece):
+                pieces.append(piece[self.offset:end])
+                self.offset = end
+                break
+            pieces.append(piece[self.offset:] if self.offset else piece)
+            size -= len(piece) - self.offset
+            self.pieces.popleft()
+            self.offset = 0
+        data = ''.join(pieces)
+        self.buffered -= len(data)
+        return data
@@ -0,0 +1,214 @@
+import socket
+import select
+import struct
+import ctypes
+import ctypes.util
+
+'''
+Batched datagram I/O. On Linux, sendmmsg() and recvmmsg() move a whole batch of
+datagrams through the kernel in one system call instead of one sendto() or
+recvfrom() per datagram. Everywhere else (or if the calls are missing) we fall
+back to a plain loop over the socket methods, so callers never need to care
+which one they got.
+'''
+
+# Linux flag that makes a single receive call non-blocking
+MSG_DONTWAIT = 0x40
+
+# iov_base is declared as a char * so that a string can be assigned to it directly; ctypes then keeps the
+# string alive for as long as the iovec refers to it
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_char_p),
+                ('iov_len', ctypes.c_size_t)]
+
+# sin_port and sin_addr are in network byte order
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [('sin_family', ctypes.c_ushort),
+                ('sin_port', ctypes.c_uint16),
+                ('sin_addr', ctypes.c_uint32),
+                ('sin_zero', ctypes.c_ubyte * 8)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        return libc
+    except (OSError, AttributeError, TypeError):
+        return None
+
+_libc = _load_libc()
+HAVE_MMSG = _libc is not None
+
+# Layout of the structures, for reading them as raw memory
+HEADER_SIZE = ctypes.sizeof(mmsghdr)
+MSG_LEN_OFFSET = mmsghdr.msg_len.offset
+NAME_SIZE = ctypes.sizeof(sockaddr_in)
+IOVEC_FORMAT = 'P' + {4: 'I', 8: 'Q'}[ctypes.sizeof(ctypes.c_size_t)]
+
+
+class BatchIO(object):
+
+    def __init__(self, sock, max_batch=64, bufsize=4096, use_mmsg=True):
+        self.sock = sock
+        self.max_batch = max_batch
+        self.bufsize = bufsize
+        # sendmmsg()/recvmmsg() only speak IPv4 here, since that is all our sockets use
+        self.use_mmsg = use_mmsg and HAVE_MMSG and sock.family == socket.AF_INET
+
+        # <(host, port) -> sockaddr_in> for destinations, and <raw sin_port and sin_addr -> (IP address, port)> for sources
+        self.sockaddr_cache = {}
+        self.address_cache = {}
+
+        if self.use_mmsg:
+            # Headers, buffers and addresses are allocated once and reused for every batch. Going through
+            # ctypes attributes for each datagram costs more than the system calls we are saving, so the hot
+            # paths read and write these arrays as raw memory with the struct module instead
+            self.send_buffer = ctypes.create_string_buffer(bufsize * max_batch)
+            self.send_view = memoryview(self.send_buffer)
+            self.send_iovecs = (iovec * max_batch)()
+            self.send_headers = (mmsghdr * max_batch)()
+            self._link_headers(self.send_headers, self.send_iovecs)
+            # destination currently in each send header, so we only touch it when it changes
+            self.send_names = [None] * max_batch
+
+            self.recv_buffers = ctypes.create_string_buffer(bufsize * max_batch)
+            self.recv_data = buffer(self.recv_buffers)
+            self.recv_addresses = (sockaddr_in * max_batch)()
+            self.recv_iovecs = (iovec * max_batch)()
+            self.recv_headers = (mmsghdr * max_batch)()
+            self._link_headers(self.recv_headers, self.recv_iovecs)
+            buffers_address = ctypes.addressof(self.recv_buffers)
+            for i in xrange(max_batch):
+                self.recv_iovecs[i].iov_base = ctypes.cast(buffers_address + i * bufsize, ctypes.c_char_p)
+                self.recv_iovecs[i].iov_len = bufsize
+                self.recv_headers[i].msg_hdr.msg_name = ctypes.addressof(self.recv_addresses[i])
+            self.recv_headers_template = ctypes.create_string_buffer(ctypes.string_at(self.recv_headers, ctypes.sizeof(self.recv_headers)))
+            # Number of receive headers that recvmmsg() filled in last time, which need resetting
+            self.recv_used = 0
+            # struct formats that pull the message lengths and source addresses out of the first n headers
+            length_format = '%dxI%dx' % (MSG_LEN_OFFSET, HEADER_SIZE - MSG_LEN_OFFSET - 4)
+            name_format = '2x6s%dx' % (NAME_SIZE - 8)
+            self.recv_length_formats = ['=' + length_format * n for n in xrange(max_batch + 1)]
+            self.recv_name_formats = ['=' + name_format * n for n in xrange(max_batch + 1)]
+
+    # Points each header at its own single iovec
+    def _link_headers(self, headers, iovecs):
+        for i in xrange(len(headers)):
+            headers[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+            headers[i].msg_hdr.msg_iovlen = 1
+            headers[i].msg_hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+
+    # Sends every (message, address) pair in 'packets', in order
+    def sendmany(self, packets):
+        if not self.use_mmsg:
+            for message, address in packets:
+                self.sock.sendto(message, address)
+            return
+
+        for start in xrange(0, len(packets), self.max_batch):
+            batch = packets[start:start + self.max_batch]
+            sent = self._sendmmsg(batch)
+            # The kernel may take only part of the batch, e.g. if the send buffer is full and the socket has a
+            # timeout (which makes it non-blocking underneath). The socket methods know how to wait for room
+            for message, address in batch[sent:]:
+                self.sock.sendto(message, address)
+
+    # Returns every datagram already queued on the socket (up to max_batch of them) as a list of
+    # (message, address) pairs, without blocking
+    def recvmany(self):
+        if not self.use_mmsg:
+            packets = []
+            while len(packets) < self.max_batch and select.select([self.sock], [], [], 0)[0]:
+                try:
+                    packets.append(self.sock.recvfrom(self.bufsize))
+                except socket.error:
+                    break
+            return packets
+
+        # recvmmsg() overwrites the address lengths and message lengths of the headers it used, so put those
+        # headers back the way they started
+        if self.recv_used:
+            ctypes.memmove(self.recv_headers, self.recv_headers_template, self.recv_used * HEADER_SIZE)
+        received = max(_libc.recvmmsg(self.sock.fileno(), self.recv_headers, self.max_batch, MSG_DONTWAIT, None), 0)
+        self.recv_used = received
+        if not received:
+            return []
+
+        lengths = struct.unpack_from(self.recv_length_formats[received], self.recv_headers)
+        # the port and IP address of each source, still in network byte order
+        names = struct.unpack_from(self.recv_name_formats[received], self.recv_addresses)
+        data = self.recv_data
+        bufsize = self.bufsize
+        address_cache = self.address_cache
+        packets = []
+        offset = 0
+        for length, key in zip(lengths, names):
+            address = address_cache.get(key)
+            if address is None:
+                address = (socket.inet_ntoa(key[2:]), struct.unpack('!H', key[:2])[0])
+                address_cache[key] = address
+            packets.append((data[offset:offset + length], address))
+            offset += bufsize
+        return packets
+
+    # Sends up to max_batch messages with a single sendmmsg() call, and returns how many the kernel took
+    def _sendmmsg(self, batch):
+        # a message too big for the send buffer, and everything after it, is left for the socket methods
+        messages = [message for message, address in batch]
+        lengths = map(len, messages)
+        total = 0
+        for count, length in enumerate(lengths):
+            if total + length > len(self.send_buffer):
+                batch, messages, lengths = batch[:count], messages[:count], lengths[:count]
+                break
+            total += length
+        if not batch:
+            return 0
+
+        # copy the messages (strings or memoryviews) into the send buffer back to back, then point an iovec at
+        # each of them
+        view = self.send_view
+        base = ctypes.addressof(self.send_buffer)
+        iovec_fields = []
+        offset = 0
+        for message, length in zip(messages, lengths):
+            view[offset:offset + length] = message
+            iovec_fields.append(base + offset)
+            iovec_fields.append(length)
+            offset += length
+        struct.pack_into(IOVEC_FORMAT * len(batch), self.send_iovecs, 0, *iovec_fields)
+
+        names = self.send_names
+        for i, (message, address) in enumerate(batch):
+            if names[i] != address:
+                self.send_headers[i].msg_hdr.msg_name = self._get_sockaddr(address)
+                names[i] = address
+
+        sent = _libc.sendmmsg(self.sock.fileno(), self.send_headers, len(batch), 0)
+        return max(sent, 0)
+
+    # Converts an (IP address or hostname, port) pair into the address of a sockaddr_in, caching the result
+    def _get_sockaddr(self, address):
+        name = self.sockaddr_cache.get(address)
+        if name is None:
+            sockaddr = sockaddr_in()
+            sockaddr.sin_family = socket.AF_INET
+            sockaddr.sin_port = socket.htons(address[1])
+            sockaddr.sin_addr = struct.unpack('=I', socket.inet_aton(socket.gethostbyname(address[0])))[0]
+            # The cache keeps the sockaddr_in alive, so its address stays valid
+            self.sockaddr_cache[address] = name = (ctypes.addressof(sockaddr), sockaddr)
+        return name[0]
@@ -0,0 +1,163 @@
+import zlib
+import struct
+import binascii
+
+'''
+A compact binary encoding of BEARS-TP packets, as an alternative to the
+pipe-delimited ASCII one. Every packet starts with a fixed 12-byte header:
+
+    magic     1 byte   0xB7, which no ASCII packet can start with
+    type      1 byte   see TYPES
+    seqno     4 bytes  unsigned, network byte order
+    length    2 bytes  number of data bytes after the header
+    checksum  4 bytes  CRC32 of the rest of the header and the data, or their
+                       Adler-32 if the type has ADLER32_FLAG set and the
+                       packet is a full data packet (see uses_adler32_checksum)
+
+The data of a 'sack' packet is the list of sequence numbers the Receiver holds
+beyond the cumulative ACK, each as a 4-byte unsigned integer. A Receiver that
+advertises a receive window sets WINDOW_FLAG in the type of its ACKs and SACKs,
+and puts the window in front of their data as another 4-byte unsigned integer.
+An ACK that answers a 'codec' packet has CODEC_FLAG set in its type, so that a
+Sender can tell it from the answer to a start packet with the same sequence
+number.
+
+Adler-32 costs about a quarter less than CRC32, but it detects errors poorly
+in short messages, which is why SCTP moved off it (RFC 3309). So even on a
+connection that uses it, only data packets of ADLER32_MIN_LENGTH bytes or more
+are checksummed with Adler-32; ACKs and every other packet keep CRC32, and on
+them the flag only says that the connection uses it. A Sender offers it by
+flagging its start packet, and uses it only if the Receiver's answer is flagged
+too; a Receiver that doesn't know the flag ignores the start packet, as it
+would any unknown type.
+
+split_packet() hands back the data as a memoryview of the packet, so parsing
+copies nothing.
+'''
+
+MAGIC = 0xB7
+HEADER = struct.Struct('!BBIHI')
+HEADER_SIZE = HEADER.size
+# The header up to the checksum, and the checksum on its own
+PREFIX = struct.Struct('!BBIH')
+CHECKSUM = struct.Struct('!I')
+
+TYPES = {'start': 1, 'data': 2, 'end': 3, 'ack': 4, 'sack': 5, 'stripe': 6, 'codec': 7}
+TYPE_NAMES = dict((code, name) for name, code in TYPES.items())
+# Senders that don't know about receive windows don't know the flagged types either, so they ignore such ACKs
+# rather than mistaking the window for a SACK
+WINDOW_FLAG = 0x80
+WINDOW = struct.Struct('!I')
+ADLER32_FLAG = 0x40
+CODEC_FLAG = 0x20
+# the flags that can be set on any type
+TYPE_FLAGS = WINDOW_FLAG | ADLER32_FLAG | CODEC_FLAG
+# Shortest data packet that gets an Adler-32 checksum. Every data packet but the last carries more than 1000 bytes
+ADLER32_MIN_LENGTH = 1000
+
+# Whether a message uses this encoding rather than the ASCII one
+def is_binary(message):
+    return message[:1] == chr(MAGIC)
+
+# Whether a binary message is flagged as part of a connection that uses Adler-32 checksums
+def uses_adler32(message):
+    return bool(ord(message[1:2] or '\0') & ADLER32_FLAG)
+
+# Whether a packet with type code 'code' and 'length' bytes of data is checksummed with Adler-32 rather than CRC32
+def uses_adler32_checksum(code, length):
+    return bool(code & ADLER32_FLAG) and code & ~TYPE_FLAGS == TYPES['data'] and length >= ADLER32_MIN_LENGTH
+
+# The checksum of a packet with type code 'code', over its header prefix and then its data
+def _checksum(code, prefix, data):
+    if uses_adler32_checksum(code, len(data)):
+        # unlike crc32(), adler32() can't read a memoryview
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return zlib.adler32(data, zlib.adler32(prefix)) & 0xffffffff
+    return binascii.crc32(data, binascii.crc32(prefix)) & 0xffffffff
+
+# Returns (packet, checksum), so that a packet can be built again later without computing its checksum again:
+# pass the checksum back in to reuse it. Unknown types (e.g. ones a test has corrupted) are encoded as 0, which
+# no one accepts
+def make_packet_with_checksum(msg_type, seqno, data, checksum=None, adler32=False):
+    code = TYPES.get(msg_type, 0)
+    if adler32:
+        code |= ADLER32_FLAG
+    prefix = PREFIX.pack(MAGIC, code, seqno, len(data))
+    if checksum is None:
+        checksum = _checksum(code, prefix, data)
+    return ''.join((prefix, CHECKSUM.pack(checksum), data)), checksum
+
+def make_packet(msg_type, seqno, data, checksum=None, adler32=False):
+    return make_packet_with_checksum(msg_type, seqno, data, checksum, adler32)[0]
+
+# Writes the header of a packet into the writable buffer 'buf' at 'offset', where 'data', a view of the packet's
+# data, already follows it
+def make_packet_into(buf, offset, msg_type, seqno, data, adler32=False):
+    code = TYPES.get(msg_type, 0)
+    if adler32:
+        code |= ADLER32_FLAG
+    checksum = _checksum(code, PREFIX.pack(MAGIC, code, seqno, len(data)), data)
+    HEADER.pack_into(buf, offset, MAGIC, code, seqno, len(data), checksum)
+
+def make_ack(seqno, sacks=None, window=None, adler32=False, codec=False):
+    if sacks is None:
+        code, data = TYPES['ack'], ''
+    else:
+        code, data = TYPES['sack'], struct.pack('!%dI' % len(sacks), *sacks)
+    if window is not None:
+        code |= WINDOW_FLAG
+        data = WINDOW.pack(window) + data
+    if adler32:
+        code |= ADLER32_FLAG
+    if codec:
+        code |= CODEC_FLAG
+    prefix = PREFIX.pack(MAGIC, code, seqno, len(data))
+    return ''.join((prefix, CHECKSUM.pack(_checksum(code, prefix, data)), data))
+
+# Returns (msg_type, seqno, data, checksum), with data as a memoryview. Raises ValueError if the message is too
+# short to be a packet or its length field doesn't match
+def split_packet(message):
+    if len(message) < HEADER_SIZE:
+        raise ValueError("packet too short")
+    magic, code, seqno, length, checksum = HEADER.unpack_from(message)
+    if magic != MAGIC or len(message) != HEADER_SIZE + length:
+        raise ValueError("malformed packet")
+    return TYPE_NAMES.get(code & ~ADLER32_FLAG), seqno, memoryview(message)[HEADER_SIZE:], checksum
+
+# Returns (msg_type, seqno, sacks, window, codec) for an 'ack' or 'sack', where window is None if the ACK doesn't
+# advertise one and codec is whether it answers a codec packet. Raises ValueError if the message is anything else
+def split_ack(message):
+    if len(message) < HEADER_SIZE:
+        raise ValueError("packet too short")
+    magic, code, seqno, length, checksum = HEADER.unpack_from(message)
+    if magic != MAGIC or len(message) != HEADER_SIZE + length:
+        raise ValueError("malformed packet")
+    offset = HEADER_SIZE
+    window = None
+    if code & WINDOW_FLAG:
+        if length < WINDOW.size:
+            raise ValueError("malformed receive window")
+        window = WINDOW.unpack_from(message, offset)[0]
+        offset += WINDOW.size
+    msg_type = TYPE_NAMES.get(code & ~TYPE_FLAGS)
+    codec = bool(code & CODEC_FLAG)
+    if msg_type == 'ack':
+        return msg_type, seqno, [], window, codec
+    elif msg_type == 'sack':
+        return msg_type, seqno, unpack_sacks(buffer(message, offset)), window, codec
+    raise ValueError("not an ACK")
+
+def validate_checksum(message):
+    try:
+        checksum = CHECKSUM.unpack_from(message, PREFIX.size)[0]
+    except struct.error:
+        return False
+    # the checksum covers the header up to itself, and then the data
+    return _checksum(ord(message[1]), buffer(message, 0, PREFIX.size), buffer(message, HEADER_SIZE)) == checksum
+
+# Returns the sequence numbers carried in the data of a 'sack' packet
+def unpack_sacks(data):
+    if len(data) % 4:
+        raise ValueError("malformed SACK list")
+    return list(struct.unpack('!%dI' % (len(data) // 4), data))
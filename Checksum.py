@@ -1,15 +1,15 @@
 import binascii
 
-# Assumes last field is the checksum!
+# Assumes last field is the checksum! The rest of the message is checksummed where it lies, through a buffer,
+# rather than split off and copied
 def validate_checksum(message):
     try:
-        msg,reported_checksum = message.rsplit('|',1)
-        msg += '|'
-        return generate_checksum(msg) == reported_checksum
+        end = message.rindex('|') + 1
+        return generate_checksum(buffer(message, 0, end)) == message[end:]
     except:
         return False
 
 # Assumes message does NOT contain final checksum field. Message MUST end
-# with a trailing '|' character.
+# with a trailing '|' character. Any string or buffer will do.
 def generate_checksum(message):
     return str(binascii.crc32(message) & 0xffffffff)
@@ -0,0 +1,56 @@
+import bz2
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+'''
+Streaming codecs for compressing the data of a transfer. A Sender that
+compresses starts the connection with a 'codec' packet naming the codec instead
+of a start packet. Every data packet after it carries the next piece of one
+compressed stream, and the Receiver decompresses the data as it delivers it. A
+Receiver that doesn't have the codec ignores the 'codec' packet, like one that
+doesn't know the packet type at all.
+
+zlib and bz2 come with Python. lzma comes with Python 3, and on Python 2 only
+with the backports.lzma package, so it is only offered where it can be imported.
+'''
+
+# <codec name -> (compressor factory taking a level, decompressor factory, highest level)>
+CODECS = {
+    'zlib': (zlib.compressobj, zlib.decompressobj, 9),
+    'bz2': (bz2.BZ2Compressor, bz2.BZ2Decompressor, 9),
+}
+if lzma is not None:
+    CODECS['lzma'] = (lambda level: lzma.LZMACompressor(preset=level), lzma.LZMADecompressor, 9)
+
+DEFAULT_LEVEL = 6
+
+# What a decompressor raises on data that isn't a valid stream
+ERRORS = (zlib.error, IOError, EOFError, ValueError) + ((lzma.LZMAError,) if lzma is not None else ())
+
+# Parses a codec given on the command line, e.g. "zlib" or "zlib:9", into (codec name, level)
+def parse_codec(spec):
+    name, _, level = spec.partition(':')
+    if name not in CODECS:
+        raise ValueError("unknown codec %s, expected one of %s" % (name, ", ".join(sorted(CODECS))))
+    level = int(level) if level else DEFAULT_LEVEL
+    if not 0 <= level <= CODECS[name][2]:
+        raise ValueError("%s levels go from 0 to %d" % (name, CODECS[name][2]))
+    return name, level
+
+# Returns an object whose compress() and flush() compress a stream with codec 'name'
+def make_compressor(name, level=DEFAULT_LEVEL):
+    # bz2 has no level 0
+    if name == 'bz2':
+        level = max(level, 1)
+    return CODECS[name][0](level)
+
+# Returns an object whose decompress() decompresses a stream compressed with codec 'name'
+def make_decompressor(name):
+    return CODECS[name][1]()
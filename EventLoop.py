@@ -0,0 +1,120 @@
+import time
+import heapq
+import select
+
+'''
+A small event loop. It waits for any of a set of files or sockets to become
+readable, or for the earliest of a set of timers to expire, and then calls the
+callbacks of whichever happened, so a caller can react to each kind of event
+independently instead of blocking on one of them at a time.
+
+All of the loop's notion of time comes from a clock object, which has two
+methods:
+
+    now()                   the current time in seconds
+    wait(readers, timeout)  waits up to 'timeout' seconds (forever if None) for
+                            any of 'readers' to become readable, and returns the
+                            ones that did
+
+Clock does this with the real time and select(). FakeClock only moves when it
+is told to, so that timer logic can be tested without sleeping.
+'''
+
+class Clock(object):
+    def now(self):
+        return time.time()
+
+    def wait(self, readers, timeout):
+        if not readers:
+            if timeout:
+                time.sleep(timeout)
+            return []
+        return select.select(readers, [], [], timeout)[0]
+
+class FakeClock(object):
+    def __init__(self, start=0.0):
+        self.time = start
+        # readers that wait() reports as readable; tests add and remove them to simulate I/O
+        self.ready = set()
+
+    def now(self):
+        return self.time
+
+    def advance(self, seconds):
+        self.time += seconds
+
+    # Returns at once if anything is readable, and otherwise jumps straight to the end of the timeout
+    def wait(self, readers, timeout):
+        ready = [reader for reader in readers if reader in self.ready]
+        if not ready and timeout is not None:
+            self.time += timeout
+        return ready
+
+
+class Timer(object):
+    __slots__ = ('deadline', 'callback', 'cancelled')
+
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    # Cancelled timers stay in the loop's heap until they reach the top, where they are thrown away
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop(object):
+
+    def __init__(self, clock=None):
+        self.clock = clock or Clock()
+        # <file or socket -> callback>
+        self.readers = {}
+        # Heap of (deadline, sequence number, Timer). The sequence number keeps timers with the same deadline in
+        # the order they were scheduled
+        self.timers = []
+        self.timers_scheduled = 0
+
+    def add_reader(self, fileobj, callback):
+        self.readers[fileobj] = callback
+
+    def remove_reader(self, fileobj):
+        self.readers.pop(fileobj, None)
+
+    # Calls 'callback' once the clock reaches 'deadline', and returns a Timer that can cancel it
+    def call_at(self, deadline, callback):
+        timer = Timer(deadline, callback)
+        heapq.heappush(self.timers, (deadline, self.timers_scheduled, timer))
+        self.timers_scheduled += 1
+        return timer
+
+    def call_later(self, delay, callback):
+        return self.call_at(self.clock.now() + delay, callback)
+
+    # Returns the deadline of the earliest timer that hasn't been cancelled, or None if there isn't one
+    def get_next_deadline(self):
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        if self.timers:
+            return self.timers[0][0]
+        return None
+
+    # Waits for the next batch of events and calls their callbacks: first those of every reader that became
+    # readable, then those of every timer that has expired
+    def run_once(self):
+        deadline = self.get_next_deadline()
+        timeout = None
+        if deadline is not None:
+            timeout = max(deadline - self.clock.now(), 0)
+
+        for fileobj in self.clock.wait(self.readers.keys(), timeout):
+            # an earlier callback may have removed this reader
+            callback = self.readers.get(fileobj)
+            if callback is not None:
+                callback()
+
+        now = self.clock.now()
+        while self.timers and self.timers[0][0] <= now:
+            deadline, _, timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                timer.callback()
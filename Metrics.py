@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import bisect
+import socket
+
+'''
+Counters, gauges and histograms that the Sender and Receiver keep as they run,
+so that we can tell from outside why a transfer is slow.
+
+Updating a metric is an attribute increment or, for a histogram, a bisect
+into a short list, so they can sit on the per-packet paths. Gauges can also
+be given a function, which is only called when the metrics are read, so that
+values like how full the window is cost nothing until then.
+
+A Reporter writes snapshots of the metrics as JSON, one object per line, to a
+file, or as one datagram each to a UDP or Unix socket:
+
+    /var/log/sender.metrics     appends to a file
+    udp:HOST:PORT               sends to a UDP socket
+    unix:/path/to/socket        sends to a Unix datagram socket
+
+A Reporter never lets a failure to report get in the way of a transfer: if
+nothing is listening on the socket, or the file can't be written, the snapshot
+is simply lost.
+'''
+
+class Counter(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return self.value
+
+class Gauge(object):
+    __slots__ = ('value', 'fn')
+
+    # With 'fn', the gauge's value is whatever fn() returns when it is read
+    def __init__(self, fn=None):
+        self.value = None
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        if self.fn is not None:
+            return self.fn()
+        return self.value
+
+# Bucket bounds for histograms of times, in seconds: from 0.1ms up to about 6.5s, each twice the last
+TIME_BOUNDS = [0.0001 * 2 ** i for i in xrange(17)]
+
+'''
+Counts observations in buckets. Bucket i counts the values up to bounds[i] and
+above bounds[i - 1], and a last bucket counts everything above the highest
+bound. We also keep the count, sum, minimum and maximum of the values.
+'''
+class Histogram(object):
+    __slots__ = ('bounds', 'buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self, bounds=TIME_BOUNDS):
+        self.bounds = sorted(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            # [[upper bound, count], ...], leaving out empty buckets; the last bound is None, for no bound
+            "buckets": [[bound, n] for bound, n in zip(self.bounds + [None], self.buckets) if n],
+        }
+
+# A named set of metrics. Asking for a metric that already exists returns it, so that several parts of the code
+# can share one
+class Registry(object):
+
+    def __init__(self):
+        # <name -> metric>
+        self.metrics = {}
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+    def gauge(self, name, fn=None):
+        return self._get(name, lambda: Gauge(fn))
+
+    def histogram(self, name, bounds=TIME_BOUNDS):
+        return self._get(name, lambda: Histogram(bounds))
+
+    def _get(self, name, factory):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = factory()
+        return metric
+
+    # Returns the current value of every metric, as a dictionary that json can encode
+    def snapshot(self):
+        return dict((name, metric.snapshot()) for name, metric in self.metrics.iteritems())
+
+
+class Reporter(object):
+    # Default number of seconds between reports
+    INTERVAL = 1.0
+
+    def __init__(self, target, source, interval=INTERVAL):
+        self.source = source # what is reporting, e.g. "sender"
+        self.interval = interval
+        self.outfile = None
+        self.sock = None
+        self.address = None
+        if target.startswith("udp:"):
+            host, _, port = target[4:].rpartition(':')
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.address = (host, int(port))
+        elif target.startswith("unix:"):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.address = target[5:]
+        else:
+            self.outfile = open(target, "a")
+        if self.sock is not None:
+            self.sock.setblocking(0)
+
+    # Writes out one snapshot of 'metrics', a dictionary such as Registry.snapshot() returns
+    def report(self, metrics):
+        line = json.dumps({"time": time.time(), "source": self.source, "pid": os.getpid(), "metrics": metrics},
+                          sort_keys=True)
+        if self.outfile is not None:
+            try:
+                self.outfile.write(line + "\n")
+                self.outfile.flush()
+            except IOError:
+                pass # e.g. the disk is full
+            return
+        try:
+            self.sock.sendto(line, self.address)
+        except socket.error:
+            pass # nobody is listening, or they can't keep up
+
+    def close(self):
+        if self.outfile is not None:
+            self.outfile.close()
+        if self.sock is not None:
+            self.sock.close()
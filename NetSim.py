@@ -0,0 +1,381 @@
+#!/usr/bin/python
+import os
+import sys
+import time
+import heapq
+import random
+import collections
+
+import Compression
+import Receiver
+import Sender
+import TestHarness
+from tests import BasicTest
+
+'''
+A discrete-event network simulator that runs the TestHarness test cases in a
+single process, against virtual time.
+
+The Sender and Receiver run in this process, and instead of UDP sockets they
+each get an Endpoint, which hands what they send to a simulated Link. Every
+Link has a bandwidth, a propagation delay and a drop-tail queue, and the links
+meet at a simulated forwarder, which calls the test case's handle_packet() and
+handle_tick() hooks exactly like TestHarness.Forwarder does, so the same test
+cases run unchanged on either.
+
+All time comes from a SimClock, which the Sender's event loop uses as its
+clock. Whenever the Sender waits for something to happen, the clock runs the
+simulated events in order up to the moment something does, jumping straight
+over the time in between. Nothing ever sleeps, so a transfer that would take
+seconds of real time takes as long as the code takes to run, and a run is
+reproducible from its random seed.
+'''
+
+class SimulationTimeout(Exception):
+    pass
+
+# A simulated clock and the queue of events that make simulated time pass. It has the interface of an EventLoop
+# clock (see EventLoop), so a Sender can run on it directly
+class SimClock(object):
+
+    def __init__(self, limit=None):
+        self.time = 0.0
+        # Heap of (time, sequence number, callback). The sequence number keeps events at the same time in the
+        # order they were scheduled
+        self.events = []
+        self.events_scheduled = 0
+        # Simulated time after which we give up on the simulation
+        self.limit = limit
+
+    def now(self):
+        return self.time
+
+    def call_at(self, when, callback):
+        heapq.heappush(self.events, (when, self.events_scheduled, callback))
+        self.events_scheduled += 1
+
+    def call_later(self, delay, callback):
+        self.call_at(self.time + delay, callback)
+
+    # Runs events until one of 'readers' is readable or 'timeout' seconds have passed, and returns the readers
+    # that are readable. Endpoints are readable once something has arrived at them; anything else, like the
+    # Sender's input file, always is
+    def wait(self, readers, timeout):
+        deadline = None if timeout is None else self.time + timeout
+        while True:
+            ready = [reader for reader in readers if not isinstance(reader, Endpoint) or reader.readable()]
+            if ready:
+                return ready
+            if not self.events or (deadline is not None and self.events[0][0] > deadline):
+                if deadline is None:
+                    raise SimulationTimeout("nothing left to happen at %.3f s" % self.time)
+                self.time = max(self.time, deadline)
+                return []
+            when, _, callback = heapq.heappop(self.events)
+            self.time = max(self.time, when)
+            if self.limit is not None and self.time > self.limit:
+                raise SimulationTimeout("still running after %.3f s" % self.limit)
+            callback()
+
+
+'''
+A one-way link. Packets are sent one after the other at 'bandwidth' bytes per
+second, and each arrives 'delay' seconds after it has been sent. A packet that
+finds 'queue_size' packets waiting to be sent, or being sent, is dropped.
+'''
+class Link(object):
+
+    def __init__(self, clock, bandwidth, delay, queue_size, deliver):
+        self.clock = clock
+        self.bandwidth = float(bandwidth)
+        self.delay = delay
+        self.queue_size = queue_size
+        self.deliver = deliver
+        # when each packet in the queue will have been sent
+        self.finish_times = collections.deque()
+        self.dropped = 0
+
+    def send(self, message):
+        now = self.clock.now()
+        while self.finish_times and self.finish_times[0] <= now:
+            self.finish_times.popleft()
+        if len(self.finish_times) >= self.queue_size:
+            self.dropped += 1
+            return
+        start = self.finish_times[-1] if self.finish_times else now
+        finish = start + len(message) / self.bandwidth
+        self.finish_times.append(finish)
+        self.clock.call_at(finish + self.delay, lambda: self.deliver(message))
+
+
+# Stands in for the UDP socket of a Sender or Receiver, and for the BatchIO on top of it. Everything sent goes over
+# 'link', whatever address it is sent to. What arrives is either queued for recvmany(), or if there is an
+# 'on_receive' callback, handed straight to it
+class Endpoint(object):
+
+    def __init__(self, address, on_receive=None):
+        self.address = address
+        self.link = None
+        self.on_receive = on_receive
+        self.arrived = []
+
+    def readable(self):
+        return bool(self.arrived)
+
+    def getsockname(self):
+        return self.address
+
+    def sendto(self, message, address):
+        # packets built in place are memoryviews of a buffer that gets reused, so we send a copy
+        if not isinstance(message, str):
+            message = memoryview(message).tobytes()
+        self.link.send(message)
+
+    def sendmany(self, packets):
+        for message, address in packets:
+            self.sendto(message, address)
+
+    def recvmany(self):
+        arrived = self.arrived
+        self.arrived = []
+        return arrived
+
+    def deliver(self, message, source):
+        if self.on_receive is not None:
+            self.on_receive(message, source)
+        else:
+            self.arrived.append((message, source))
+
+    def close(self):
+        pass
+
+
+'''
+Runs test cases like TestHarness.Forwarder does, but on the simulated network.
+The sender and the receiver are each connected to the forwarder by a link in
+each direction, all of them alike.
+'''
+class Simulator(object):
+
+    def __init__(self, port=33125, seed=0, bandwidth=12500000, delay=0.005, queue_size=100, debug=False):
+        # [(test object1, input file1), (test object2, input file2), ...]
+        self.tests = []
+        self.current_test = None
+        self.in_queue = []
+        self.out_queue = []
+        # [(test object, input file, whether it passed, its TransferStats), ...]
+        self.test_results = []
+        self.stats = None
+        self.tick_interval = 0.001 # 1ms
+        self.timeout = 300. # simulated seconds
+        self.seed = seed
+        self.bandwidth = bandwidth
+        self.delay = delay
+        self.queue_size = queue_size
+        self.debug = debug
+        self.clock = None
+
+        # The addresses the Receiver and Sender see each other at. As with the forwarder, the Receiver names its
+        # output file after the address it sees the Sender at
+        self.port = port
+        self.sender_addr = ('127.0.0.1', port)
+        self.receiver_addr = ('127.0.0.1', port + 1)
+
+    def now(self):
+        return self.clock.now()
+
+    # Sends a packet 'delay' seconds from now. Unlike the forwarder, we don't have to wait for a tick to send it
+    def send_later(self, packet, delay):
+        self.clock.call_later(delay, lambda: self._send(packet))
+
+    def register_test(self, testcase, input_file):
+        assert isinstance(testcase, BasicTest.BasicTest)
+        self.tests.append((testcase, input_file))
+
+    def execute_tests(self):
+        for (t, input_file) in self.tests:
+            self.current_test = t
+            print "Now running '%s'..." % self.current_test.__class__.__name__
+            start = time.time()
+            try:
+                passed = self.start(input_file)
+            except (KeyboardInterrupt, SystemExit):
+                exit()
+            except Exception, e:
+                print "Test fail: %s" % e
+                passed = False
+            self.test_results.append((t, input_file, passed, self.stats))
+            print "(%.2f s simulated in %.2f s)" % (self.clock.now(), time.time() - start)
+
+    # Called when a packet reaches the forwarder from 'source', the address of the sender or the receiver. Like the
+    # forwarder, we learn the sequence number base from the sender's first packet, and ignore everything before it
+    def handle_receive(self, message, source):
+        if self.start_seqno_base is None:
+            if source != self.sender_addr:
+                return
+            start_packet = TestHarness.Packet(message, (None, None), 0, self.current_test.sackMode)
+            if start_packet.bogon:
+                return
+            self.start_seqno_base = start_packet.seqno
+
+        if source == self.sender_addr:
+            destination = self.receiver_addr
+        else:
+            destination = self.sender_addr
+        p = TestHarness.Packet(message, destination, self.start_seqno_base, self.current_test.sackMode)
+        if source == self.sender_addr:
+            self.stats.count_from_sender(p)
+        self.in_queue.append(p)
+        self.current_test.handle_packet()
+
+    # Every tick, we call the tick handler for the current test, then send everything in the out_queue
+    def _tick(self):
+        self.current_test.handle_tick(self.tick_interval)
+        for p in self.out_queue:
+            self._send(p)
+        self.out_queue = []
+
+    def _send(self, packet):
+        packet.update_packet(seqno=packet.seqno + self.start_seqno_base, update_checksum=False)
+        if packet.address == self.sender_addr:
+            self.stats.count_to_sender(packet)
+        self.links[packet.address].send(packet.full_packet)
+
+    def _tick_periodically(self):
+        self._tick()
+        self.clock.call_later(self.tick_interval, self._tick_periodically)
+
+    def _make_link(self, deliver):
+        return Link(self.clock, self.bandwidth, self.delay, self.queue_size, deliver)
+
+    def start(self, input_file):
+        test = self.current_test
+        random.seed(self.seed)
+        self.clock = SimClock(self.timeout)
+        self.in_queue = []
+        self.out_queue = []
+        self.start_seqno_base = None
+        self.stats = TestHarness.TransferStats()
+        recv_outfile = "127.0.0.1.%d" % self.port
+        if os.path.exists(recv_outfile):
+            os.remove(recv_outfile)
+
+        # The Receiver handles every packet as soon as it arrives, and its ACKs go out straight away
+        receiver = Receiver.Receiver(0, self.debug, sackMode=test.sackMode, binaryMode=test.binaryMode,
+                                     window=test.receiveWindow)
+        receiver.s.close()
+        def receive(message, source):
+            receiver._handle_message(message, source)
+            receiver.flush()
+        receiver_end = Endpoint(self.receiver_addr, receive)
+        receiver.io = receiver_end
+
+        compression, compression_level = None, Compression.DEFAULT_LEVEL
+        if test.compression:
+            compression, compression_level = Compression.parse_codec(test.compression)
+        sender = Sender.Sender(self.receiver_addr[0], self.receiver_addr[1], input_file, self.debug, test.sackMode,
+                               clock=self.clock, binaryMode=test.binaryMode, maxRate=test.maxRate,
+                               compression=compression, compressionLevel=compression_level)
+        sender.sock.close()
+        sender_end = Endpoint(self.sender_addr)
+        sender.sock = sender.io = sender_end
+
+        sender_end.link = self._make_link(lambda message: self.handle_receive(message, self.sender_addr))
+        receiver_end.link = self._make_link(lambda message: self.handle_receive(message, self.receiver_addr))
+        self.links = {
+            self.sender_addr: self._make_link(lambda message: sender_end.deliver(message, self.receiver_addr)),
+            self.receiver_addr: self._make_link(lambda message: receiver_end.deliver(message, self.sender_addr)),
+        }
+
+        self.clock.call_later(self.tick_interval, self._tick_periodically)
+        try:
+            sender.start()
+            self.stats.elapsed = self.clock.now()
+            self._tick()
+        finally:
+            sender.infile.close()
+            receiver._flush_writes()
+            for conn in receiver.connections.values():
+                conn.end()
+
+        if not os.path.exists(recv_outfile):
+            raise RuntimeError("No data received by receiver!")
+        try:
+            return test.result(recv_outfile)
+        finally:
+            os.remove(recv_outfile)
+
+if __name__ == "__main__":
+    import getopt
+
+    def usage():
+        print "Simulated network test harness for BEARS-TP"
+        print "-s SEED | --seed=SEED Random seed, defaults to 0"
+        print "-b BANDWIDTH | --bandwidth=BANDWIDTH Bandwidth of each link in bytes per second, defaults to 12500000"
+        print "-l DELAY | --delay=DELAY Propagation delay of each link in seconds, defaults to 0.005"
+        print "-q PACKETS | --queue=PACKETS Queue size of each link in packets, defaults to 100"
+        print "-t TEST | --test=TEST Only run the test cases of this class"
+        print "-d | --debug Enable debug mode"
+        print "-B | --benchmark Run the TestHarness benchmarks instead of the tests, timing them in simulated time"
+        print "-j FILE | --json=FILE Write the benchmark results to FILE as JSON"
+        print "-c FILE | --csv=FILE Write the benchmark results to FILE as CSV"
+        print "-x FILE | --baseline=FILE Compare the benchmark results to the JSON results in FILE"
+        print "--tolerance=FRACTION How much slower than the baseline a benchmark may get, defaults to 0.25"
+        print "-h | --help Print this usage message"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "s:b:l:q:t:dBj:c:x:h",
+                                   ["seed=", "bandwidth=", "delay=", "queue=", "test=", "debug", "benchmark", "json=",
+                                    "csv=", "baseline=", "tolerance=", "help"])
+    except getopt.GetoptError:
+        usage()
+        exit()
+
+    seed = 0
+    bandwidth = 12500000
+    delay = 0.005
+    queue_size = 100
+    only = None
+    debug = False
+    benchmark = False
+    json_file = None
+    csv_file = None
+    baseline_file = None
+    tolerance = 0.25
+
+    for o,a in opts:
+        if o in ("-s", "--seed"):
+            seed = int(a)
+        elif o in ("-b", "--bandwidth"):
+            bandwidth = float(a)
+        elif o in ("-l", "--delay"):
+            delay = float(a)
+        elif o in ("-q", "--queue"):
+            queue_size = int(a)
+        elif o in ("-t", "--test"):
+            only = a
+        elif o in ("-d", "--debug"):
+            debug = True
+        elif o in ("-B", "--benchmark"):
+            benchmark = True
+        elif o in ("-j", "--json"):
+            json_file = a
+        elif o in ("-c", "--csv"):
+            csv_file = a
+        elif o in ("-x", "--baseline"):
+            baseline_file = a
+        elif o == "--tolerance":
+            tolerance = float(a)
+        else:
+            usage()
+            exit()
+
+    sim = Simulator(seed=seed, bandwidth=bandwidth, delay=delay, queue_size=queue_size, debug=debug)
+    if benchmark:
+        # Every run of a simulated benchmark is the same, so one is enough
+        regressions = TestHarness.run_benchmarks(sim, 1, json_file, csv_file, baseline_file, tolerance)
+        sys.exit(1 if regressions else 0)
+    TestHarness.tests_to_run(sim)
+    if only is not None:
+        sim.tests = [(t, input_file) for (t, input_file) in sim.tests if t.__class__.__name__ == only]
+    sim.execute_tests()
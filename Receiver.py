@@ -1,155 +1,468 @@
+import os
+import bisect
+import signal
 import socket
 import getopt
 import sys
 import time
+import ctypes
+import ctypes.util
 
 import Checksum
+import BatchIO
+import BinaryPacket
+import Compression
+import Metrics
+import Trace
+
+'''
+Holds the packets that arrive ahead of the next one we expect, until the gap
+before them fills. Packet 'seqno' lives in slot seqno % capacity of a ring
+buffer, so delivering the next run of packets costs O(packets delivered)
+rather than a sort of everything we hold on every packet. The sequence numbers
+we hold are also kept in a sorted list, updated as packets come and go, which
+is the SACK list as it stands.
+'''
+class ReassemblyBuffer(object):
+    def __init__(self, next_seqno, capacity):
+        self.next_seqno = next_seqno # the sequence number we are waiting for
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.held = [] # sequence numbers of the packets in the slots, in ascending order
+
+    # Stores the data of a packet, and then removes and returns the data of the run of packets starting at
+    # next_seqno, in order. Returns None, and stores nothing, if the packet doesn't fit in the buffer: anything
+    # before next_seqno was already delivered. A duplicate replaces the copy we hold
+    def add(self, seqno, data):
+        next_seqno = self.next_seqno
+        if not next_seqno <= seqno < next_seqno + self.capacity:
+            return None
+        slots = self.slots
+        capacity = self.capacity
+        index = seqno % capacity
+        if seqno != next_seqno:
+            if slots[index] is None:
+                bisect.insort(self.held, seqno)
+            slots[index] = data
+            return []
+
+        # this packet fills the gap, so it and the run we hold behind it go out
+        delivered = [data]
+        index = (index + 1) % capacity
+        while slots[index] is not None:
+            delivered.append(slots[index])
+            slots[index] = None
+            index = (index + 1) % capacity
+        self.next_seqno += len(delivered)
+        # the rest of the run was always at the front of the list
+        if len(delivered) > 1:
+            del self.held[:len(delivered) - 1]
+        return delivered
+
+    # Returns the sequence numbers of the packets we hold beyond next_seqno, in ascending order. The list
+    # belongs to the buffer and changes with it
+    def get_sacks(self):
+        return self.held
 
 class Connection():
-    def __init__(self,host,port,start_seq,debug=False):
+    WRITE_BUFFER_SIZE = 256 * 1024
+
+    def __init__(self,host,port,start_seq,debug=False,binary=False,window=None,stripe=None,adler32=False,
+                 codec=None,tracer=None):
         self.debug = debug
+        self.tracer = tracer # the Receiver's Tracer, if it traces
+        self.binary = binary # whether this connection uses the binary packet format
+        self.adler32 = adler32 # whether its full binary data packets use Adler-32 checksums rather than CRC32
         self.updated = time.time()
-        self.current_seqno = start_seq - 1 # expect to ack from the start_seqno
         self.host = host
         self.port = port
-        self.max_buf_size = 5
-        self.outfile = open("%s.%d" % (host,port),"w")
-        self.seqnums = {} # enforce single instance of each seqno
+        self.window = window # receive window to advertise, if any
+        self.max_buf_size = window or 5
+        self.buffer = ReassemblyBuffer(start_seq, self.max_buf_size) # expect to ack from the start_seqno
+        self.end_seqno = None # sequence number of the end packet, once we have seen it
+        # Delivered data is written behind: the file's own buffer gathers it into writes of up to
+        # WRITE_BUFFER_SIZE bytes, and the Receiver flushes whatever is left when the connection goes quiet
+        # or ends
+        if stripe is None:
+            self.filename = "%s.%d" % (host,port)
+            self.outfile = open(self.filename,"wb",self.WRITE_BUFFER_SIZE)
+        else:
+            # One of several connections that send a file in parallel, each writing its own range of it. The
+            # file is named after the transfer rather than this connection. Each of them cuts it to the size of
+            # the whole file, which drops whatever an older, longer file left at its end, but never what the
+            # others have written
+            transfer_id, offset, size = stripe
+            self.filename = "%s.%d" % (host,transfer_id)
+            fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT, 0666)
+            os.ftruncate(fd, size)
+            self.outfile = os.fdopen(fd,"wb",self.WRITE_BUFFER_SIZE)
+            self.outfile.seek(offset)
+        self.unflushed = False
+        # decompresses the data of a compressed transfer as it is delivered
+        self.codec = codec
+        self.decompressor = Compression.make_decompressor(codec) if codec is not None else None
+
+        self.metrics = Metrics.Registry()
+        self.packets_received = self.metrics.counter("packets_received")
+        self.packets_delivered = self.metrics.counter("packets_delivered")
+        self.bytes_delivered = self.metrics.counter("bytes_delivered")
+        self.duplicates = self.metrics.counter("duplicates")
+        self.out_of_window_drops = self.metrics.counter("out_of_window_drops")
+        self.packet_interarrival = self.metrics.histogram("packet_interarrival")
+        self.metrics.gauge("packets_buffered", lambda: len(self.buffer.held))
+        self.metrics.gauge("next_seqno", lambda: self.buffer.next_seqno)
 
     def ack(self,seqno, data, sackMode = False):
         res_data = []
         sacks = []
-        self.updated = time.time()
-        if seqno > self.current_seqno and seqno <= self.current_seqno + self.max_buf_size:
-            self.seqnums[seqno] = data
-            for n in sorted(self.seqnums.keys()):
-                if n == self.current_seqno + 1:
-                    self.current_seqno += 1
-                    res_data.append(self.seqnums[n])
-                    del self.seqnums[n]
-                else:
-                    if sackMode:
-                        sacks.append(n)
-                    else:
-                        break # when we find out of order seqno, quit and move on
+        now = time.time()
+        self.packets_received.inc()
+        self.packet_interarrival.observe(now - self.updated)
+        self.updated = now
+        delivered = self.buffer.add(seqno, data)
+        # packets outside the buffer are acked without a SACK list, as they always have been
+        if delivered is not None:
+            res_data = delivered
+            self.packets_delivered.inc(len(delivered))
+            if sackMode:
+                sacks = self.buffer.get_sacks()
+        elif seqno < self.buffer.next_seqno:
+            self.duplicates.inc()
+        else:
+            self.out_of_window_drops.inc()
 
-        if self.debug:
-            print "Receiver.py:next seqno should be %d" % (self.current_seqno+1)
+        if self.tracer:
+            held = len(self.buffer.held)
+            self.tracer.record(now, Trace.RECEIVE if delivered is not None else Trace.DROP, seqno, held)
+            self.tracer.record(now, Trace.ACK, self.buffer.next_seqno, held)
 
         # note: we return the /next/ sequence number we're expecting
         if sackMode:
-            return "%s;%s" % (self.current_seqno+1, ','.join(map(str, sacks))), res_data
+            return "%s;%s" % (self.buffer.next_seqno, ','.join(map(str, sacks))), res_data
         else:
-            return str(self.current_seqno+1), res_data
+            return str(self.buffer.next_seqno), res_data
+
 
+    # Returns the receive window to advertise in our ACKs, or None if we don't advertise one. We hand every
+    # in-order packet straight to the file, so each slot from the next sequence number on is either free or
+    # holds a packet beyond a gap, and we accept anything up to the ACK plus our whole buffer
+    def get_receive_window(self):
+        if self.window is None:
+            return None
+        return self.buffer.capacity
 
     def record(self,data):
+        # The end packet carries no data, and once a bz2 stream has ended its decompressor won't take even that
+        if self.decompressor is not None and len(data):
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            data = self.decompressor.decompress(data)
         self.outfile.write(data)
-        self.outfile.flush()
+        self.bytes_delivered.inc(len(data))
+        self.unflushed = True
+
+    # writes out any data still in the file's buffer
+    def flush(self):
+        if self.unflushed:
+            self.outfile.flush()
+            self.unflushed = False
+
+    # whether everything up to and including the end packet has been delivered
+    def is_finished(self):
+        return self.end_seqno is not None and self.buffer.next_seqno > self.end_seqno
 
     def end(self):
         self.outfile.close()
 
+# Linux has had SO_REUSEPORT since 3.9, even where the socket module doesn't name it
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15 if sys.platform.startswith('linux') else None)
+PR_SET_PDEATHSIG = 1
+
 class Receiver():
-    def __init__(self,listenport=33122,debug=False,timeout=10, sackMode=False):
+    # longest we leave delivered data in a connection's write buffer, in seconds
+    WRITE_DELAY = 0.2
+
+    def __init__(self,listenport=33122,debug=False,timeout=10, sackMode=False, binaryMode=False, window=None,
+                 reusePort=False, metrics=None, metricsInterval=Metrics.Reporter.INTERVAL, trace=None):
         self.debug = debug
+        self.window = window # receive window in packets; None keeps the old 5-packet buffer and advertises nothing
         self.timeout = timeout
         self.sackMode = sackMode
+        self.binaryMode = binaryMode # accept senders that offer the binary packet format
         self.last_cleanup = time.time()
+        self.last_write_flush = time.time()
         self.port = listenport
         self.host = ''
         self.s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.s.settimeout(timeout)
+        if reusePort:
+            # lets several receivers bind the same port; see run_workers()
+            self.s.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        # wake up often enough to flush written-behind data once the connections go quiet
+        self.s.settimeout(min(timeout, self.WRITE_DELAY))
         self.s.bind((self.host,self.port))
+        self.io = BatchIO.BatchIO(self.s)
+        self.send_queue = [] # ACKs waiting for the next flush(), as (message, address) pairs
         self.connections = {} # schema is {(address, port) : Connection}
+        # Metrics for packets that don't belong to a connection; every connection keeps its own. With 'metrics', a
+        # Reporter writes them all out every 'metricsInterval' seconds (see Metrics)
+        self.metrics = Metrics.Registry()
+        self.checksum_failures = self.metrics.counter("checksum_failures")
+        self.packets_ignored = self.metrics.counter("packets_ignored")
+        self.connections_aborted = self.metrics.counter("connections_aborted")
+        self.metrics.gauge("connections", lambda: len(self.connections))
+        self.metrics_target = metrics
+        self.metrics_interval = metricsInterval
+        self.metrics_reporter = None
+        self.last_metrics_report = time.time()
+        # With 'trace', every packet and ACK of every connection goes into a Tracer, which we write out to the file
+        # 'trace' when we stop (see Trace)
+        self.trace_file = trace
+        self.tracer = Trace.Tracer("receiver") if trace else None
         self.MESSAGE_HANDLER = {
             'start' : self._handle_start,
+            'stripe' : self._handle_stripe,
+            'codec' : self._handle_codec,
             'data' : self._handle_data,
             'end' : self._handle_end,
             'ack' : self._handle_ack
         }
 
     def start(self):
+        # The reporter is only opened here, so that every worker has its own
+        if self.metrics_target is not None:
+            self.metrics_reporter = Metrics.Reporter(self.metrics_target, "receiver", self.metrics_interval)
         while True:
             try:
-                message, address = self.receive()
-                msg_type, seqno, data, checksum = self._split_message(message)
-                try:
-                    seqno = int(seqno)
-                except:
-                    raise ValueError
-                if debug:
-                    print "Receiver.py: received %s|%d|%s|%s" % (msg_type, seqno, data[:5], checksum)
-                if Checksum.validate_checksum(message):
-                    self.MESSAGE_HANDLER.get(msg_type,self._handle_other)(seqno, data, address)
-                elif self.debug:
-                    print "Receiver.py: checksum failed: %s|%d|%s|%s" % (msg_type, seqno, data[:5], checksum)
-
-                if time.time() - self.last_cleanup > self.timeout:
+                for message, address in self.receive_batch():
+                    self._handle_message(message, address)
+                # send all the ACKs for this batch at once
+                self.flush()
+
+                now = time.time()
+                if now - self.last_write_flush > self.WRITE_DELAY:
+                    self._flush_writes()
+                if now - self.last_cleanup > self.timeout:
                     self._cleanup()
             except socket.timeout:
-                self._cleanup()
+                self._flush_writes()
+                now = time.time()
+                if now - self.last_cleanup > self.timeout:
+                    self._cleanup()
             except (KeyboardInterrupt, SystemExit):
+                self._flush_writes()
+                if self.metrics_reporter is not None:
+                    self._report_metrics()
+                if self.tracer is not None:
+                    self.tracer.dump(self.trace_file)
                 exit()
-            except ValueError, e:
-                if self.debug:
-                    print "Receiver.py:" + str(e)
-                pass # ignore
+            if self.metrics_reporter is not None and now - self.last_metrics_report > self.metrics_interval:
+                self._report_metrics()
+
+    # Returns our own metrics and those of every connection, keyed by its "host:port"
+    def get_metrics(self):
+        return {
+            "receiver": self.metrics.snapshot(),
+            "connections": dict(("%s:%d" % address, conn.metrics.snapshot())
+                                for address, conn in self.connections.iteritems()),
+        }
+
+    def _report_metrics(self):
+        self.metrics_reporter.report(self.get_metrics())
+        self.last_metrics_report = time.time()
+
+    def _handle_message(self, message, address):
+        if self.binaryMode and BinaryPacket.is_binary(message):
+            self._handle_binary_message(message, address)
+            return
+        try:
+            msg_type, seqno, data, checksum = self._split_message(message)
+            try:
+                seqno = int(seqno)
+            except:
+                raise ValueError
+            if Checksum.validate_checksum(message):
+                self.MESSAGE_HANDLER.get(msg_type,self._handle_other)(seqno, data, address)
+            else:
+                self.checksum_failures.inc()
+                if self.tracer:
+                    self.tracer.record(time.time(), Trace.CORRUPT, max(seqno, 0), None)
+        except ValueError:
+            self.packets_ignored.inc()
+            if self.tracer:
+                self.tracer.record(time.time(), Trace.CORRUPT, 0, None)
+
+    # A sender that offers the binary format does so with its start packet. We answer it in the same format,
+    # which is what tells the sender that we accepted
+    def _handle_binary_message(self, message, address):
+        if not BinaryPacket.validate_checksum(message):
+            self.checksum_failures.inc()
+            if self.tracer:
+                self.tracer.record(time.time(), Trace.CORRUPT, 0, None)
+            return
+        try:
+            msg_type, seqno, data, checksum = BinaryPacket.split_packet(message)
+        except ValueError:
+            self.packets_ignored.inc()
+            if self.tracer:
+                self.tracer.record(time.time(), Trace.CORRUPT, 0, None)
+            return
+        if msg_type == 'start':
+            self._handle_start(seqno, data, address, binary=True, adler32=BinaryPacket.uses_adler32(message))
+        elif msg_type == 'stripe':
+            self._handle_stripe(seqno, data, address, binary=True, adler32=BinaryPacket.uses_adler32(message))
+        elif msg_type == 'codec':
+            self._handle_codec(seqno, data, address, binary=True, adler32=BinaryPacket.uses_adler32(message))
+        elif address in self.connections and self.connections[address].binary:
+            self.MESSAGE_HANDLER.get(msg_type,self._handle_other)(seqno, data, address)
 
     # waits until packet is received to return
     def receive(self):
         return self.s.recvfrom(4096)
 
+    # waits until a packet is received, then returns it along with every other packet already queued on
+    # the socket, as a list of (message, address) pairs
+    def receive_batch(self):
+        return [self.receive()] + self.io.recvmany()
+
     # sends a message to the specified address. Addresses are in the format:
     #   (IP address, port number)
     def send(self, message, address):
         self.s.sendto(message, address)
 
-    # this sends an ack message to address with specified seqno
-    def _send_ack(self, seqno, address):
+    # queues a message for the specified address, to be sent by the next flush()
+    def enqueue(self, message, address):
+        self.send_queue.append((message, address))
+
+    # sends every queued message
+    def flush(self):
+        if self.send_queue:
+            self.io.sendmany(self.send_queue)
+            self.send_queue = []
+
+    # this sends an ack message to address with specified seqno. An answer to a codec packet names the codec, so
+    # that the Sender can tell it from the answer to a start packet
+    def _send_ack(self, seqno, address, codec=None):
+        conn = self.connections[address]
+        window = conn.get_receive_window()
+        if conn.binary:
+            ackno, _, sacks = seqno.partition(';')
+            if self.sackMode:
+                message = BinaryPacket.make_ack(int(ackno), [int(sack) for sack in sacks.split(',') if sack], window,
+                                                conn.adler32, codec is not None)
+            else:
+                message = BinaryPacket.make_ack(int(ackno), window=window, adler32=conn.adler32,
+                                                codec=codec is not None)
+            self.enqueue(message, address)
+            return
         if self.sackMode:
             m = "sack|%s|" % seqno
         else:
             m = "ack|%s|" % seqno
+        if window is not None or codec is not None:
+            # the window goes in the data field, followed by the codec
+            m += "%s|" % ("" if window is None else window)
+            if codec is not None:
+                m += "%s|" % codec
         checksum = Checksum.generate_checksum(m)
         message = "%s%s" % (m, checksum)
-        if self.debug:
-            print "Receiver.py: send ack %s" % m
-        self.send(message, address)
+        self.enqueue(message, address)
 
-    def _handle_start(self, seqno, data, address):
+    def _handle_start(self, seqno, data, address, binary=False, adler32=False):
         if not address in self.connections:
-            self.connections[address] = Connection(address[0],address[1],seqno,self.debug)
+            self.connections[address] = Connection(address[0],address[1],seqno,self.debug,binary,self.window,
+                                                   adler32=adler32,tracer=self.tracer)
         conn = self.connections[address]
+        # A Sender that never heard us accept its codec packet gives up on the codec and starts over with an
+        # empty start packet, sending nothing else until we answer it, so the file is sent as it is after all
+        if conn.decompressor is not None and conn.buffer.next_seqno == seqno + 1:
+            conn.decompressor = None
+            conn.codec = None
         ackno, res_data = conn.ack(seqno,data,self.sackMode)
-        for l in res_data:
-            #if self.debug:
-            #    print data
-            conn.record(l)
-        self._send_ack(ackno, address)
+        if self._deliver(conn, res_data):
+            self._send_ack(ackno, address)
+
+    # A stripe starts a connection like a start packet does, but carries "transfer id:offset:size" instead of
+    # data: where in which file to write what the connection delivers, and how long the whole file is
+    def _handle_stripe(self, seqno, data, address, binary=False, adler32=False):
+        if not address in self.connections:
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            try:
+                transfer_id, offset, size = [int(field) for field in data.split(':')]
+                if not 0 <= offset <= size:
+                    raise ValueError
+            except ValueError:
+                return # ignore
+            self.connections[address] = Connection(address[0],address[1],seqno,self.debug,binary,self.window,
+                                                   (transfer_id, offset, size), adler32, tracer=self.tracer)
+        conn = self.connections[address]
+        ackno, res_data = conn.ack(seqno,'',self.sackMode)
+        if self._deliver(conn, res_data):
+            self._send_ack(ackno, address)
+
+    # A codec packet starts a connection like a start packet does, but names the codec that the rest of its data
+    # is compressed with instead of carrying data. We ignore codecs we don't have
+    def _handle_codec(self, seqno, data, address, binary=False, adler32=False):
+        if not address in self.connections:
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            if data not in Compression.CODECS:
+                if self.debug:
+                    print "Receiver.py: unknown codec %s" % data
+                return
+            self.connections[address] = Connection(address[0],address[1],seqno,self.debug,binary,self.window,
+                                                   adler32=adler32,codec=data,tracer=self.tracer)
+        conn = self.connections[address]
+        ackno, res_data = conn.ack(seqno,'',self.sackMode)
+        if self._deliver(conn, res_data):
+            self._send_ack(ackno, address, conn.codec)
 
     # ignore packets from uninitiated connections
     def _handle_data(self, seqno, data, address):
         if address in self.connections:
             conn = self.connections[address]
             ackno,res_data = conn.ack(seqno,data,self.sackMode)
-            for l in res_data:
-                #if self.debug:
-                #    print l
-                conn.record(l)
-            self._send_ack(ackno, address)
+            if self._deliver(conn, res_data):
+                self._send_ack(ackno, address)
+        else:
+            self.packets_ignored.inc()
 
     # handle end packets
     def _handle_end(self, seqno, data, address):
         if address in self.connections:
             conn = self.connections[address]
+            conn.end_seqno = seqno
             ackno, res_data = conn.ack(seqno,data,self.sackMode)
+            if self._deliver(conn, res_data):
+                self._send_ack(ackno, address)
+
+    # writes the data a connection delivered in order to its file. Once the end packet has been delivered the
+    # file is complete, so we flush it before acking rather than wait for the connection to go quiet. Returns
+    # false if the connection had to be torn down instead, in which case there is nothing to ack
+    def _deliver(self, conn, res_data):
+        try:
             for l in res_data:
-                #if self.debug:
-                #    print l
                 conn.record(l)
-            self._send_ack(ackno, address)
+        except Compression.ERRORS, e:
+            # The file would be broken, so rather than write the rest of it and ack as if nothing happened, we
+            # drop the connection and what it wrote. The Sender never hears back, and doesn't report success
+            if self.debug:
+                print "Receiver.py: can't decompress from %s:%d: %s" % (conn.host, conn.port, e)
+            self.connections_aborted.inc()
+            conn.end()
+            os.remove(conn.filename)
+            del self.connections[(conn.host, conn.port)]
+            return False
+        if conn.is_finished():
+            conn.flush()
+        return True
+
+    # writes out the data every connection has written behind
+    def _flush_writes(self):
+        for conn in self.connections.values():
+            conn.flush()
+        self.last_write_flush = time.time()
 
     # I'll do the ack-ing here, buddy
     def _handle_ack(self, seqno, data, address):
@@ -179,6 +492,63 @@ class Receiver():
                 del self.connections[address]
         self.last_cleanup = now
 
+'''
+Runs 'workers' receivers in processes of their own, all listening on the same
+port with SO_REUSEPORT. The kernel picks the socket for each datagram by a hash
+of its source address, so every packet of a connection reaches the same worker,
+and independent senders are validated, reassembled and written in parallel.
+
+Every socket is bound before any worker starts, so the hash never changes under
+a connection. The workers exit when this process does, flushing what they have
+written behind.
+'''
+def run_workers(workers, listenport, debug, timeout, sackMode, binaryMode, window, metrics=None,
+                metricsInterval=Metrics.Reporter.INTERVAL, trace=None):
+    if SO_REUSEPORT is None:
+        raise ValueError("running several workers needs SO_REUSEPORT")
+    # every worker writes its own trace, FILE.0, FILE.1, ...
+    receivers = [Receiver(listenport, debug, timeout, sackMode, binaryMode, window, reusePort=True, metrics=metrics,
+                          metricsInterval=metricsInterval, trace="%s.%d" % (trace, i) if trace else None)
+                 for i in xrange(workers)]
+    pids = []
+    for receiver in receivers:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _become_worker(receiver, receivers)
+                receiver.start()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    for receiver in receivers:
+        receiver.s.close()
+
+    # SIGTERM (e.g. from kill) stops us the same way as Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    try:
+        for pid in pids:
+            os.waitpid(pid, 0)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass # already gone
+
+# Sets up a freshly forked worker: it keeps only its own socket, stops cleanly on SIGTERM, and asks the kernel
+# to send it SIGTERM if the process that started it dies
+def _become_worker(receiver, receivers):
+    for other in receivers:
+        if other is not receiver:
+            other.s.close()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    try:
+        ctypes.CDLL(ctypes.util.find_library('c')).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    except (OSError, AttributeError, TypeError):
+        pass # not Linux; the worker outlives a parent that is killed outright
+
 if __name__ == "__main__":
     def usage():
         print "BEARS-TP Receiver"
@@ -187,10 +557,17 @@ if __name__ == "__main__":
         print "-d | --debug Print debug messages"
         print "-h | --help Print this usage message"
         print "-k | --sack Enable selective acknowledgement mode"
+        print "-b | --binary Accept senders that offer the binary packet format"
+        print "-w WINDOW | --window=WINDOW Buffer up to WINDOW packets ahead and advertise it in every ACK"
+        print "-j WORKERS | --workers=WORKERS Spread connections across WORKERS processes, defaults to 1"
+        print "-m TARGET | --metrics=TARGET Report metrics to TARGET: a file, udp:HOST:PORT or unix:PATH"
+        print "--metrics-interval=SECONDS Seconds between metrics reports, defaults to %g" % Metrics.Reporter.INTERVAL
+        print "-T FILE | --trace=FILE Trace every packet and ACK, and write the trace to FILE when stopped (see Trace.py)"
 
     try:
         opts, args = getopt.getopt(sys.argv[1:],
-                               "p:dt:k", ["port=", "debug=", "timeout=", "sack="])
+                               "p:dt:kbw:j:m:T:", ["port=", "debug=", "timeout=", "sack=", "binary", "window=", "workers=",
+                                                    "metrics=", "metrics-interval=", "trace="])
     except:
         usage()
         exit()
@@ -199,6 +576,12 @@ if __name__ == "__main__":
     debug = False
     timeout = 10
     sackMode = False
+    binaryMode = False
+    window = None
+    workers = 1
+    metrics = None
+    metricsInterval = Metrics.Reporter.INTERVAL
+    trace = None
 
     for o,a in opts:
         if o in ("-p", "--port="):
@@ -209,8 +592,32 @@ if __name__ == "__main__":
             debug = True
         elif o in ("-k", "--sack="):
             sackMode = True
+        elif o in ("-b", "--binary"):
+            binaryMode = True
+        elif o in ("-w", "--window"):
+            window = int(a)
+            if window < 1:
+                print usage()
+                exit()
+        elif o in ("-j", "--workers"):
+            workers = int(a)
+            if workers < 1:
+                print usage()
+                exit()
+        elif o in ("-m", "--metrics"):
+            metrics = a
+        elif o == "--metrics-interval":
+            metricsInterval = float(a)
+        elif o in ("-T", "--trace"):
+            trace = a
         else:
             print usage()
             exit()
-    r = Receiver(port, debug, timeout, sackMode)
-    r.start()
+    if workers > 1:
+        run_workers(workers, port, debug, timeout, sackMode, binaryMode, window, metrics, metricsInterval, trace)
+    else:
+        r = Receiver(port, debug, timeout, sackMode, binaryMode, window, metrics=metrics,
+                     metricsInterval=metricsInterval, trace=trace)
+        # SIGTERM (e.g. from kill) stops us the same way as Ctrl-C, so that we still write out what we hold
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+        r.start()
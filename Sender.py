@@ -1,64 +1,512 @@
+import os
 import sys
+import heapq
 import getopt
 
 import Checksum
 import BasicSender
+import BinaryPacket
+import Compression
+import EventLoop
+import Metrics
+import Trace
 
 '''
 This is a skeleton sender class. Create a fantastic transport protocol here.
 '''
 
-class Window(object):
+'''
+Congestion control engines. Each engine owns a congestion window (cwnd), measured
+in packets, and a slow start threshold (ssthresh). The Sender feeds every engine
+the same four signals:
 
-    def __init__(self, window_size):
-        self.seqno_to_packet_map = {}
+1. on_start: the connection is starting
+2. on_ack: a new cumulative ACK arrived and acknowledged 'acked' packets
+3. on_loss: a loss was inferred from duplicate ACKs (fast retransmit)
+4. on_timeout: a retransmission timeout fired
 
-        # Map of <sequence number -> number of ACKs that have been received with this sequence number>
-        # We use this map to determine how to handle duplicate ACKs
-        self.seqno_to_ack_map = {}
-        self.window_size = window_size
+The Window asks the engine for get_window() to decide how many packets may be in flight.
+'''
+class FixedWindow(object):
 
-    # Adds a <sequence number -> packet> pair into map
-    def add_packet_to_map(self, seqno, packet):
-        self.seqno_to_packet_map[seqno] = (packet, False)
+    def __init__(self, initial_window=5, max_window=5):
+        self.cwnd = float(initial_window)
+        self.ssthresh = float(max_window)
+        self.max_window = max_window
 
-    # Removes a <sequence number -> packet> pair from map
-    def remove_seqno_from_packet_map(self, seqno):
-        del self.seqno_to_packet_map[seqno]
+    def on_start(self, now):
+        pass
 
-    # Adds a <sequence number -> number of ACKs> pair into map
-    def add_acks_count_to_map(self, seqno, ack):
-        self.seqno_to_ack_map[seqno] = ack
+    def on_ack(self, acked, now):
+        pass
 
-    # Removes a <sequence number -> number of ACKs> pair from map
-    def remove_seqno_from_ack_map(self, seqno):
-        del self.seqno_to_ack_map[seqno]
+    def on_loss(self, in_flight, now):
+        pass
 
-    # Gets a packet pair associated with a particular sequence number
-    def get_packet_via_seqno(self, seqno):
-        return self.seqno_to_packet_map[seqno][0]
+    def on_timeout(self, in_flight, now):
+        pass
+
+    def in_slow_start(self):
+        return False
+
+    # Returns the number of packets that may be in flight, which is never less than 1
+    def get_window(self):
+        return max(1, min(int(self.cwnd), self.max_window))
+
+
+# Slow start followed by additive-increase/multiplicative-decrease congestion avoidance (i.e. TCP Reno)
+class AIMD(FixedWindow):
+
+    # Multiplicative decrease factor applied to the window on loss
+    BETA = 0.5
+
+    def __init__(self, initial_window=5, max_window=256):
+        super(AIMD, self).__init__(initial_window, max_window)
+
+    def in_slow_start(self):
+        return self.cwnd < self.ssthresh
+
+    def on_ack(self, acked, now):
+        for _ in xrange(acked):
+            if self.in_slow_start():
+                # Slow start: grow by one packet per ACKed packet, doubling cwnd every round trip
+                self.cwnd += 1
+            else:
+                self.congestion_avoidance(now)
+        self.cwnd = min(self.cwnd, float(self.max_window))
+
+    # Additive increase: grow by roughly one packet per round trip
+    def congestion_avoidance(self, now):
+        self.cwnd += 1.0 / self.cwnd
+
+    def on_loss(self, in_flight, now):
+        self.ssthresh = max(in_flight * self.BETA, 2.0)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, in_flight, now):
+        self.ssthresh = max(in_flight * self.BETA, 2.0)
+        self.cwnd = 1.0
+
+
+# CUBIC-style congestion avoidance (RFC 8312): after a loss, the window follows a cubic function of the
+# time elapsed since that loss, plateauing around the window size at which the loss happened. Where that
+# would grow more slowly than AIMD, e.g. on short round trips, the window grows like AIMD instead
+class Cubic(AIMD):
+
+    BETA = 0.7
+    C = 0.4
+    # Additive increase, in packets per round trip, that makes AIMD with our BETA as fair as AIMD with its own
+    ALPHA = 3 * (1 - BETA) / (1 + BETA)
+
+    def __init__(self, initial_window=5, max_window=256):
+        super(Cubic, self).__init__(initial_window, max_window)
+        self.w_max = 0.0
+        self.k = 0.0
+        self.epoch_start = None
+        # The window AIMD would have reached in this epoch
+        self.w_est = 0.0
+
+    def on_start(self, now):
+        self.epoch_start = None
+
+    def congestion_avoidance(self, now):
+        if self.epoch_start is None:
+            # First ACK of a new congestion avoidance epoch
+            self.epoch_start = now
+            if self.cwnd < self.w_max:
+                self.k = ((self.w_max - self.cwnd) / self.C) ** (1.0 / 3)
+            else:
+                self.k = 0.0
+                self.w_max = self.cwnd
+            self.w_est = self.cwnd
+        # Grown per ACK rather than from the time and the RTT, which we don't know here (RFC 9438, 4.3)
+        self.w_est += self.ALPHA / self.cwnd
+        t = now - self.epoch_start
+        target = self.C * (t - self.k) ** 3 + self.w_max
+        if target < self.w_est:
+            # TCP-friendly region: never grow more slowly than AIMD would
+            self.cwnd = max(self.cwnd, self.w_est)
+        elif target > self.cwnd:
+            self.cwnd += (target - self.cwnd) / self.cwnd
+        else:
+            # On the plateau, only probe for more bandwidth, very slowly
+            self.cwnd += 0.01 / self.cwnd
+
+    def on_loss(self, in_flight, now):
+        # Fast convergence: release bandwidth faster if the previous plateau was never reached
+        if self.cwnd < self.w_max:
+            self.w_max = self.cwnd * (1 + self.BETA) / 2
+        else:
+            self.w_max = self.cwnd
+        self.epoch_start = None
+        super(Cubic, self).on_loss(in_flight, now)
+
+    def on_timeout(self, in_flight, now):
+        self.w_max = self.cwnd
+        self.epoch_start = None
+        super(Cubic, self).on_timeout(in_flight, now)
+
+
+# Maps the name given on the command line to a congestion control engine
+CONGESTION_CONTROL = {
+    'fixed': FixedWindow,
+    'aimd': AIMD,
+    'cubic': Cubic,
+}
+
+
+# Estimates the round trip time and derives the retransmission timeout (RTO) from it, as in RFC 6298.
+# Per Karn's rule, callers must only feed samples taken from packets that were never retransmitted.
+class RTTEstimator(object):
+
+    ALPHA = 1.0 / 8
+    BETA = 1.0 / 4
+    K = 4
+
+    # Used before we have any RTT samples; this matches the old fixed 500ms timeout
+    INITIAL_RTO = 0.5
+    # Floor for the RTO. RFC 6298 recommends 1 second, which is far too slow on a LAN
+    MIN_RTO = 0.1
+    # Ceiling for the RTO. RFC 6298 allows 60 seconds, but this has to stay well under the Receiver's
+    # 10 second idle timeout
+    MAX_RTO = 2.0
+    # Ceiling for backing off. The Receiver drops connections that have been idle for 10 seconds, so we
+    # keep around 20 retransmissions within that time; otherwise a run of losses on a lossy path can
+    # starve the Receiver and kill the transfer. We never back off below the measured RTO, though, so
+    # paths with a longer RTT don't retransmit spuriously
+    MAX_BACKOFF_RTO = 0.5
+    # Clock granularity
+    G = 0.001
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = self.INITIAL_RTO
+
+        # Number of times the RTO has been doubled since the ACKs last made forward progress
+        self.backoff = 0
+
+    # Updates SRTT, RTTVAR and the RTO with a new round trip time measurement (in seconds)
+    def add_sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = self.clamp(self.srtt + max(self.G, self.K * self.rttvar))
+
+    # Exponential backoff after a timeout
+    def back_off(self):
+        self.backoff = min(self.backoff + 1, 16)
+
+    # Ends the backoff. We do this whenever an ACK makes forward progress: on a lossy path nearly every
+    # packet ends up retransmitted, so waiting for a Karn-valid sample would leave the RTO backed off indefinitely
+    def reset_backoff(self):
+        self.backoff = 0
 
-    def get_packet_pair_via_seqno(self, seqno):
-        return self.seqno_to_packet_map[seqno]
+    # Returns how long to wait for the ACK of a packet that is being sent right now
+    def get_timeout(self):
+        return max(self.rto, min(self.rto * 2 ** self.backoff, self.MAX_BACKOFF_RTO))
 
-    # Gets the number of ACKs with a particular sequence number
-    def get_ack_number_via_seqno(self, seqno):
-        return self.seqno_to_ack_map[seqno]
+    def clamp(self, rto):
+        return min(max(rto, self.MIN_RTO), self.MAX_RTO)
+
+
+'''
+Token bucket that paces new packets. Rather than sending everything the window has room for back to back as
+soon as an ACK opens it, we only send a new packet when there is a token for it, and tokens accumulate at the
+pacing rate, in packets per second. The rate is 'max_rate', or if 'adaptive', the congestion window spread over
+a little less than the smoothed RTT, capped at 'max_rate'. Until it has a rate (e.g. before the first RTT
+sample), the pacer lets every packet through.
+'''
+class Pacer(object):
+    # How many congestion windows we send per smoothed RTT. Sending each window a bit faster than the ACKs
+    # come back means pacing never holds the congestion window back; in slow start the window doubles every
+    # round trip, so we have to go faster still
+    GAIN = 1.25
+    SLOW_START_GAIN = 2.0
+
+    # The bucket holds a QUANTUM's worth of tokens, but at least MIN_BURST, so that we send small bursts and
+    # wake up about once per QUANTUM rather than once per packet
+    QUANTUM = 0.001
+    MIN_BURST = 2
+
+    # Tokens we round up to a whole one. Refilling at exactly get_next_send_time() can leave us a rounding error
+    # short of a token, and on a clock that doesn't move on by itself (see NetSim) we would wait for it forever
+    ROUNDING = 1e-9
+
+    def __init__(self, max_rate=None, adaptive=False):
+        self.max_rate = max_rate
+        self.adaptive = adaptive
+        self.rate = None
+        self.burst = self.MIN_BURST
+        self.tokens = self.burst
+        self.last_refill = None
+        self.set_rate(max_rate)
+
+    def set_rate(self, rate):
+        self.rate = rate
+        if rate is not None:
+            self.burst = max(rate * self.QUANTUM, self.MIN_BURST)
+
+    # Derives the rate from the congestion window (in packets) and the smoothed RTT, if we pace adaptively
+    def update_rate(self, window, srtt, slow_start):
+        if not self.adaptive or not srtt:
+            return
+        rate = window / srtt * (self.SLOW_START_GAIN if slow_start else self.GAIN)
+        if self.max_rate is not None:
+            rate = min(rate, self.max_rate)
+        self.set_rate(rate)
+
+    # Adds the tokens that accumulated since the last refill
+    def refill(self, now):
+        if self.rate is not None and self.last_refill is not None:
+            self.tokens = min(self.tokens + (now - self.last_refill) * self.rate, self.burst)
+        self.last_refill = now
+
+    # Returns true or false based on whether we may send a new packet at time 'now'
+    def has_token(self, now):
+        self.refill(now)
+        return self.rate is None or self.tokens >= 1 - self.ROUNDING
+
+    # Takes the token for a new packet, and returns false if there isn't one
+    def take(self, now):
+        if not self.has_token(now):
+            return False
+        if self.rate is not None:
+            self.tokens = max(self.tokens - 1, 0)
+        return True
+
+    # Returns the time at which the next token will be available, assuming nothing has refilled since 'now'
+    def get_next_send_time(self, now):
+        return now + max(1 - self.tokens, 0) / self.rate
+
+
+# A slot in the Window's ring buffer, holding everything we know about one packet in flight. 'packet' is either
+# the packet itself or, for a memory-mapped input file, the (msg_type, offset, length, checksum) to build it from,
+# where checksum is None until the packet is first built
+class WindowEntry(object):
+    __slots__ = ('packet', 'send_time', 'transmissions', 'sacked')
+
+    def __init__(self):
+        self.packet = None
+        self.send_time = None
+        self.transmissions = 0
+        self.sacked = False
+
+
+'''
+The packets in flight, kept in a fixed-capacity ring buffer. The packet with sequence number 'seqno' lives in
+slot seqno % capacity, and the window covers the sequence numbers from 'base' (the oldest unacknowledged packet)
+up to but excluding 'next_seqno'. Inserting a packet is O(1), and sliding the window is O(number of packets ACKed).
+'''
+class Window(object):
+
+    def __init__(self, congestion_control, capacity=None):
+        # Engine that decides how many packets we may have in flight
+        self.congestion_control = congestion_control
+
+        # The window can never hold more packets than the congestion window can ever allow
+        if capacity is None:
+            capacity = congestion_control.max_window
+        self.capacity = capacity
+        self.entries = [WindowEntry() for _ in xrange(capacity)]
+        self.base = 0
+        self.next_seqno = 0
+
+        # The highest cumulative ACK we have received, and how many duplicates of it we have received since.
+        # Cumulative ACKs only ever move forward, so this is all we need to detect duplicate ACKs
+        self.highest_ack = None
+        self.dup_ack_count = 0
+
+        # The first sequence number past the receive window that the Receiver last advertised, or None if it
+        # doesn't advertise one. We never send that far, however large the congestion window
+        self.receive_limit = None
+
+        # Number of SACKed packets in the window, and the highest SACKed sequence number, so that we can
+        # skip looking for lost holes when there can't be any
+        self.sacked_count = 0
+        self.highest_sacked = None
+
+        # During fast recovery without SACKs, the number of packets that duplicate ACKs tell us have left the
+        # network, and so no longer count against the congestion window (RFC 6582's window inflation)
+        self.recovery_inflation = 0
+
+        # Heap of <retransmission deadline, sequence number, time sent> triples, one per transmission.
+        # Entries for packets that were since ACKed or resent are stale and get discarded lazily when they
+        # reach the top of the heap
+        self.retransmission_timers = []
+
+    @property
+    def window_size(self):
+        return min(self.congestion_control.get_window(), self.capacity)
+
+    # Adds the next packet to the window
+    def add_packet_to_window(self, seqno, packet):
+        assert seqno == self.next_seqno and seqno - self.base < self.capacity
+        entry = self.entries[seqno % self.capacity]
+        entry.packet = packet
+        entry.send_time = None
+        entry.transmissions = 0
+        entry.sacked = False
+        self.next_seqno = seqno + 1
+
+    # Returns the sequence numbers of every packet in the window that 'ack' acknowledges, in ascending order
+    def get_seqnos_acked_by(self, ack):
+        return xrange(self.base, max(self.base, min(ack, self.next_seqno)))
+
+    # Removes every packet with a sequence number less than 'ack' from the window, and returns how many were removed
+    def slide_window(self, ack):
+        acked_seqnos = self.get_seqnos_acked_by(ack)
+        for seqno in acked_seqnos:
+            entry = self.entries[seqno % self.capacity]
+            if entry.sacked:
+                self.sacked_count -= 1
+            # Let go of the packet, but keep the entry around for reuse
+            entry.packet = None
+            entry.send_time = None
+        self.base += len(acked_seqnos)
+        return len(acked_seqnos)
+
+    # Returns the sequence numbers of every packet in the window, in ascending order
+    def get_seqnos_in_window(self):
+        return xrange(self.base, self.next_seqno)
+
+    # Records that the packet with a particular sequence number was just (re)sent at time 'now'
+    def record_transmission(self, seqno, now):
+        entry = self.entries[seqno % self.capacity]
+        entry.send_time = now
+        entry.transmissions += 1
+
+    # Arms the retransmission timer of the latest transmission of a packet
+    def set_retransmission_timer(self, seqno, deadline):
+        heapq.heappush(self.retransmission_timers, (deadline, seqno, self.get_send_time_via_seqno(seqno)))
+
+    # Gets the time that a packet with a particular sequence number was last sent
+    def get_send_time_via_seqno(self, seqno):
+        return self.entries[seqno % self.capacity].send_time
+
+    # Gets the number of times that a packet with a particular sequence number has been sent
+    def get_transmissions_via_seqno(self, seqno):
+        return self.entries[seqno % self.capacity].transmissions
+
+    # Returns true or false based on whether a packet has been sent more than once
+    def is_seqno_retransmitted(self, seqno):
+        return self.entries[seqno % self.capacity].transmissions > 1
+
+    # Pops timers off the heap until the top one belongs to the latest transmission of a packet in our window
+    def discard_stale_timers(self):
+        timers = self.retransmission_timers
+        while timers and not (self.is_seqno_contained_in_window(timers[0][1]) and
+                              self.get_send_time_via_seqno(timers[0][1]) == timers[0][2]):
+            heapq.heappop(timers)
+
+    # Returns the earliest time at which an unacknowledged packet times out, or None if the window is empty
+    def get_retransmission_deadline(self):
+        self.discard_stale_timers()
+        if not self.retransmission_timers:
+            return None
+        return self.retransmission_timers[0][0]
+
+    # Removes and returns the sequence numbers of every packet whose retransmission deadline has passed
+    def pop_expired_seqnos(self, now):
+        expired_seqnos = []
+        self.discard_stale_timers()
+        while self.retransmission_timers and self.retransmission_timers[0][0] <= now:
+            expired_seqnos.append(heapq.heappop(self.retransmission_timers)[1])
+            self.discard_stale_timers()
+        return expired_seqnos
+
+    # Returns true or false based on whether 'ack' moves our cumulative ACK forward
+    def is_new_ack(self, ack):
+        return self.highest_ack is None or ack > self.highest_ack
+
+    # Records a new cumulative ACK
+    def record_new_ack(self, ack):
+        self.highest_ack = ack
+        self.dup_ack_count = 0
+
+    # Records the receive window advertised by an ACK: the Receiver buffers up to 'window' packets from 'ack'
+    # on. ACKs that arrive out of order don't get to move the limit back
+    def update_receive_window(self, ack, window):
+        if self.highest_ack is None or ack >= self.highest_ack:
+            self.receive_limit = ack + window
+
+    # Records a duplicate of the highest cumulative ACK and returns how many duplicates we have received
+    def record_dup_ack(self):
+        self.dup_ack_count += 1
+        return self.dup_ack_count
+
+    # Marks every packet that the Receiver reported in a SACK as received. SACKs for packets that are
+    # no longer in our window are stale and ignored
+    def mark_seqnos_as_sacked(self, seqnos):
+        for seqno in seqnos:
+            if self.is_seqno_contained_in_window(seqno):
+                entry = self.entries[seqno % self.capacity]
+                if not entry.sacked:
+                    entry.sacked = True
+                    self.sacked_count += 1
+                    if self.highest_sacked is None or seqno > self.highest_sacked:
+                        self.highest_sacked = seqno
+
+    # Returns true or false based on whether the Receiver has SACKed a packet with a particular sequence number
+    def is_seqno_sacked(self, seqno):
+        return self.entries[seqno % self.capacity].sacked
+
+    '''
+    Returns the sequence numbers of the holes in our SACK scoreboard that we consider lost, in ascending order.
+    As in RFC 6675, a hole is lost once at least 'dup_thresh' packets above it have been SACKed. We only count
+    SACKed packets that were sent after the hole was last sent, so that a hole we just retransmitted is not
+    considered lost again until enough packets sent after the retransmission have arrived.
+    '''
+    def get_lost_seqnos(self, dup_thresh):
+        lost_seqnos = []
+        if self.sacked_count < dup_thresh:
+            return lost_seqnos
+
+        # Min-heap of the 'dup_thresh' latest send times among the SACKed packets above the current hole
+        latest_sacked_send_times = []
+        for seqno in xrange(min(self.highest_sacked, self.next_seqno - 1), self.base - 1, -1):
+            entry = self.entries[seqno % self.capacity]
+            if entry.sacked:
+                if len(latest_sacked_send_times) < dup_thresh:
+                    heapq.heappush(latest_sacked_send_times, entry.send_time)
+                elif entry.send_time > latest_sacked_send_times[0]:
+                    heapq.heapreplace(latest_sacked_send_times, entry.send_time)
+            elif len(latest_sacked_send_times) == dup_thresh and latest_sacked_send_times[0] > entry.send_time:
+                lost_seqnos.append(seqno)
+        lost_seqnos.reverse()
+        return lost_seqnos
+
+    # Gets the packet with a particular sequence number
+    def get_packet_via_seqno(self, seqno):
+        return self.entries[seqno % self.capacity].packet
+
+    # Replaces the packet with a particular sequence number, e.g. with a differently encoded one
+    def replace_packet_via_seqno(self, seqno, packet):
+        self.entries[seqno % self.capacity].packet = packet
 
     # Returns true or false based on whether more packets can be fit into the window
     def window_is_full(self):
-        return len(self.seqno_to_packet_map) >= self.window_size
+        in_flight = self.next_seqno - self.base
+        if in_flight >= self.capacity:
+            return True
+        if self.receive_limit is not None:
+            if self.next_seqno >= self.receive_limit:
+                return True
+            # Packets that we know have reached the Receiver, because they were SACKed or duplicate ACKs told us
+            # so, are no longer in flight. That lets us keep sending past a hole, but only when the Receiver tells
+            # us how far past it it has room: otherwise it would drop what we send and make more holes
+            in_flight -= self.sacked_count + self.recovery_inflation
+        return in_flight >= self.window_size
 
     # Returns true or false based on whether a particular sequence number is contained in our window
-    def is_seqno_contained_in_packet_map(self, seqno):
-        return seqno in self.seqno_to_packet_map
-
-    # Returns true or false based on whether a particular seqno is contained in our ACK map
-    def is_seqno_contained_in_ack_map(self, seqno):
-        return seqno in self.seqno_to_ack_map
+    def is_seqno_contained_in_window(self, seqno):
+        return self.base <= seqno < self.next_seqno
 
     def get_number_of_packets_in_window(self):
-        return len(self.seqno_to_packet_map)
+        return self.next_seqno - self.base
 
 
 
@@ -75,79 +523,326 @@ class Sender(BasicSender.BasicSender):
     CHUNK_SIZE = PACKET_SIZE - 5 - 8 - 10 - 3
     # CHUNK_SIZE = 1000
 
-    def __init__(self, dest, port, filename, debug=False, sackMode=False):
+    # The binary packet format has a fixed-size header, so its chunks can grow to fill the rest of the packet
+    BINARY_CHUNK_SIZE = PACKET_SIZE - BinaryPacket.HEADER_SIZE
+
+    # Size of each packet buffer. CHUNK_SIZE leaves room for 8-digit sequence numbers; the slack is for longer ones
+    PACKET_BUFFER_SIZE = PACKET_SIZE + 16
+
+    # Number of duplicate ACKs (or SACKed packets above a hole) that signal a loss
+    DUP_THRESH = 3
+
+    # Number of times we send the codec packet of a compressed transfer before we decide that the Receiver
+    # doesn't know the codec. In binary mode that is each packet format twice
+    CODEC_ATTEMPTS = 4
+
+    def __init__(self, dest, port, filename, debug=False, sackMode=False, congestion='aimd', clock=None,
+                 binaryMode=False, zeroCopy=False, adler32=False, maxRate=None, pacing=False, compression=None,
+                 compressionLevel=Compression.DEFAULT_LEVEL, metrics=None, metricsInterval=Metrics.Reporter.INTERVAL,
+                 trace=None):
         super(Sender, self).__init__(dest, port, filename, debug)
-        self.window = Window(5)
+        # Where all of our timestamps and timers come from; tests can pass in an EventLoop.FakeClock
+        self.clock = clock or EventLoop.Clock()
+        self.window = Window(CONGESTION_CONTROL[congestion]())
+        self.rtt_estimator = RTTEstimator()
+
+        # Paces new packets to at most 'maxRate' bytes per second and/or, with 'pacing', to the congestion window
+        # per RTT. Retransmissions are few and urgent, so they are never paced
+        self.pacer = None
+        if maxRate or pacing:
+            self.pacer = Pacer(float(maxRate) / self.PACKET_SIZE if maxRate else None, pacing)
+        self.pacing_timer = None
+
+        # In zero-copy mode we build every new packet in place, in one packet buffer per slot of the window. A
+        # packet's buffer is only reused once the packet has left the window
+        self.packet_builder = None
+        if zeroCopy:
+            self.packet_builder = BasicSender.PacketBuilder(self.window.capacity, self.PACKET_BUFFER_SIZE)
+
+        # What we have done so far, and how it went, so that we can tell why a transfer is slow. With 'metrics', a
+        # Reporter writes them out every 'metricsInterval' seconds (see Metrics)
+        self.metrics = Metrics.Registry()
+        self.packets_sent = self.metrics.counter("packets_sent")
+        self.packets_retransmitted = self.metrics.counter("packets_retransmitted")
+        self.packets_acked = self.metrics.counter("packets_acked")
+        self.acks_received = self.metrics.counter("acks_received")
+        self.dup_acks = self.metrics.counter("dup_acks")
+        self.checksum_failures = self.metrics.counter("checksum_failures")
+        self.timeouts = self.metrics.counter("timeouts")
+        self.fast_recoveries = self.metrics.counter("fast_recoveries")
+        self.rtt_samples = self.metrics.histogram("rtt")
+        self.ack_interarrival = self.metrics.histogram("ack_interarrival")
+        self.metrics.gauge("window_occupancy", lambda: self.window.get_number_of_packets_in_window())
+        self.metrics.gauge("congestion_window", lambda: self.window.window_size)
+        self.metrics.gauge("srtt", lambda: self.rtt_estimator.srtt)
+        self.metrics.gauge("rto", lambda: self.rtt_estimator.get_timeout())
+        self.last_ack_time = None
+        self.metrics_target = metrics
+        self.metrics_interval = metricsInterval
+        self.metrics_reporter = None
+
+        # With 'trace', we record every packet we send and every ACK we receive in a Tracer, and write it out to
+        # the file 'trace' once we are done (see Trace). None when we don't trace, which is all the per-packet
+        # code checks
+        self.trace_file = trace
+        self.tracer = Trace.Tracer("sender") if trace else None
+
+        # Time at which we last cut the congestion window because of a timeout. Packets sent before then
+        # belong to a flight whose loss we have already reacted to
+        self.last_timeout_reaction = 0
+
+        # While we are in fast recovery, the sequence number we had got up to when it started; recovery ends once
+        # everything before it has been ACKed. None outside of fast recovery
+        self.recovery_point = None
+
+        # Fast recovery only starts for losses of packets at or after this sequence number, so that one flight
+        # (or the packets resent after a timeout) never cuts the congestion window twice. This is RFC 6582's
+        # 'recover'
+        self.recover = 0
+
+        # The codec we compress the data with, if any. A compressed transfer reads the file front to back,
+        # through the compressor, so it has no use for the map
+        self.compression = compression
+        if compression is not None:
+            self.infile_map = None
+        # A compressed transfer sends nothing but its codec packet until the Receiver answers it, and reads
+        # nothing of the file either, so that if the Receiver never does we can still send the file as it is
+        self.negotiating_codec = compression is not None
+        # number of times the codec packet has timed out
+        self.codec_timeouts = 0
+
         self.current_sequence_number = 0
+        # Offset in the mapped input file of the next chunk to send, and of the end of what we send
+        self.file_offset = 0
+        self.file_end = len(self.infile_map) if self.infile_map is not None else None
+        # Input we can't map, like stdin, is read ahead of what we send, so that a slow producer never blocks us.
+        # If we compress, it is compressed as it is read
+        self.read_ahead = None
+        if self.infile_map is None:
+            compressor = None
+            if compression is not None:
+                compressor = Compression.make_compressor(compression, compressionLevel)
+            self.read_ahead = BasicSender.ReadAhead(self.infile, self.window.capacity * self.PACKET_SIZE, compressor)
+        # (transfer id, start, end) if we only send the range [start, end) of the file, as one of several
+        # streams; see run_striped()
+        self.stripe = None
         self.done_sending = False
         self.is_chunking_done = False
         self.sackMode = sackMode
 
+        # In binary mode we offer the binary packet format with our start packet, and only send more once the
+        # Receiver has answered it. The Receiver answers in whichever format it accepted
+        self.binaryMode = binaryMode
+        self.negotiating = binaryMode
+        # Whether full binary data packets use Adler-32 checksums rather than CRC32 (see BinaryPacket). We offer
+        # it along with the binary format, and keep it only if the Receiver answers with it
+        self.adler32 = binaryMode and adler32
+
         # if sackMode:
         #     raise NotImplementedError #remove this line when you implement SACK
 
-    # Main sending loop.
+    # Makes us send only bytes [start, end) of the file, as one stripe of the transfer 'transfer_id'. Only a
+    # memory-mapped file can be striped
+    def set_stripe(self, transfer_id, start, end):
+        if self.infile_map is None or self.packet_builder is not None:
+            raise ValueError("only a memory-mapped file can be striped")
+        self.stripe = (transfer_id, start, end)
+        self.file_offset = start
+        self.file_end = end
+
+    # Main sending loop. Rather than alternating between filling the window and blocking for a single ACK, we
+    # let an event loop tell us whenever ACKs arrive, a retransmission timer expires or the file has data,
+    # and react to each of those on its own. Every ACK already waiting is processed before we send again, and
+    # new packets go out as soon as the window has room.
     def start(self):
         # NOTE: Packet payload size should be larger than 1000 bytes (unless it is the last packet in the stream)
         # but less than 1472 bytes.
 
-        msg_type = None
-
-        while not self.done_sending:
-            # Repeatedly send packets until our window is full or until our chunking is complete (i.e. msg_type == false)
-            while not self.window.window_is_full() and self.is_chunking_done is False:
-                # Send the next packet chunk and return a boolean that represents whether we are done chunking
-                self.is_chunking_done = self.send_next_packet_chunk()
-                if self.is_chunking_done:
-                    msg_type = 'end'
-
-            # Receive an ACK from the Receiver
-            packet_response = self.receive(0.5)
-
-            # If we haven't received a response in 500ms, then handle timeout
-            if (packet_response == None):
-                self.handle_timeout()
-            else:
-
-                # Via the spec, we ignore all ACK packets with an invalid checksum
-                if Checksum.validate_checksum(packet_response):
-                    msg_type, seqno, data, checksum = self.split_packet(packet_response)
-
-                    if self.sackMode:
-                        seqno = int(seqno.split(";")[0])
-                    # For some reason, 'seqno' is returned as a string... so we parse it into an integer
-                    else:
-                        seqno = int(seqno)
+        self.loop = EventLoop.EventLoop(self.clock)
+        self.loop.add_reader(self.sock, self.handle_acks)
+        self.retransmission_timer = None
 
-                    # Do ACKs have data? Probably not?
-                    if (self.debug):
-                        print("Received packet: %s | %d | %s | %s" % (msg_type, seqno, data, checksum))
+        self.window.congestion_control.on_start(self.clock.now())
 
-                    # Put the current sequence number in our <sequence number -> ACKs> map, given some conditions
+        # The reporter is only opened here, so that every stream of a striped transfer has its own
+        if self.metrics_target is not None:
+            self.metrics_reporter = Metrics.Reporter(self.metrics_target, "sender", self.metrics_interval)
+            self.loop.call_later(self.metrics_interval, self.report_metrics)
 
-                    # If we haven't seen the current ACK before
-                    if not self.window.is_seqno_contained_in_ack_map(seqno):
-                        self.handle_new_ack(seqno)
+        while not self.done_sending:
+            # Only watch the file while we have room in the window, and time from the pacer, to send what we read
+            # from it. Input we read ahead is read whenever there's room in the buffer instead, once we know
+            # whether to compress it
+            if self.read_ahead is not None and not self.negotiating_codec:
+                if self.read_ahead.wants_more():
+                    self.loop.add_reader(self.infile, self.read_ahead.fill)
+                else:
+                    self.loop.remove_reader(self.infile)
+            elif self.can_send_new_packet() and self.pacer_allows_send():
+                self.loop.add_reader(self.infile, self.fill_window)
+            else:
+                self.loop.remove_reader(self.infile)
 
-                    # Current sequence number is NOT already contained within our map...
-                    else:
-                        # Increment the number of ACKs (for seqno) by 1
-                        self.window.add_acks_count_to_map(seqno, self.window.get_ack_number_via_seqno(seqno) + 1)
+            self.schedule_retransmission_timer()
+            self.loop.run_once()
 
-                        # Algorithm: If ACK count is 3, then we use fast retransmit and resend the seqno with count == 3
-                        if (self.window.get_ack_number_via_seqno(seqno) == 3):
-                            self.handle_dup_ack(seqno)
+            # Whatever the events let us send of the input we read ahead goes out now
+            if self.read_ahead is not None and self.can_send_new_packet() and self.pacer_allows_send():
+                self.fill_window()
 
-                else:
-                    # Ignore ACKs with invalid checksum
-                    # Do we need to handle_timeout() if we receive an ACK with an invalid checksum?
-                    self.handle_timeout()
-                    pass
+            # Send the whole burst of new packets and retransmissions that the events produced at once
+            self.flush()
 
             # Declare that we are done sending if our window is empty AND we are done chunking
             if (self.window.get_number_of_packets_in_window() == 0 and self.is_chunking_done is True):
                 self.done_sending = True
 
+        self.log("Sent %d packets, retransmitted %d packets, timed out %d times" %
+                 (self.packets_sent.value, self.packets_retransmitted.value, self.timeouts.value))
+        if self.metrics_reporter is not None:
+            self.metrics_reporter.report(self.metrics.snapshot())
+            self.metrics_reporter.close()
+        self.dump_trace()
+
+    # Writes out what we have traced, if we trace
+    def dump_trace(self):
+        if self.tracer is not None:
+            self.tracer.dump(self.trace_file)
+
+    # Called by the event loop every metrics interval
+    def report_metrics(self):
+        self.metrics_reporter.report(self.metrics.snapshot())
+        self.loop.call_later(self.metrics_interval, self.report_metrics)
+
+    # Called by the event loop when the file has data. Sends packets until our window is full or until our
+    # chunking is complete
+    def fill_window(self):
+        # Retransmissions queued by earlier events may be of packets that have since been ACKed, whose buffers
+        # we are about to reuse, so send them first
+        if self.packet_builder is not None:
+            self.flush()
+        now = self.clock.now()
+        while self.can_send_new_packet():
+            if self.pacer is not None and not self.pacer.take(now):
+                break
+            # Send the next packet chunk and return a boolean that represents whether we are done chunking
+            self.is_chunking_done = self.send_next_packet_chunk()
+
+    # Returns true if we have more of the file to send and room in the window to send it. While we are still
+    # negotiating the packet format or the codec, that room is for the start packet only. Input we read ahead
+    # also has to have a whole chunk ready, unless all we send is the codec packet, which carries none
+    def can_send_new_packet(self):
+        if (self.negotiating or self.negotiating_codec) and self.current_sequence_number > 0:
+            return False
+        if (self.read_ahead is not None and not self.negotiating_codec and
+                not self.read_ahead.has_chunk(self.get_chunk_size())):
+            return False
+        return not self.window.window_is_full() and self.is_chunking_done is False
+
+    # Returns true if the pacer lets us send a new packet now. If it doesn't, we arm a timer that wakes the event
+    # loop when it will, rather than polling it
+    def pacer_allows_send(self):
+        if self.pacer is None:
+            return True
+        now = self.clock.now()
+        congestion_control = self.window.congestion_control
+        self.pacer.update_rate(self.window.window_size, self.rtt_estimator.srtt, congestion_control.in_slow_start())
+        if self.pacer.has_token(now):
+            return True
+        if self.pacing_timer is None:
+            self.pacing_timer = self.loop.call_at(self.pacer.get_next_send_time(now), self.handle_pacing_timer)
+        return False
+
+    # Called by the event loop once the pacer has a token again. All it has to do is wake the loop up
+    def handle_pacing_timer(self):
+        self.pacing_timer = None
+
+    # Keeps a single event loop timer armed for the earliest retransmission deadline in our window
+    def schedule_retransmission_timer(self):
+        deadline = self.window.get_retransmission_deadline()
+        timer = self.retransmission_timer
+        if timer is not None and not timer.cancelled and timer.deadline == deadline:
+            return
+        if timer is not None:
+            timer.cancel()
+        self.retransmission_timer = None
+        if deadline is not None:
+            self.retransmission_timer = self.loop.call_at(deadline, self.handle_timeout)
+
+    # Called by the event loop when the socket is readable. Handles every ACK that is already waiting
+    def handle_acks(self):
+        for packet_response in self.receive_many():
+            self.handle_ack(packet_response)
+
+    def handle_ack(self, packet_response):
+        if BinaryPacket.is_binary(packet_response):
+            ack = self.parse_binary_ack(packet_response)
+        else:
+            ack = self.parse_ack(packet_response)
+
+        # Via the spec, we ignore all ACK packets with an invalid checksum. A corrupted ACK is not a sign of
+        # congestion, so we leave it to the timeout to recover if the ACK was the only one for its window
+        if ack is None:
+            self.checksum_failures.inc()
+            if self.tracer:
+                self.tracer.record(self.clock.now(), Trace.CORRUPT, 0, self.window.window_size)
+            return
+        seqno, sacks, receive_window, answers_codec = ack
+
+        # Once we have given up on the codec, an answer to one of our codec packets that turns up late is not an
+        # answer to the start packet that replaced it. Until the Receiver gets that, it still decompresses
+        if answers_codec and self.compression is None:
+            return
+
+        self.acks_received.inc()
+        now = self.clock.now()
+        if self.last_ack_time is not None:
+            self.ack_interarrival.observe(now - self.last_ack_time)
+        self.last_ack_time = now
+
+        # The first valid answer to our start packet settles the packet format
+        if self.negotiating:
+            self.binaryMode = BinaryPacket.is_binary(packet_response)
+            self.adler32 = self.binaryMode and BinaryPacket.uses_adler32(packet_response)
+            self.negotiating = False
+            self.log("Receiver answered in the %s packet format, with %s checksums" %
+                     ("binary" if self.binaryMode else "ASCII", "Adler-32" if self.adler32 else "CRC32"))
+        if self.negotiating_codec:
+            self.negotiating_codec = False
+            if self.compression is not None:
+                self.log("Receiver accepted the %s codec" % self.compression)
+
+        if receive_window is not None:
+            self.window.update_receive_window(seqno, receive_window)
+
+        if self.sackMode:
+            self.window.mark_seqnos_as_sacked(sacks)
+
+        if self.tracer:
+            self.tracer.record(now, Trace.ACK, seqno, self.window.window_size)
+
+        # If the ACK moves our cumulative ACK forward
+        if self.window.is_new_ack(seqno):
+            self.handle_new_ack(seqno)
+
+        # If the ACK duplicates our cumulative ACK. Older ACKs were reordered on the way and tell us nothing
+        elif seqno == self.window.highest_ack:
+            self.dup_acks.inc()
+            if self.tracer:
+                self.tracer.record(now, Trace.DUP_ACK, seqno, self.window.window_size)
+            dup_ack_count = self.window.record_dup_ack()
+            # Algorithm: If ACK count is 3, then we use fast retransmit and resend the seqno with count == 3.
+            # Every further duplicate during fast recovery means another packet has left the network, which
+            # makes room for a new one
+            if self.recovery_point is not None:
+                if not self.sackMode:
+                    self.window.recovery_inflation += 1
+            elif dup_ack_count == self.DUP_THRESH:
+                self.handle_dup_ack(seqno)
+
+        # In SACK mode, resend the holes that the SACKs tell us were lost
+        if self.sackMode:
+            self.handle_sack_holes()
 
     '''
     Helper method that does the following things:
@@ -160,30 +855,57 @@ class Sender(BasicSender.BasicSender):
     6. Returns True if the packet is completely finished being chunked, and False otherwise
     '''
     def send_next_packet_chunk(self):
-        # Create next file chunk
-        file_chunk = self.chunkFile(self.infile)
+        if self.compression is not None and self.current_sequence_number == 0:
+            # A compressed transfer starts with a packet that names the codec rather than a start packet
+            msg_type = 'codec'
+            packet_to_send = self.make_packet(msg_type, 0, self.compression)
+        elif self.packet_builder is not None:
+            # Read the next file chunk straight into its packet buffer and generate the packet around it. The
+            # builder sets msg_type appropriately, based on what type the chunk is
+            msg_type, packet_to_send = self.packet_builder.build_from_file(
+                self.read_ahead or self.infile, self.current_sequence_number, self.get_chunk_size(), self.binaryMode, self.adler32)
+        elif self.stripe is not None and self.current_sequence_number == 0:
+            # A stripe starts with a packet that only says which transfer it belongs to, where in the file
+            # its data goes and how long the file is
+            msg_type = 'stripe'
+            packet_to_send = self.make_packet(msg_type, 0, "%d:%d:%d" % (self.stripe[0], self.file_offset,
+                                                                        len(self.infile_map)))
+        elif self.infile_map is not None:
+            # A mapped file can be read again whenever we like, so the window only holds where each packet's
+            # data lies in the file, and transmit() builds the packet from it each time it goes out
+            offset = self.file_offset
+            length = min(self.get_chunk_size(), self.file_end - offset)
+            self.file_offset += length
+
+            msg_type = 'data'
+            if self.current_sequence_number == 0:
+                msg_type = 'start'
+            elif not length:
+                msg_type = 'end'
+
+            packet_to_send = (msg_type, offset, length, None)
+            if self.negotiating:
+                # the start packet changes format while we negotiate, so it is built once and kept
+                packet_to_send = self.make_packet(msg_type, self.current_sequence_number, self.read_at(offset, length))
+        else:
+            # Create next file chunk
+            file_chunk = self.chunkFile(self.read_ahead or self.infile)
 
-        # Set msg_type appropriately, based on what type the chunk is
-        msg_type = 'data'
-        if self.current_sequence_number == 0:
-            msg_type = 'start'
-        elif not file_chunk:
-            msg_type = 'end'
+            # Set msg_type appropriately, based on what type the chunk is
+            msg_type = 'data'
+            if self.current_sequence_number == 0:
+                msg_type = 'start'
+            elif not file_chunk:
+                msg_type = 'end'
 
-        # Generate a packet with the current file chunk
-        packet_to_send = self.make_packet(msg_type, self.current_sequence_number, file_chunk)
+            # Generate a packet with the current file chunk
+            packet_to_send = self.make_packet(msg_type, self.current_sequence_number, file_chunk)
 
-        # Add packet to our <sequence number -> packet> map
-        self.window.add_packet_to_map(self.current_sequence_number, packet_to_send)
+        # Add packet to our window
+        self.window.add_packet_to_window(self.current_sequence_number, packet_to_send)
 
         # Send newly generated packet and increment the sequence number by 1
-        self.send(packet_to_send)
-
-        # Update packet map
-        self.window.add_packet_to_map(self.current_sequence_number, packet_to_send)
-
-        if (self.debug):
-            print("Just sent packet with sequence number %s" % self.current_sequence_number)
+        self.transmit(self.current_sequence_number)
         self.current_sequence_number += 1
 
         packet_finished_chunking = (msg_type == 'end')
@@ -208,72 +930,242 @@ class Sender(BasicSender.BasicSender):
         #       1 2 3 (dropped) 4 5 6 7 3 4 5 6 7
         # ACKS: 2 3 3           3 3 3 3 8 8 8 8 8
 
-        if self.sackMode:
-            for seqno in self.window.seqno_to_packet_map:
-                current_packet_pair = self.window.get_packet_pair_via_seqno(seqno)
-
-                # If we're in SACK mode, then resend all packets in our window that have not been received successfully
-                if (current_packet_pair[1] == False):
-                    self.send(current_packet_pair[0])
-                    if self.debug:
-                        print("We are able to resend packet %s" % seqno)
-        else:
-            for seqno in self.window.seqno_to_packet_map:
-                current_packet = self.window.get_packet_via_seqno(seqno)
+        # In SACK mode, every packet has its own timer, and we only resend the packets whose timers expired
+        now = self.clock.now()
+        expired_seqnos = self.window.pop_expired_seqnos(now)
 
-                if self.debug:
-                    print("We are able to resend packet %s" % seqno)
+        # We can wake up marginally before the earliest deadline, in which case nothing has timed out yet
+        if not expired_seqnos:
+            return
 
-                self.send(current_packet)
+        self.timeouts.inc()
+        if self.tracer:
+            self.tracer.record(now, Trace.TIMEOUT, min(expired_seqnos), self.window.window_size)
 
-    # Called when we encounter an ACK with a sequence number that we have never seen before
-    def handle_new_ack(self, ack):
+        if self.negotiating:
+            self.alternate_start_packet_format()
+        if self.negotiating_codec and self.compression is not None:
+            self.codec_timeouts += 1
+            if self.codec_timeouts >= self.CODEC_ATTEMPTS:
+                self.give_up_on_codec()
 
-        # Slide the window if it is full
-        if self.window.window_is_full() or self.is_chunking_done:
+        # Cut the congestion window and back off once per flight, rather than once for every packet of the
+        # flight that times out
+        if max(self.window.get_send_time_via_seqno(seqno) for seqno in expired_seqnos) >= self.last_timeout_reaction:
+            self.window.congestion_control.on_timeout(self.window.get_number_of_packets_in_window(), now)
+            self.rtt_estimator.back_off()
+            self.last_timeout_reaction = now
 
-            # Find all entries in map that have sequence number less than 'ack', and remove them from the map
-            list_of_sequences_numbers_to_remove = []
-            for seqno in self.window.seqno_to_packet_map:
-                if seqno < ack:
-                    list_of_sequences_numbers_to_remove.append(seqno)
-            for seqno_to_remove in list_of_sequences_numbers_to_remove:
-                self.window.remove_seqno_from_packet_map(seqno_to_remove)
+        # A timeout ends fast recovery, and the packets we resend because of it are not worth a fast retransmit
+        self.exit_recovery()
+        self.recover = self.current_sequence_number
 
-                if self.debug:
-                    print("We are shifting our window right now and removing sequence number %s from it" % seqno_to_remove)       
-
-        # Because we haven't seen the current ACK before, put it in our ACK map
-        self.window.add_acks_count_to_map(ack, 0)
+        if self.sackMode:
+            for seqno in expired_seqnos:
+                # If we're in SACK mode, then resend the expired packets that have not been received successfully
+                if not self.window.is_seqno_sacked(seqno):
+                    self.retransmit(seqno)
+        else:
+            for seqno in self.window.get_seqnos_in_window():
+                self.retransmit(seqno)
 
-        # Iterate through our packet map, and for every packet with a lower sequence number than this received ACK,
-        # Update the packet pair's "received" boolean to True
-        for seqno in self.window.seqno_to_packet_map:
-            if seqno < ack:
-                current_packet_pair = self.window.get_packet_pair_via_seqno(seqno)
-                current_packet_pair[1] = True
+    # Called when we encounter an ACK with a sequence number that we have never seen before
+    def handle_new_ack(self, ack):
+        now = self.clock.now()
+
+        # Every packet in the window with a sequence number less than 'ack' has been received
+        acked_seqnos = self.window.get_seqnos_acked_by(ack)
+
+        # The ACK for the newest packet it covers gives us an RTT sample, unless it also covers a retransmitted
+        # packet. Then we can't tell which transmission triggered the ACK (Karn's rule): it may have been the
+        # retransmission filling a hole, long after the newest packet arrived
+        if acked_seqnos and acked_seqnos[-1] == ack - 1 and \
+                not any(self.window.is_seqno_retransmitted(seqno) for seqno in acked_seqnos):
+            rtt = now - self.window.get_send_time_via_seqno(ack - 1)
+            self.rtt_estimator.add_sample(rtt)
+            self.rtt_samples.observe(rtt)
+
+        # Slide the window. The window size changes with the congestion window, so we always slide rather
+        # than only when the window is full
+        number_of_packets_acked = self.window.slide_window(ack)
+        self.packets_acked.inc(number_of_packets_acked)
+
+        if number_of_packets_acked:
+            self.rtt_estimator.reset_backoff()
+
+        # Because we haven't seen the current ACK before, it is our new cumulative ACK
+        self.window.record_new_ack(ack)
+
+        if self.recovery_point is None:
+            # Every packet that left the window grows the congestion window
+            self.window.congestion_control.on_ack(number_of_packets_acked, now)
+        elif ack >= self.recovery_point:
+            # A full ACK: everything sent before the loss has arrived, so recovery is over. The congestion window
+            # is where the loss left it, and starts growing again from the next ACK
+            self.exit_recovery()
+        else:
+            # A partial ACK: the retransmission filled one hole, and the ACK points at the next one, which was
+            # lost from the same flight. Resend it straight away rather than waiting for more duplicates or a
+            # timeout. The packets it ACKs are no longer in flight, which deflates the window by as many, less the
+            # one that the retransmission itself made room for
+            if not self.sackMode:
+                self.window.recovery_inflation = max(self.window.recovery_inflation - number_of_packets_acked + 1, 0)
+                if self.window.is_seqno_contained_in_window(ack):
+                    self.retransmit(ack)
 
     def handle_dup_ack(self, ack):
-        if (self.debug):
-            print("We are now handling the duplicate ACK %s!!!!!!!!!!!!!!!!!" % ack)
-
         # Grab packet that has the sequence number of 'ack', and resend it
-        if (self.window.is_seqno_contained_in_packet_map(ack)):
-            packet_to_resend = self.window.get_packet_via_seqno(ack)
-            self.send(packet_to_resend)
-            if (self.debug):
-                print("We just resent ACK %s due to fast retransmit!!!!!" % ack)
+        if (self.window.is_seqno_contained_in_window(ack)):
+            # Three duplicate ACKs mean a packet was lost, so back off
+            self.handle_loss(ack)
+            self.retransmit(ack)
+
+    # Resends every hole in our SACK scoreboard that we consider lost
+    def handle_sack_holes(self):
+        for seqno in self.window.get_lost_seqnos(self.DUP_THRESH):
+            self.handle_loss(seqno)
+            self.retransmit(seqno)
+
+    # Reacts to the loss of a packet inferred from duplicate ACKs or SACKs by cutting the congestion window and
+    # starting fast recovery. Until every packet that was in flight then has been ACKed, further losses belong to
+    # the same congestion event: we resend them, but don't cut the congestion window again
+    def handle_loss(self, seqno):
+        if self.recovery_point is not None or seqno < self.recover:
+            return
+        self.window.congestion_control.on_loss(self.window.get_number_of_packets_in_window(), self.clock.now())
+        self.fast_recoveries.inc()
+        if self.tracer:
+            self.tracer.record(self.clock.now(), Trace.LOSS, seqno, self.window.window_size)
+        self.recovery_point = self.recover = self.current_sequence_number
+        # The duplicate ACKs that signalled the loss were for packets that have left the network
+        if not self.sackMode:
+            self.window.recovery_inflation = self.DUP_THRESH
+
+    # Leaves fast recovery, if we are in it
+    def exit_recovery(self):
+        self.recovery_point = None
+        self.window.recovery_inflation = 0
+
+    # Parses an ASCII ACK or SACK into the cumulative ACK, the list of SACKed sequence numbers, the receive
+    # window and whether it answers a codec packet, or returns None if it is invalid. A Receiver that advertises
+    # a receive window puts it in the data field, which is otherwise empty; the window is None if it doesn't
+    def parse_ack(self, packet_response):
+        if not Checksum.validate_checksum(packet_response):
+            return None
+        msg_type, seqno, data, checksum = self.split_packet(packet_response)
+        window, _, codec = data.partition('|')
+        try:
+            receive_window = int(window) if window else None
+            if self.sackMode:
+                return self.split_sack(seqno) + (receive_window, bool(codec))
+            # For some reason, 'seqno' is returned as a string... so we parse it into an integer
+            return int(seqno), [], receive_window, bool(codec)
+        except ValueError:
+            return None
+
+    # Parses a binary ACK or SACK the same way
+    def parse_binary_ack(self, packet_response):
+        if not BinaryPacket.validate_checksum(packet_response):
+            return None
+        try:
+            msg_type, seqno, sacks, receive_window, codec = BinaryPacket.split_ack(packet_response)
+            return seqno, sacks, receive_window, codec
+        except ValueError:
+            return None
+
+    # Prepares a packet in whichever format we are using
+    def make_packet(self, msg_type, seqno, msg):
+        if self.binaryMode:
+            return BinaryPacket.make_packet(msg_type, seqno, msg, adler32=self.adler32)
+        return super(Sender, self).make_packet(msg_type, seqno, msg)
+
+    def make_packet_with_checksum(self, msg_type, seqno, msg, checksum=None):
+        if self.binaryMode:
+            return BinaryPacket.make_packet_with_checksum(msg_type, seqno, msg, checksum, self.adler32)
+        return super(Sender, self).make_packet_with_checksum(msg_type, seqno, msg, checksum)
+
+    # Re-encodes our start packet in the other format. Each time it times out while we negotiate, we switch
+    # between offering the binary format and falling back to ASCII, so that a Receiver that doesn't speak
+    # binary still gets a start packet it understands, and losing a few packets doesn't make us give up on
+    # binary. We read its chunk at the ASCII size, so it fits either way
+    def alternate_start_packet_format(self):
+        packet = self.window.get_packet_via_seqno(0)
+        if isinstance(packet, memoryview):
+            packet = packet.tobytes()
+        if BinaryPacket.is_binary(packet):
+            msg_type, seqno, data, checksum = BinaryPacket.split_packet(packet)
+            packet = super(Sender, self).make_packet(msg_type, seqno, data.tobytes())
+        else:
+            msg_type, seqno, data, checksum = self.split_packet(packet)
+            packet = BinaryPacket.make_packet(msg_type, int(seqno), data, adler32=self.adler32)
+        self.window.replace_packet_via_seqno(0, packet)
+
+    # Replaces our codec packet with a start packet that carries no data, in whichever format the codec packet
+    # had, and sends the file uncompressed. A Receiver that doesn't know the codec ignores the codec packet,
+    # so without this we would resend it until we gave up. We have read none of the file yet, so all that
+    # changes is that the rest of it is read without the compressor
+    def give_up_on_codec(self):
+        self.log("Receiver didn't answer the %s codec; sending the file uncompressed" % self.compression)
+        self.compression = None
+        self.read_ahead.compressor = None
+        if BinaryPacket.is_binary(self.window.get_packet_via_seqno(0)):
+            packet = BinaryPacket.make_packet('start', 0, '', adler32=self.adler32)
+        else:
+            packet = super(Sender, self).make_packet('start', 0, '')
+        self.window.replace_packet_via_seqno(0, packet)
+
+    # Splits the sequence number field of a SACK, e.g. "5;7,8", into the cumulative ACK and the list of
+    # sequence numbers that the Receiver holds beyond it
+    def split_sack(self, seqno):
+        cumulative_ack, _, sacks = seqno.partition(';')
+        return int(cumulative_ack), [int(sack) for sack in sacks.split(',') if sack]
+
+    # Queues the packet in our window with a particular sequence number to be sent by the next flush(), and
+    # arms its retransmission timer. Recording every transmission lets Karn's rule keep retransmitted packets
+    # out of our RTT samples
+    def transmit(self, seqno):
+        now = self.clock.now()
+        packet = self.window.get_packet_via_seqno(seqno)
+        if type(packet) is tuple:
+            packet = self.build_packet(seqno, packet)
+        self.enqueue(packet)
+        self.window.record_transmission(seqno, now)
+        self.window.set_retransmission_timer(seqno, now + self.rtt_estimator.get_timeout())
+        self.packets_sent.inc()
+        if self.tracer:
+            event = Trace.RETRANSMIT if self.window.get_transmissions_via_seqno(seqno) > 1 else Trace.SEND
+            self.tracer.record(now, event, seqno, self.window.window_size)
+
+    # Resends the packet in our window with a particular sequence number
+    def retransmit(self, seqno):
+        self.transmit(seqno)
+        self.packets_retransmitted.inc()
 
     def log(self, msg):
         if self.debug:
             print msg
 
+    # Builds the packet for a (msg_type, offset, length, checksum) segment of the mapped input file. The first
+    # time, we keep the checksum in the window, so that retransmissions don't compute it again
+    def build_packet(self, seqno, segment):
+        msg_type, offset, length, checksum = segment
+        packet, new_checksum = self.make_packet_with_checksum(msg_type, seqno, self.read_at(offset, length), checksum)
+        if checksum is None:
+            self.window.replace_packet_via_seqno(seqno, (msg_type, offset, length, new_checksum))
+        return packet
+
     # Chunks a file into size 1472 bytes, if it is able to be chunked
     def chunkFile(self, file):
-        chunk = file.read(self.CHUNK_SIZE)
+        chunk = file.read(self.get_chunk_size())
         # If no chunk, will return empty string; else, returns String representation of chunk
         return chunk
 
+    # Returns how much of the file to put in each packet, so that packets are at most 1472 bytes
+    def get_chunk_size(self):
+        if self.binaryMode and not self.negotiating:
+            return self.BINARY_CHUNK_SIZE
+        return self.CHUNK_SIZE
+
     # Handles a response from the receiver.
     # This has been taken from StanfurdSender.py
     def handle_response(self,response_packet):
@@ -289,6 +1181,52 @@ class Sender(BasicSender.BasicSender):
 
 
 
+'''
+Sends one file as several streams at once, each from a process of its own
+with its own socket and window, so that a single transfer can use several
+cores. The file is split into one byte range per stream, and each stream opens
+with a 'stripe' packet that tells the Receiver which transfer it belongs to,
+where its range starts and how long the whole file is. The transfer is
+identified by the port of the first stream, so the Receiver writes the file
+where an ordinary transfer from that port would go.
+
+Returns true if every stream finished.
+'''
+def run_striped(streams, dest, port, filename, *args, **kwargs):
+    senders = [Sender(dest, port, filename, *args, **kwargs) for _ in xrange(streams)]
+    size = senders[0].file_end
+    if size is None:
+        # an empty file can't be mapped, and there is nothing to split
+        senders[0].start()
+        return True
+    transfer_id = senders[0].sock.getsockname()[1]
+    # Streams with nothing to send would only add overhead, so a small file gets fewer of them
+    stripe_size = max(-(-size // streams), Sender.CHUNK_SIZE)
+    senders = [sender for i, sender in enumerate(senders) if i * stripe_size < size or i == 0]
+
+    pids = []
+    for i, sender in enumerate(senders):
+        sender.set_stripe(transfer_id, i * stripe_size, min((i + 1) * stripe_size, size))
+        # every stream writes its own trace, FILE.0, FILE.1, ...
+        if sender.trace_file is not None:
+            sender.trace_file = "%s.%d" % (sender.trace_file, i)
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                sender.start()
+                status = 0
+            finally:
+                sys.stdout.flush()
+                os._exit(status)
+        pids.append(pid)
+
+    finished = True
+    for pid in pids:
+        finished = os.waitpid(pid, 0)[1] == 0 and finished
+    return finished
+
+
 '''
 This will be run if you run this script from the command line. You should not
 change any of this; the grader may rely on the behavior here to test your
@@ -303,10 +1241,25 @@ if __name__ == "__main__":
         print "-d | --debug Print debug messages"
         print "-h | --help Print this usage message"
         print "-k | --sack Enable selective acknowledgement mode"
+        print "-c ALGORITHM | --congestion=ALGORITHM Congestion control: %s, defaults to aimd" % ", ".join(sorted(CONGESTION_CONTROL))
+        print "-b | --binary Offer the binary packet format, falling back to ASCII if the receiver doesn't accept it"
+        print "-z | --zero-copy Build packets in place in preallocated buffers"
+        print "-s STREAMS | --streams=STREAMS Send the file as STREAMS parallel streams, defaults to 1"
+        print "-x | --adler32 With -b, also offer Adler-32 checksums on full data packets, which are cheaper than CRC32"
+        print "-r RATE | --rate=RATE Pace new packets to at most RATE bytes per second"
+        print "-g | --pace Pace new packets to send the congestion window over a round trip, rather than in bursts"
+        print "-e CODEC[:LEVEL] | --compress=CODEC[:LEVEL] Compress the data with CODEC: %s, at LEVEL, defaults to %d" % \
+            (", ".join(sorted(Compression.CODECS)), Compression.DEFAULT_LEVEL)
+        print "-m TARGET | --metrics=TARGET Report metrics to TARGET: a file, udp:HOST:PORT or unix:PATH"
+        print "--metrics-interval=SECONDS Seconds between metrics reports, defaults to %g" % Metrics.Reporter.INTERVAL
+        print "-T FILE | --trace=FILE Trace every packet and ACK, and write the trace to FILE (see Trace.py)"
 
     try:
         opts, args = getopt.getopt(sys.argv[1:],
-                               "f:p:a:dk", ["file=", "port=", "address=", "debug=", "sack="])
+                               "f:p:a:dkc:bzs:xr:ge:m:T:", ["file=", "port=", "address=", "debug=", "sack=", "congestion=",
+                                                          "binary", "zero-copy", "streams=", "adler32", "rate=", "pace",
+                                                          "compress=", "metrics=", "metrics-interval=",
+                                                          "trace="])
     except:
         usage()
         exit()
@@ -316,6 +1269,18 @@ if __name__ == "__main__":
     filename = None
     debug = False
     sackMode = False
+    congestion = 'aimd'
+    binaryMode = False
+    zeroCopy = False
+    streams = 1
+    adler32 = False
+    maxRate = None
+    pacing = False
+    compression = None
+    compressionLevel = Compression.DEFAULT_LEVEL
+    metrics = None
+    metricsInterval = Metrics.Reporter.INTERVAL
+    trace = None
 
     for o,a in opts:
         if o in ("-f", "--file="):
@@ -328,9 +1293,56 @@ if __name__ == "__main__":
             debug = True
         elif o in ("-k", "--sack="):
             sackMode = True
+        elif o in ("-c", "--congestion"):
+            if a not in CONGESTION_CONTROL:
+                usage()
+                exit()
+            congestion = a
+        elif o in ("-b", "--binary"):
+            binaryMode = True
+        elif o in ("-z", "--zero-copy"):
+            zeroCopy = True
+        elif o in ("-s", "--streams"):
+            streams = int(a)
+        elif o in ("-x", "--adler32"):
+            adler32 = True
+        elif o in ("-r", "--rate"):
+            maxRate = float(a)
+        elif o in ("-g", "--pace"):
+            pacing = True
+        elif o in ("-e", "--compress"):
+            try:
+                compression, compressionLevel = Compression.parse_codec(a)
+            except ValueError, e:
+                print e
+                usage()
+                exit()
+        elif o in ("-m", "--metrics"):
+            metrics = a
+        elif o == "--metrics-interval":
+            metricsInterval = float(a)
+        elif o in ("-T", "--trace"):
+            trace = a
+
+    if streams > 1:
+        if filename is None or zeroCopy or compression:
+            print "Only a file, without -z or -e, can be sent as several streams"
+            exit()
+        try:
+            # The streams share the maximum rate
+            if not run_striped(streams, dest, port, filename, debug, sackMode, congestion, binaryMode=binaryMode,
+                               adler32=adler32, maxRate=maxRate / streams if maxRate else None, pacing=pacing,
+                               metrics=metrics, metricsInterval=metricsInterval, trace=trace):
+                sys.exit(1)
+        except KeyboardInterrupt:
+            exit()
+        exit()
 
-    s = Sender(dest, port, filename, debug, sackMode)
+    s = Sender(dest, port, filename, debug, sackMode, congestion, binaryMode=binaryMode, zeroCopy=zeroCopy,
+               adler32=adler32, maxRate=maxRate, pacing=pacing, compression=compression,
+               compressionLevel=compressionLevel, metrics=metrics, metricsInterval=metricsInterval, trace=trace)
     try:
         s.start()
     except (KeyboardInterrupt, SystemExit):
+        s.dump_trace()
         exit()
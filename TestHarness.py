@@ -1,10 +1,14 @@
 #!/usr/bin/python
+import csv
+import heapq
+import json
 import os
 import socket
 import subprocess
 import time
 
 import Checksum
+import BinaryPacket
 from tests import BasicTest
 
 """
@@ -15,7 +19,7 @@ you want to run. The tests automatically register themselves with the
 forwarder, so they will magically be run.
 """
 def tests_to_run(forwarder):
-    from tests import BasicTest, RandomDropTest, SackRandomDropTest, DelayTest, CorruptTest, DropStartAckTest, NonAckTest, DropFirstPacketsTest, RandomDuplicateTest, RandomReorderTest, StartAndEndTest
+    from tests import BasicTest, RandomDropTest, SackRandomDropTest, DelayTest, CorruptTest, DropStartAckTest, NonAckTest, DropFirstPacketsTest, RandomDuplicateTest, RandomReorderTest, StartAndEndTest, BinaryCorruptTest, ReceiveWindowTest, BurstDropTest, PacingTest, CompressionTest, CodecFallbackTest
     BasicTest.BasicTest(forwarder, "README")
     RandomDropTest.RandomDropTest(forwarder, "README")
     DelayTest.DelayTest(forwarder, "README")
@@ -27,6 +31,35 @@ def tests_to_run(forwarder):
     RandomReorderTest.RandomReorderTest(forwarder, "README")
     BasicTest.BasicTest(forwarder, "one_char.txt")
     SackRandomDropTest.SackRandomDropTest(forwarder, "README")
+    BinaryCorruptTest.BinaryCorruptTest(forwarder, "README")
+    ReceiveWindowTest.ReceiveWindowTest(forwarder, "LONG_FILE")
+    BurstDropTest.BurstDropTest(forwarder, "LONG_FILE")
+    PacingTest.PacingTest(forwarder, "LONG_FILE")
+    CompressionTest.CompressionTest(forwarder, "LONG_FILE")
+    CodecFallbackTest.CodecFallbackTest(forwarder, "README")
+    CodecFallbackTest.CodecFallbackTest(forwarder, "README", acks="drop")
+    CodecFallbackTest.CodecFallbackTest(forwarder, "README", acks="late")
+
+"""
+The scenarios that benchmark mode (-B) runs, each of them on every one of the
+input files, 'runs' times over. Returns [(scenario name, test object), ...].
+"""
+def benchmarks_to_run(forwarder, runs=1):
+    from tests import BasicTest, RandomDropTest, DelayTest, RandomReorderTest, CorruptTest, RandomDuplicateTest
+    scenarios = [
+        ("clean", BasicTest.BasicTest),
+        ("drop", RandomDropTest.RandomDropTest),
+        ("delay", DelayTest.DelayTest),
+        ("reorder", RandomReorderTest.RandomReorderTest),
+        ("corrupt", CorruptTest.CorruptTest),
+        ("duplicate", RandomDuplicateTest.RandomDuplicateTest),
+    ]
+    benchmarks = []
+    for input_file in ["one_char.txt", "README", "LONG_FILE"]:
+        for name, test in scenarios:
+            for _ in xrange(runs):
+                benchmarks.append((name, test(forwarder, input_file)))
+    return benchmarks
 """
 Testing is divided into two pieces: this forwarder and a set of test cases in
 the tests directory.
@@ -78,11 +111,16 @@ class Forwarder(object):
         self.current_test = None
         self.out_queue = []
         self.in_queue = []
+        # Heap of (release time, sequence number, packet) for packets sent with send_later()
+        self.scheduled = []
+        self.scheduled_count = 0
         self.test_state = "INIT"
         self.tick_interval = 0.001 # 1ms
         self.last_tick = time.time()
         self.timeout = 300. # seconds
+        # [(test object, input file, whether it passed, its TransferStats), ...]
         self.test_results = []
+        self.stats = None
         self.debug = debug
 
         # network stuff
@@ -101,6 +139,9 @@ class Forwarder(object):
         flush the out_queue.
         """
         self.current_test.handle_tick(self.tick_interval)
+        now = self.now()
+        while self.scheduled and self.scheduled[0][0] <= now:
+            self.out_queue.append(heapq.heappop(self.scheduled)[2])
         for p in self.out_queue:
             self._send(p)
         self.out_queue = []
@@ -108,8 +149,22 @@ class Forwarder(object):
     def _send(self, packet):
         """ Send a packet. """
         packet.update_packet(seqno=packet.seqno + self.start_seqno_base, update_checksum=False)
+        if packet.address == self.sender_addr:
+            self.stats.count_to_sender(packet)
         self.sock.sendto(packet.full_packet, packet.address)
 
+    def send_later(self, packet, delay):
+        """
+        Send a packet 'delay' seconds from now, without holding up any other
+        packet. It goes out with the first tick after that.
+        """
+        heapq.heappush(self.scheduled, (self.now() + delay, self.scheduled_count, packet))
+        self.scheduled_count += 1
+
+    def now(self):
+        """ The current time. Test cases should use this rather than the system clock. """
+        return time.time()
+
     def register_test(self, testcase, input_file):
         assert isinstance(testcase, BasicTest.BasicTest)
         self.tests.append((testcase, input_file))
@@ -119,11 +174,13 @@ class Forwarder(object):
             self.current_test = t
             print "Now running '%s'..." % self.current_test.__class__.__name__
             try:
-                self.start(input_file)
+                passed = self.start(input_file)
             except (KeyboardInterrupt, SystemExit):
                 exit()
             except:
                 print("Test fail")
+                passed = False
+            self.test_results.append((t, input_file, passed, self.stats))
             time.sleep(1)
 
     def handle_receive(self, message, address, sackMode = False):
@@ -151,6 +208,7 @@ class Forwarder(object):
                 p = Packet(message, self.sender_addr, self.start_seqno_base, sackMode)
             elif address == self.sender_addr:
                 p = Packet(message, self.receiver_addr, self.start_seqno_base, sackMode)
+                self.stats.count_from_sender(p)
             else:
                 # Ignore packets from unknown sources
                 return
@@ -165,6 +223,8 @@ class Forwarder(object):
         self.recv_outfile = "127.0.0.1.%d" % self.port
         self.in_queue = []
         self.out_queue = []
+        self.scheduled = []
+        self.stats = TransferStats()
 
         if os.path.exists(self.recv_outfile):
             os.remove(self.recv_outfile)
@@ -183,6 +243,19 @@ class Forwarder(object):
             receiverCmd.append("-k")
             senderCmd.append("-k")
 
+        if self.current_test.binaryMode:
+            receiverCmd.append("-b")
+            senderCmd.append("-b")
+
+        if self.current_test.receiveWindow:
+            receiverCmd.extend(["-w", str(self.current_test.receiveWindow)])
+
+        if self.current_test.maxRate:
+            senderCmd.extend(["-r", str(self.current_test.maxRate)])
+
+        if self.current_test.compression:
+            senderCmd.extend(["-e", self.current_test.compression])
+
         if self.debug:
             receiverCmd.append("-d")
             senderCmd.append("-d")
@@ -206,6 +279,7 @@ class Forwarder(object):
                     self._tick()
                 if time.time() - start_time > self.timeout:
                     raise Exception("Test timed out!")
+            self.stats.elapsed = time.time() - start_time
             self._tick()
         except (KeyboardInterrupt, SystemExit):
             exit()
@@ -226,7 +300,7 @@ class Forwarder(object):
 
         if not os.path.exists(self.recv_outfile):
             raise RuntimeError("No data received by receiver!")
-        self.current_test.result(self.recv_outfile)
+        return self.current_test.result(self.recv_outfile)
 
 
 class Packet(object):
@@ -238,7 +312,11 @@ class Packet(object):
         # this is for making sure we have 0-indexed seq numbers throughout the
         # test.
         self.start_seqno_base = start_seqno_base
+        self.binary = BinaryPacket.is_binary(packet)
         try:
+            if self.binary:
+                self._parse_binary(packet)
+                return
             pieces = packet.split('|')
             self.msg_type, self.seqno_str = pieces[0:2] # first two elements always treated as msg type and seqno
             self.checksum = pieces[-1] # last is always treated as checksum
@@ -248,7 +326,7 @@ class Packet(object):
                 self.sack_str = self.seqno_str.split(';')[1]
             else:
                 self.seqno = int(self.seqno_str) - self.start_seqno_base
-            assert(self.msg_type in ["start", "end", "data", "ack", "sack"])
+            assert(self.msg_type in ["start", "stripe", "codec", "end", "data", "ack", "sack"])
             int(self.checksum)
             self.bogon = False
         except Exception as e:
@@ -259,6 +337,15 @@ class Packet(object):
             # on them.
             self.bogon = True
 
+    def _parse_binary(self, packet):
+        msg_type, seqno, data, checksum = BinaryPacket.split_packet(packet)
+        assert(msg_type in ["start", "stripe", "codec", "end", "data", "ack", "sack"])
+        self.msg_type = msg_type
+        self.seqno = seqno - self.start_seqno_base
+        self.data = data.tobytes()
+        self.checksum = checksum
+        self.bogon = False
+
     def update_packet(self, msg_type=None, seqno=None, data=None, full_packet=None, update_checksum=True):
         """
         This function handles safely changing the contents of a packet. By
@@ -276,6 +363,10 @@ class Packet(object):
             if data == None:
                 data = self.data
 
+            if self.binary:
+                self._update_binary_packet(msg_type, seqno, data, full_packet, update_checksum)
+                return
+
             if msg_type == "ack": # doesn't have a data field, so handle separately
                 body = "%s|%d|" % (msg_type, seqno)
                 checksum_body = "%s|%d|" % (msg_type, seqno + self.start_seqno_base)
@@ -285,6 +376,9 @@ class Packet(object):
             else:
                 body = "%s|%d|%s|" % (msg_type,seqno,data)
                 checksum_body = "%s|%d|%s|" % (msg_type, seqno + self.start_seqno_base, data)
+            if msg_type in ("ack", "sack") and data: # the receive window, if the receiver advertises one
+                body += "%s|" % data
+                checksum_body += "%s|" % data
             if update_checksum:
                 checksum = Checksum.generate_checksum(checksum_body)
             else:
@@ -298,9 +392,152 @@ class Packet(object):
             else:
                 self.full_packet = "%s%s" % (body,checksum)
 
+    def _update_binary_packet(self, msg_type, seqno, data, full_packet, update_checksum):
+        # The SACK list of a binary SACK lives in its data field, so unlike ASCII packets every type is encoded
+        # the same way
+        if update_checksum:
+            checksum_packet = BinaryPacket.make_packet(msg_type, seqno + self.start_seqno_base, data)
+            checksum = BinaryPacket.split_packet(checksum_packet)[3]
+        else:
+            checksum = self.checksum
+        self.msg_type = msg_type
+        self.seqno = seqno
+        self.data = data
+        self.checksum = checksum
+        if full_packet:
+            self.full_packet = full_packet
+        else:
+            self.full_packet = BinaryPacket.make_packet(msg_type, seqno, data, checksum)
+
     def __repr__(self):
         return "%s|%s|...|%s" % (self.msg_type, self.seqno, self.checksum)
 
+class TransferStats(object):
+    """
+    What one test's transfer cost: how long the sender ran, how many packets
+    it sent and how many of those were retransmissions, and how many ACKs
+    reached it. The forwarder counts packets as they pass through it.
+    """
+    DATA_TYPES = ("start", "stripe", "codec", "data", "end")
+
+    def __init__(self):
+        self.elapsed = None
+        self.packets_sent = 0
+        self.retransmissions = 0
+        self.acks_received = 0
+        self.seqnos_sent = set()
+
+    def count_from_sender(self, packet):
+        self.packets_sent += 1
+        if not packet.bogon and packet.msg_type in self.DATA_TYPES:
+            if packet.seqno in self.seqnos_sent:
+                self.retransmissions += 1
+            else:
+                self.seqnos_sent.add(packet.seqno)
+
+    def count_to_sender(self, packet):
+        if not packet.bogon and packet.msg_type in ("ack", "sack"):
+            self.acks_received += 1
+
+
+"""
+Benchmark mode runs the scenarios in benchmarks_to_run() and records, for each
+scenario and input file, the sender's completion time, its goodput (bytes of
+the file per second), the packets it sent, its retransmissions and the ACKs it
+received. With more than one run of each, we keep the fastest run that passed.
+
+The records can be written to JSON and CSV, and compared against the JSON of
+an earlier run: a scenario regresses if it no longer passes, or if it takes
+more than 'tolerance' longer than it did.
+"""
+BENCHMARK_FIELDS = ["scenario", "file", "bytes", "passed", "time", "goodput", "packets_sent", "retransmissions",
+                    "acks_received"]
+
+def run_benchmarks(forwarder, runs=1, json_file=None, csv_file=None, baseline_file=None, tolerance=0.25):
+    """ Runs the benchmarks, and returns the number of regressions against the baseline. """
+    scenario_of = dict((test, name) for name, test in benchmarks_to_run(forwarder, runs))
+    forwarder.execute_tests()
+
+    records = []
+    best = {}
+    for test, input_file, passed, stats in forwarder.test_results:
+        if test not in scenario_of:
+            continue
+        record = benchmark_record(scenario_of[test], input_file, passed, stats)
+        key = (record["scenario"], record["file"])
+        if key not in best:
+            records.append(key)
+            best[key] = record
+        elif record["passed"] and (not best[key]["passed"] or record["time"] < best[key]["time"]):
+            best[key] = record
+    records = [best[key] for key in records]
+
+    print_benchmarks(records)
+    if json_file:
+        f = open(json_file, "w")
+        json.dump(records, f, indent=2, sort_keys=True, separators=(",", ": "))
+        f.close()
+    if csv_file:
+        f = open(csv_file, "wb")
+        writer = csv.DictWriter(f, BENCHMARK_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+        f.close()
+    if baseline_file:
+        f = open(baseline_file)
+        baseline = json.load(f)
+        f.close()
+        return compare_benchmarks(records, baseline, tolerance)
+    return 0
+
+def benchmark_record(scenario, input_file, passed, stats):
+    size = os.path.getsize(input_file)
+    record = dict.fromkeys(BENCHMARK_FIELDS)
+    record.update(scenario=scenario, file=input_file, bytes=size, passed=bool(passed))
+    if stats is not None:
+        record.update(packets_sent=stats.packets_sent, retransmissions=stats.retransmissions,
+                      acks_received=stats.acks_received)
+        if stats.elapsed is not None:
+            record.update(time=stats.elapsed, goodput=size / max(stats.elapsed, 1e-9))
+    return record
+
+def print_benchmarks(records):
+    print "%-10s %-14s %9s %6s %9s %12s %8s %8s %8s" % \
+        ("scenario", "file", "bytes", "passed", "time (s)", "goodput B/s", "packets", "resent", "acks")
+    for r in records:
+        if r["time"] is None:
+            print "%-10s %-14s %9d %6s" % (r["scenario"], r["file"], r["bytes"], r["passed"])
+            continue
+        print "%-10s %-14s %9d %6s %9.3f %12.0f %8d %8d %8d" % \
+            (r["scenario"], r["file"], r["bytes"], r["passed"], r["time"], r["goodput"], r["packets_sent"],
+             r["retransmissions"], r["acks_received"])
+
+def compare_benchmarks(records, baseline, tolerance):
+    """ Prints how each record compares to the baseline, and returns the number of regressions. """
+    baseline = dict(((r["scenario"], r["file"]), r) for r in baseline)
+    regressions = 0
+    print "Against the baseline (regression: fails, or more than %d%% slower):" % (tolerance * 100)
+    for r in records:
+        base = baseline.get((r["scenario"], r["file"]))
+        if base is None:
+            print "%-10s %-14s not in the baseline" % (r["scenario"], r["file"])
+            continue
+        if base["passed"] and not r["passed"]:
+            verdict = "REGRESSION: no longer passes"
+            regressions += 1
+        elif not r["passed"] or base["time"] is None:
+            verdict = "passed %s, baseline passed %s" % (r["passed"], base["passed"])
+        else:
+            change = r["time"] / max(base["time"], 1e-9) - 1
+            verdict = "time %+.0f%%, retransmissions %+d" % \
+                (change * 100, r["retransmissions"] - base["retransmissions"])
+            if change > tolerance:
+                verdict = "REGRESSION: " + verdict
+                regressions += 1
+        print "%-10s %-14s %s" % (r["scenario"], r["file"], verdict)
+    print "%d regression(s)" % regressions
+    return regressions
+
 if __name__ == "__main__":
     # Don't modify anything below this line!
     import getopt
@@ -313,10 +550,17 @@ if __name__ == "__main__":
         print "-r RECEIVER | --receiver RECEIVER The path to the Receiver implementation (default: Receiver.py)"
         print "-h | --help Print this usage message"
         print "-d | --debug Enable debug mode"
+        print "-B | --benchmark Run the benchmarks instead of the tests"
+        print "-n RUNS | --runs RUNS Runs of each benchmark, keeping the fastest (default: 1)"
+        print "-j FILE | --json FILE Write the benchmark results to FILE as JSON"
+        print "-c FILE | --csv FILE Write the benchmark results to FILE as CSV"
+        print "-x FILE | --baseline FILE Compare the benchmark results to the JSON results in FILE"
+        print "--tolerance FRACTION How much slower than the baseline a benchmark may get (default: 0.25)"
 
     try:
         opts, args = getopt.getopt(sys.argv[1:],
-                                "p:s:r:d", ["port=", "sender=", "receiver=", "debug="])
+                                "p:s:r:dBn:j:c:x:", ["port=", "sender=", "receiver=", "debug=", "benchmark",
+                                                     "runs=", "json=", "csv=", "baseline=", "tolerance="])
     except:
         usage()
         exit()
@@ -325,6 +569,12 @@ if __name__ == "__main__":
     sender = "Sender.py"
     receiver = "Receiver.py"
     debug = False
+    benchmark = False
+    runs = 1
+    json_file = None
+    csv_file = None
+    baseline_file = None
+    tolerance = 0.25
 
     for o,a in opts:
         if o in ("-p", "--port"):
@@ -335,7 +585,22 @@ if __name__ == "__main__":
             receiver = a
         elif o in ("-d", "--debug"):
             debug = True
+        elif o in ("-B", "--benchmark"):
+            benchmark = True
+        elif o in ("-n", "--runs"):
+            runs = int(a)
+        elif o in ("-j", "--json"):
+            json_file = a
+        elif o in ("-c", "--csv"):
+            csv_file = a
+        elif o in ("-x", "--baseline"):
+            baseline_file = a
+        elif o == "--tolerance":
+            tolerance = float(a)
 
     f = Forwarder(sender, receiver, port, debug)
+    if benchmark:
+        regressions = run_benchmarks(f, runs, json_file, csv_file, baseline_file, tolerance)
+        sys.exit(1 if regressions else 0)
     tests_to_run(f)
     f.execute_tests()
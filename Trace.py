@@ -0,0 +1,198 @@
+import os
+import sys
+import struct
+import getopt
+
+'''
+A packet-level trace of what the Sender or Receiver did, cheap enough to leave
+on the per-packet paths.
+
+Every event is a fixed-size binary record: when it happened, what happened, the
+sequence number it was about, and a window size (the congestion window for the
+Sender, the packets it holds beyond a gap for the Receiver). Records go into a
+ring buffer that is allocated once, so recording an event is a single
+struct.pack_into() and, once the buffer has wrapped, only the latest CAPACITY
+events are kept. Nothing is written out until the trace is dumped to a file.
+
+Code that traces keeps its Tracer in an attribute that is None when tracing is
+off, so that all a disabled trace costs is checking that attribute.
+
+Run this file to read a trace back, as text or as an SVG time-sequence plot
+of sequence numbers against time:
+
+    python Trace.py -f sender.trace -o sender.svg
+    python Trace.py -f sender.trace -t
+'''
+
+# Event types
+SEND = 0        # Sender: sent a new packet
+RETRANSMIT = 1  # Sender: resent a packet
+ACK = 2         # Sender: received an ACK; Receiver: sent one. The sequence number is the cumulative ACK
+DUP_ACK = 3     # Sender: received a duplicate of the cumulative ACK
+TIMEOUT = 4     # Sender: a retransmission timer expired for this packet, the earliest that did
+LOSS = 5        # Sender: inferred that this packet was lost, and started fast recovery
+CORRUPT = 6     # a packet or ACK failed its checksum, or didn't parse
+RECEIVE = 7     # Receiver: received a packet of a connection
+DROP = 8        # Receiver: dropped a packet beyond its buffer
+
+EVENT_NAMES = ['send', 'retransmit', 'ack', 'dup_ack', 'timeout', 'loss', 'corrupt', 'receive', 'drop']
+
+MAGIC = "BTRC"
+VERSION = 1
+# magic, version, size of each record, number of records, number of events lost to the buffer wrapping, source
+HEADER = struct.Struct("<4sHHII16s")
+# time, sequence number, window, event type
+RECORD = struct.Struct("<dIIB")
+
+class Tracer(object):
+    # Default number of records the ring buffer holds
+    CAPACITY = 65536
+
+    def __init__(self, source, capacity=CAPACITY):
+        self.source = source # what is tracing, e.g. "sender"
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        # number of events recorded; the next one goes in slot count % capacity
+        self.count = 0
+
+    def record(self, now, event, seqno, window):
+        RECORD.pack_into(self.buffer, (self.count % self.capacity) * RECORD.size, now, seqno, window or 0, event)
+        self.count += 1
+
+    # Returns the records we hold as (time, event, seqno, window) tuples, oldest first
+    def get_records(self):
+        held = min(self.count, self.capacity)
+        first = self.count - held
+        return [self._unpack((first + i) % self.capacity) for i in xrange(held)]
+
+    def _unpack(self, slot):
+        now, seqno, window, event = RECORD.unpack_from(self.buffer, slot * RECORD.size)
+        return now, event, seqno, window
+
+    def dump(self, path):
+        records = self.get_records()
+        f = open(path, "wb")
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, len(records), self.count - len(records), self.source))
+        for now, event, seqno, window in records:
+            f.write(RECORD.pack(now, seqno, window, event))
+        f.close()
+
+# Reads a trace that Tracer.dump() wrote, and returns (source, lost, records), where 'lost' is the number of
+# earlier events that the ring buffer had overwritten and 'records' is a list of (time, event, seqno, window)
+def load(path):
+    f = open(path, "rb")
+    data = f.read()
+    f.close()
+    if len(data) < HEADER.size:
+        raise ValueError("%s is not a trace" % path)
+    magic, version, record_size, count, lost, source = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError("%s is not a version %d trace" % (path, VERSION))
+    records = []
+    for i in xrange(count):
+        now, seqno, window, event = RECORD.unpack_from(data, HEADER.size + i * record_size)
+        records.append((now, event, seqno, window))
+    return source.rstrip("\0"), lost, records
+
+# How each event is drawn in the plot: (colour, shape), where the shape is a mark at its sequence number or a
+# line across the whole plot at its time
+STYLES = {
+    SEND: ("#1f77b4", "mark"),
+    RETRANSMIT: ("#d62728", "mark"),
+    ACK: ("#2ca02c", "mark"),
+    DUP_ACK: ("#ff7f0e", "mark"),
+    TIMEOUT: ("#7f7f7f", "line"),
+    LOSS: ("#9467bd", "line"),
+    CORRUPT: ("#8c564b", "mark"),
+    RECEIVE: ("#1f77b4", "mark"),
+    DROP: ("#d62728", "mark"),
+}
+
+# Writes an SVG time-sequence plot of 'records': time along the bottom, sequence numbers up the side
+def plot(records, title, outfile, width=1200, height=700):
+    left, right, top, bottom = 70, 20, 40, 50
+    times = [r[0] for r in records] or [0]
+    seqnos = [r[2] for r in records if STYLES[r[1]][1] == "mark"] or [0]
+    t0, t1 = min(times), max(max(times), min(times) + 1e-6)
+    s0, s1 = min(seqnos), max(max(seqnos), min(seqnos) + 1)
+    def x(t):
+        return left + (t - t0) / (t1 - t0) * (width - left - right)
+    def y(seqno):
+        return height - bottom - float(seqno - s0) / (s1 - s0) * (height - top - bottom)
+
+    out = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" font-family="sans-serif" font-size="12">'
+           % (width, height),
+           '<rect width="100%" height="100%" fill="white"/>',
+           '<text x="%d" y="20" font-size="14">%s</text>' % (left, title),
+           '<line x1="%d" y1="%d" x2="%d" y2="%d" stroke="black"/>' % (left, height - bottom, width - right,
+                                                                       height - bottom),
+           '<line x1="%d" y1="%d" x2="%d" y2="%d" stroke="black"/>' % (left, top, left, height - bottom)]
+    for i in xrange(6):
+        t = t0 + (t1 - t0) * i / 5
+        seqno = s0 + (s1 - s0) * i / 5.
+        out.append('<text x="%.1f" y="%d" text-anchor="middle">%.3f</text>' % (x(t), height - bottom + 16, t - t0))
+        out.append('<text x="%d" y="%.1f" text-anchor="end">%d</text>' % (left - 6, y(seqno) + 4, seqno))
+    out.append('<text x="%d" y="%d" text-anchor="middle">time (s)</text>' % ((left + width - right) / 2, height - 10))
+    out.append('<text x="15" y="%d" transform="rotate(-90 15 %d)" text-anchor="middle">sequence number</text>' %
+               ((top + height - bottom) / 2, (top + height - bottom) / 2))
+
+    for now, event, seqno, window in records:
+        colour, shape = STYLES[event]
+        if shape == "line":
+            out.append('<line x1="%.1f" y1="%d" x2="%.1f" y2="%d" stroke="%s" stroke-dasharray="4,3"/>' %
+                       (x(now), top, x(now), height - bottom, colour))
+        else:
+            out.append('<rect x="%.1f" y="%.1f" width="2" height="2" fill="%s"/>' % (x(now) - 1, y(seqno) - 1, colour))
+
+    # a legend of the events that appear
+    seen = sorted(set(r[1] for r in records))
+    for i, event in enumerate(seen):
+        legend_x = width - right - 110 * (len(seen) - i)
+        out.append('<rect x="%d" y="12" width="10" height="10" fill="%s"/>' % (legend_x, STYLES[event][0]))
+        out.append('<text x="%d" y="21">%s</text>' % (legend_x + 14, EVENT_NAMES[event]))
+    out.append('</svg>')
+
+    f = open(outfile, "w")
+    f.write("\n".join(out) + "\n")
+    f.close()
+
+if __name__ == "__main__":
+    def usage():
+        print "BEARS-TP trace reader"
+        print "-f FILE | --file=FILE The trace to read"
+        print "-o FILE | --output=FILE Write a time-sequence plot of the trace to FILE, as SVG"
+        print "-t | --text Print the trace, one event per line"
+        print "-h | --help Print this usage message"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "f:o:th", ["file=", "output=", "text", "help"])
+    except getopt.GetoptError:
+        usage()
+        exit()
+
+    trace_file = None
+    outfile = None
+    text = False
+
+    for o,a in opts:
+        if o in ("-f", "--file"):
+            trace_file = a
+        elif o in ("-o", "--output"):
+            outfile = a
+        elif o in ("-t", "--text"):
+            text = True
+        else:
+            usage()
+            exit()
+
+    if trace_file is None or not (outfile or text):
+        usage()
+        exit()
+
+    source, lost, records = load(trace_file)
+    if text:
+        print "# %s, %d events%s" % (source, len(records), ", the %d before them lost" % lost if lost else "")
+        for now, event, seqno, window in records:
+            print "%.6f %s %d %d" % (now, EVENT_NAMES[event], seqno, window)
+    if outfile:
+        plot(records, "%s: %s" % (source, os.path.basename(trace_file)), outfile)
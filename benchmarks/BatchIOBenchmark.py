@@ -0,0 +1,99 @@
+import getopt
+import socket
+import sys
+import time
+
+import BatchIO
+
+"""
+Measures how many packets per second we can push through a loopback UDP socket
+pair, first with one sendto()/recvfrom() system call per datagram (what
+BasicSender and Receiver used to do), then with BatchIO batches, which use
+sendmmsg()/recvmmsg() where available.
+
+Run it from the top-level directory:
+
+    python -m benchmarks.BatchIOBenchmark [-n PACKETS] [-b BATCH] [-s SIZE]
+
+Each round, the sender writes a burst of BATCH datagrams and the receiver drains
+everything queued on its socket, which is the same pattern as a Sender flushing
+a window and a Receiver draining its socket per wakeup.
+"""
+
+def run(batched, packets, batch, size):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    receiver.bind(('127.0.0.1', 0))
+    address = receiver.getsockname()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    send_io = BatchIO.BatchIO(sender, max_batch=batch)
+    recv_io = BatchIO.BatchIO(receiver, max_batch=batch)
+    message = 'x' * size
+    burst = [(message, address)] * batch
+
+    sent = 0
+    received = 0
+    start = time.time()
+    while sent < packets:
+        if batched:
+            send_io.sendmany(burst)
+            sent += batch
+            drained = recv_io.recvmany()
+            while drained:
+                received += len(drained)
+                drained = recv_io.recvmany()
+        else:
+            # One blocking system call per datagram in each direction. Loopback doesn't drop anything with
+            # a receive buffer this large, so we know exactly how many datagrams to wait for
+            for _ in xrange(batch):
+                sender.sendto(message, address)
+            sent += batch
+            for _ in xrange(batch):
+                receiver.recvfrom(4096)
+            received += batch
+    elapsed = time.time() - start
+
+    sender.close()
+    receiver.close()
+    return sent, received, elapsed
+
+if __name__ == "__main__":
+    def usage():
+        print "Batched socket I/O benchmark"
+        print "-n PACKETS | --packets=PACKETS Number of datagrams to send, defaults to 200000"
+        print "-b BATCH | --batch=BATCH Datagrams per burst, defaults to 64"
+        print "-s SIZE | --size=SIZE Datagram size in bytes, defaults to 1472"
+        print "-h | --help Print this usage message"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:b:s:h", ["packets=", "batch=", "size=", "help"])
+    except getopt.GetoptError:
+        usage()
+        exit()
+
+    packets = 200000
+    batch = 64
+    size = 1472
+
+    for o,a in opts:
+        if o in ("-n", "--packets"):
+            packets = int(a)
+        elif o in ("-b", "--batch"):
+            batch = int(a)
+        elif o in ("-s", "--size"):
+            size = int(a)
+        else:
+            usage()
+            exit()
+
+    if not BatchIO.HAVE_MMSG:
+        print "sendmmsg()/recvmmsg() are not available here, so the batched run uses the portable fallback"
+
+    results = {}
+    for name, batched in (("per-datagram", False), ("batched", True)):
+        sent, received, elapsed = run(batched, packets, batch, size)
+        results[name] = received / elapsed
+        print "%-12s sent %d, received %d in %.2fs: %.0f packets/sec" % (name, sent, received, elapsed, received / elapsed)
+
+    print "speedup: %.2fx" % (results["batched"] / results["per-datagram"])
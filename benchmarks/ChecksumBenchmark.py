@@ -0,0 +1,117 @@
+import binascii
+import getopt
+import os
+import sys
+import time
+import zlib
+
+import Checksum
+import BinaryPacket
+import BasicSender
+import Receiver
+
+"""
+Measures how much of the CPU time spent on each packet goes into checksums.
+For each packet format and checksum, it times building a data packet and then
+validating and parsing it the way the Receiver does, and on its own the time
+the checksums take (one to build the packet, one to validate it). It also
+compares:
+
+    - ASCII validation before and after it stopped copying the packet
+    - rebuilding a packet for a retransmission with and without the checksum
+      cached from its first transmission
+
+Run it from the top-level directory:
+
+    python -m benchmarks.ChecksumBenchmark [-n PACKETS] [-s SIZE]
+
+Every figure is the best of a few runs, in microseconds per packet.
+"""
+
+REPEATS = 5
+
+# The ASCII code lives in methods that don't touch their instance, so we call them without creating a sender or
+# receiver (and the sockets that come with them)
+make_ascii_packet = BasicSender.BasicSender.__dict__['make_packet']
+make_ascii_packet_with_checksum = BasicSender.BasicSender.__dict__['make_packet_with_checksum']
+split_ascii_message = Receiver.Receiver.__dict__['_split_message']
+
+# Checksum.validate_checksum before it checksummed the packet in place
+def copying_validate_checksum(message):
+    try:
+        msg,reported_checksum = message.rsplit('|',1)
+        msg += '|'
+        return Checksum.generate_checksum(msg) == reported_checksum
+    except:
+        return False
+
+# Returns the best time per call of 'function' over 'packets' calls, in microseconds
+def best_time(packets, function, *args):
+    best = None
+    for _ in xrange(REPEATS):
+        start = time.time()
+        for _ in xrange(packets):
+            function(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / packets * 1e6
+
+def ascii_round_trip(data, validate):
+    packet = make_ascii_packet(None, 'data', 1234, data)
+    if validate(packet):
+        msg_type, seqno, payload, checksum = split_ascii_message(None, packet)
+        int(seqno)
+
+def binary_round_trip(data, adler32):
+    packet = BinaryPacket.make_packet('data', 1234, data, adler32=adler32)
+    if BinaryPacket.validate_checksum(packet):
+        BinaryPacket.split_packet(packet)
+
+if __name__ == "__main__":
+    def usage():
+        print "Checksum benchmark"
+        print "-n PACKETS | --packets=PACKETS Packets per run, defaults to 100000"
+        print "-s SIZE | --size=SIZE Data bytes per packet, defaults to 1446"
+        print "-h | --help Print this usage message"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:s:h", ["packets=", "size=", "help"])
+    except getopt.GetoptError:
+        usage()
+        exit()
+
+    packets = 100000
+    size = 1446
+
+    for o,a in opts:
+        if o in ("-n", "--packets"):
+            packets = int(a)
+        elif o in ("-s", "--size"):
+            size = int(a)
+        else:
+            usage()
+            exit()
+
+    # random data, without the '|' characters that would make the ASCII parser do extra work
+    data = os.urandom(size).replace('|', '-')
+    packet = make_ascii_packet(None, 'data', 1234, data)
+
+    crc = best_time(packets, binascii.crc32, packet)
+    adler = best_time(packets, zlib.adler32, packet)
+    print "checksum alone:       crc32 %.2f, adler32 %.2f" % (crc, adler)
+
+    before = best_time(packets, ascii_round_trip, data, copying_validate_checksum)
+    after = best_time(packets, ascii_round_trip, data, Checksum.validate_checksum)
+    print "ascii, copying:       %.2f per packet, %.0f%% of it checksums" % (before, 200 * crc / before)
+    print "ascii, in place:      %.2f per packet, %.0f%% of it checksums" % (after, 200 * crc / after)
+
+    for name, adler32, checksum_time in (("crc32", False, crc), ("adler32", True, adler)):
+        elapsed = best_time(packets, binary_round_trip, data, adler32)
+        print "%-21s %.2f per packet, %.0f%% of it checksums" % \
+            ("binary, %s:" % name, elapsed, 200 * checksum_time / elapsed)
+
+    checksum = make_ascii_packet_with_checksum(None, 'data', 1234, data)[1]
+    rebuild = best_time(packets, make_ascii_packet_with_checksum, None, 'data', 1234, data)
+    cached = best_time(packets, make_ascii_packet_with_checksum, None, 'data', 1234, data, checksum)
+    print "retransmit rebuild:   %.2f computing the checksum, %.2f with it cached" % (rebuild, cached)
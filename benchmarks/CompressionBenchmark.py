@@ -0,0 +1,117 @@
+import getopt
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import Compression
+
+"""
+Measures what compressing a transfer (Sender.py -e) buys for a file. For each
+codec and level it reports the compression ratio, how fast the codec compresses
+on its own, and how long the whole transfer takes, from starting the sender
+until it exits, against a transfer without compression.
+
+Run it from the top-level directory:
+
+    python -m benchmarks.CompressionBenchmark [-f FILE] [-e CODECS] [-n RUNS]
+
+Transfers run over loopback, where the network is rarely the bottleneck, so
+the time a codec costs shows up more than the packets it saves. Every transfer
+time is the best of a few runs.
+"""
+
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SENDER = os.path.join(TOP, "Sender.py")
+RECEIVER = os.path.join(TOP, "Receiver.py")
+
+# Compresses 'data' with a codec, and returns the compressed size and the time it took
+def compress(data, name, level):
+    start = time.time()
+    compressor = Compression.make_compressor(name, level)
+    size = len(compressor.compress(data)) + len(compressor.flush())
+    return size, time.time() - start
+
+# Transfers 'input_file' with the given extra Sender arguments, and returns how long it took, or None if the
+# file didn't arrive intact
+def transfer(input_file, sender_args):
+    port = random.randint(20000, 30000)
+    outdir = tempfile.mkdtemp()
+    receiver = subprocess.Popen(["python", RECEIVER, "-p", str(port), "-t", "5"], cwd=outdir)
+    time.sleep(0.5) # make sure the receiver is started first
+    try:
+        start = time.time()
+        subprocess.call(["python", SENDER, "-f", input_file, "-p", str(port)] + sender_args)
+        elapsed = time.time() - start
+        time.sleep(0.3) # let the receiver flush
+    finally:
+        receiver.terminate()
+        receiver.wait()
+
+    expected = open(input_file, "rb").read()
+    names = os.listdir(outdir)
+    complete = len(names) == 1 and open(os.path.join(outdir, names[0]), "rb").read() == expected
+    shutil.rmtree(outdir)
+    if not complete:
+        return None
+    return elapsed
+
+def best_transfer(input_file, sender_args, runs):
+    times = [transfer(input_file, sender_args) for _ in xrange(runs)]
+    if None in times:
+        return None
+    return min(times)
+
+if __name__ == "__main__":
+    def usage():
+        print "Compression benchmark"
+        print "-f FILE | --file=FILE The file to transfer, defaults to LONG_FILE"
+        print "-e CODECS | --codecs=CODECS Comma-separated CODEC:LEVEL pairs, defaults to levels 1, 6 and 9 of %s" % \
+            ", ".join(sorted(Compression.CODECS))
+        print "-n RUNS | --runs=RUNS Transfers of each kind, defaults to 3"
+        print "-h | --help Print this usage message"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "f:e:n:h", ["file=", "codecs=", "runs=", "help"])
+    except getopt.GetoptError:
+        usage()
+        exit()
+
+    input_file = os.path.join(TOP, "LONG_FILE")
+    codecs = ["%s:%d" % (name, level) for name in sorted(Compression.CODECS) for level in (1, 6, 9)]
+    runs = 3
+
+    for o,a in opts:
+        if o in ("-f", "--file"):
+            input_file = os.path.abspath(a)
+        elif o in ("-e", "--codecs"):
+            codecs = a.split(',')
+        elif o in ("-n", "--runs"):
+            runs = int(a)
+        else:
+            usage()
+            exit()
+
+    data = open(input_file, "rb").read()
+    baseline = best_transfer(input_file, [], runs)
+    print "%s, %d bytes" % (os.path.basename(input_file), len(data))
+    if baseline is None:
+        print "%-8s transfer failed" % "none"
+    else:
+        print "%-8s ratio 1.00, transfer %.2f s" % ("none", baseline)
+    for codec in codecs:
+        name, level = Compression.parse_codec(codec)
+        size, elapsed = compress(data, name, level)
+        transfer_time = best_transfer(input_file, ["-e", codec], runs)
+        if transfer_time is None:
+            print "%-8s transfer failed" % codec
+            continue
+        line = "%-8s ratio %.2f, compresses at %.1f MB/s, transfer %.2f s" % \
+            (codec, float(size) / len(data), len(data) / elapsed / 1e6, transfer_time)
+        # without a baseline there is nothing to compare the transfer to
+        if baseline is not None:
+            line += ", speedup: %.2fx" % (baseline / transfer_time)
+        print line
@@ -0,0 +1,99 @@
+import getopt
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+"""
+Measures how the aggregate throughput of concurrent transfers to one Receiver
+scales with the number of receiver worker processes (Receiver.py -j).
+
+Run it from the top-level directory:
+
+    python -m benchmarks.MultiReceiverBenchmark [-n SENDERS] [-j WORKERS] [-s SIZE]
+
+Every sender transfers its own copy of a file of random bytes, all at once, and
+the time runs from starting the senders until the last one exits. Senders and
+workers compete for the same cores, so the speedup a machine can show is
+limited by how many it has.
+"""
+
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SENDER = os.path.join(TOP, "Sender.py")
+RECEIVER = os.path.join(TOP, "Receiver.py")
+
+def run_transfers(workers, senders, input_file, port, extra_args):
+    outdir = tempfile.mkdtemp()
+    receiver = subprocess.Popen(["python", RECEIVER, "-p", str(port), "-t", "5", "-j", str(workers)] + extra_args,
+                                cwd=outdir)
+    time.sleep(0.5) # make sure the receiver is started first
+    try:
+        start = time.time()
+        processes = [subprocess.Popen(["python", SENDER, "-f", input_file, "-p", str(port)] + extra_args)
+                     for _ in xrange(senders)]
+        for process in processes:
+            process.wait()
+        elapsed = time.time() - start
+        time.sleep(0.5) # let the workers flush
+    finally:
+        receiver.terminate()
+        receiver.wait()
+
+    expected = open(input_file, "rb").read()
+    complete = 0
+    for name in os.listdir(outdir):
+        if open(os.path.join(outdir, name), "rb").read() == expected:
+            complete += 1
+    shutil.rmtree(outdir)
+    return elapsed, complete
+
+if __name__ == "__main__":
+    def usage():
+        print "Multi-process receiver benchmark"
+        print "-n SENDERS | --senders=SENDERS Number of concurrent senders, defaults to 4"
+        print "-j WORKERS | --workers=WORKERS Comma-separated receiver worker counts, defaults to 1,2,4"
+        print "-s SIZE | --size=SIZE Bytes each sender transfers, defaults to 4000000"
+        print "-k | --sack Use selective acknowledgements"
+        print "-h | --help Print this usage message"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:j:s:kh", ["senders=", "workers=", "size=", "sack", "help"])
+    except getopt.GetoptError:
+        usage()
+        exit()
+
+    senders = 4
+    worker_counts = [1, 2, 4]
+    size = 4000000
+    extra_args = []
+
+    for o,a in opts:
+        if o in ("-n", "--senders"):
+            senders = int(a)
+        elif o in ("-j", "--workers"):
+            worker_counts = [int(workers) for workers in a.split(',')]
+        elif o in ("-s", "--size"):
+            size = int(a)
+        elif o in ("-k", "--sack"):
+            extra_args.append("-k")
+        else:
+            usage()
+            exit()
+
+    input_file = tempfile.NamedTemporaryFile()
+    input_file.write(os.urandom(size))
+    input_file.flush()
+
+    print "%d cores, %d senders of %d bytes each" % (os.sysconf("SC_NPROCESSORS_ONLN"), senders, size)
+    baseline = None
+    for workers in worker_counts:
+        port = random.randint(20000, 30000)
+        elapsed, complete = run_transfers(workers, senders, input_file.name, port, extra_args)
+        throughput = senders * size / elapsed / 1e6
+        if baseline is None:
+            baseline = throughput
+        print "%d workers: %.2f s, %.2f MB/s aggregate, %d/%d files complete, speedup: %.2fx" % \
+            (workers, elapsed, throughput, complete, senders, throughput / baseline)
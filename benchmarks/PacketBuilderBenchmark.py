@@ -0,0 +1,113 @@
+import getopt
+import os
+import sys
+import tempfile
+import time
+
+import BasicSender
+import BinaryPacket
+
+"""
+Compares building data packets from a file the old way, by reading a chunk and
+formatting it into a new packet string, with building them in place with
+BasicSender.PacketBuilder.
+
+Run it from the top-level directory:
+
+    python -m benchmarks.PacketBuilderBenchmark [-n PACKETS] [-w WINDOW]
+
+It reports how many packets per second each builds, the memory each in-flight
+packet holds onto, and how many payload-sized objects each allocates per packet
+and per second. Python 2 can't count allocations for us, so those are counted
+from the code paths:
+
+    strings:          the chunk, the packet body and the final packet
+    strings (binary): the chunk and the final packet
+    builder:          none; the chunk is read straight into the packet's buffer
+"""
+
+CHUNK_SIZE = 1446
+BINARY_CHUNK_SIZE = 1460
+PACKET_BUFFER_SIZE = 1472 + 16
+
+ALLOCATIONS_PER_PACKET = {"strings": 3, "builder": 0, "strings (binary)": 2, "builder (binary)": 0}
+
+make_ascii_packet = BasicSender.BasicSender.__dict__['make_packet']
+
+def build_strings(infile, packets, in_flight, binary):
+    chunk_size = BINARY_CHUNK_SIZE if binary else CHUNK_SIZE
+    window = len(in_flight)
+    for seqno in xrange(packets):
+        chunk = infile.read(chunk_size)
+        if binary:
+            in_flight[seqno % window] = BinaryPacket.make_packet('data', seqno, chunk)
+        else:
+            in_flight[seqno % window] = make_ascii_packet(None, 'data', seqno, chunk)
+
+def build_in_place(infile, packets, in_flight, builder, binary):
+    chunk_size = BINARY_CHUNK_SIZE if binary else CHUNK_SIZE
+    window = len(in_flight)
+    for seqno in xrange(packets):
+        in_flight[seqno % window] = builder.build_from_file(infile, seqno + 1, chunk_size, binary)[1]
+
+if __name__ == "__main__":
+    def usage():
+        print "Packet builder benchmark"
+        print "-n PACKETS | --packets=PACKETS Number of packets to build, defaults to 200000"
+        print "-w WINDOW | --window=WINDOW Packets in flight, defaults to 256"
+        print "-h | --help Print this usage message"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:w:h", ["packets=", "window=", "help"])
+    except getopt.GetoptError:
+        usage()
+        exit()
+
+    packets = 200000
+    window = 256
+
+    for o,a in opts:
+        if o in ("-n", "--packets"):
+            packets = int(a)
+        elif o in ("-w", "--window"):
+            window = int(a)
+        else:
+            usage()
+            exit()
+
+    # a file big enough that we never run out of data
+    source = tempfile.TemporaryFile()
+    source.write(os.urandom(BINARY_CHUNK_SIZE * window))
+    source.flush()
+
+    for binary in (False, True):
+        rates = {}
+        for name in ("strings", "builder"):
+            if binary:
+                name += " (binary)"
+            # re-reading the same data keeps the file in the page cache, so we measure the builders rather than the disk
+            infile = os.fdopen(os.dup(source.fileno()), "rb")
+            in_flight = [None] * window
+            builder = BasicSender.PacketBuilder(window, PACKET_BUFFER_SIZE)
+            start = time.time()
+            built = 0
+            while built < packets:
+                infile.seek(0)
+                batch = min(packets - built, window)
+                if name.startswith("strings"):
+                    build_strings(infile, batch, in_flight, binary)
+                else:
+                    build_in_place(infile, batch, in_flight, builder, binary)
+                built += batch
+            elapsed = time.time() - start
+            infile.close()
+
+            memory = sum(sys.getsizeof(packet) for packet in in_flight)
+            if name.startswith("builder"):
+                memory += len(builder.buffer)
+
+            rate = packets / elapsed
+            rates[name] = rate
+            print "%-17s %.0f packets/sec, %d bytes per in-flight packet, %d payload allocations per packet (%.0f/sec)" % \
+                (name, rate, memory // window, ALLOCATIONS_PER_PACKET[name], rate * ALLOCATIONS_PER_PACKET[name])
+        print "speedup: %.2fx" % (rates[name] / rates[name.replace("builder", "strings")])
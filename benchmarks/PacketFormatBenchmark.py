@@ -0,0 +1,78 @@
+import getopt
+import os
+import sys
+import time
+
+import Checksum
+import BinaryPacket
+import BasicSender
+import Receiver
+
+"""
+Compares the pipe-delimited ASCII packet format with the binary one: how many
+header bytes each spends per packet, and how long it takes to build a data
+packet and then validate and parse it the way the Receiver does.
+
+Run it from the top-level directory:
+
+    python -m benchmarks.PacketFormatBenchmark [-n PACKETS] [-s SIZE]
+
+The data is random bytes, so it is full of the '|' characters that the ASCII
+parser has to split on and join back together.
+"""
+
+# The ASCII code lives in methods that don't touch their instance, so we call them without creating a sender or
+# receiver (and the sockets that come with them)
+make_ascii_packet = BasicSender.BasicSender.__dict__['make_packet']
+split_ascii_message = Receiver.Receiver.__dict__['_split_message']
+
+def run_ascii(packets, data):
+    start = time.time()
+    for seqno in xrange(packets):
+        packet = make_ascii_packet(None, 'data', seqno, data)
+        if Checksum.validate_checksum(packet):
+            msg_type, seqno_str, payload, checksum = split_ascii_message(None, packet)
+            int(seqno_str)
+    return time.time() - start, len(packet) - len(data)
+
+def run_binary(packets, data):
+    start = time.time()
+    for seqno in xrange(packets):
+        packet = BinaryPacket.make_packet('data', seqno, data)
+        if BinaryPacket.validate_checksum(packet):
+            msg_type, seqno, payload, checksum = BinaryPacket.split_packet(packet)
+    return time.time() - start, len(packet) - len(data)
+
+if __name__ == "__main__":
+    def usage():
+        print "Packet format benchmark"
+        print "-n PACKETS | --packets=PACKETS Number of packets to build and parse, defaults to 200000"
+        print "-s SIZE | --size=SIZE Data bytes per packet, defaults to 1400"
+        print "-h | --help Print this usage message"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:s:h", ["packets=", "size=", "help"])
+    except getopt.GetoptError:
+        usage()
+        exit()
+
+    packets = 200000
+    size = 1400
+
+    for o,a in opts:
+        if o in ("-n", "--packets"):
+            packets = int(a)
+        elif o in ("-s", "--size"):
+            size = int(a)
+        else:
+            usage()
+            exit()
+
+    data = os.urandom(size)
+    results = {}
+    for name, run in (("ascii", run_ascii), ("binary", run_binary)):
+        elapsed, overhead = run(packets, data)
+        results[name] = elapsed
+        print "%-6s %d header bytes per packet, %.2f us to build and parse a packet" % (name, overhead, elapsed / packets * 1e6)
+
+    print "speedup: %.2fx" % (results["ascii"] / results["binary"])
@@ -0,0 +1,94 @@
+import getopt
+import random
+import sys
+import time
+
+import Receiver
+
+"""
+Compares the Receiver's old reassembly, which kept out-of-order packets in a
+dict and sorted its keys on every packet, with Receiver.ReassemblyBuffer.
+
+Run it from the top-level directory:
+
+    python -m benchmarks.ReassemblyBenchmark [-n PACKETS] [-w WINDOWS]
+
+Packets arrive in blocks the size of the window, each shuffled, so nearly every
+packet arrives out of order and the buffer is often close to full. Both sides
+build the SACK list for every packet, as the Receiver does in SACK mode.
+"""
+
+# The reassembly in Connection.ack before ReassemblyBuffer
+def run_sorted(arrivals, window):
+    current_seqno = -1
+    seqnums = {}
+    delivered = 0
+    for seqno in arrivals:
+        sacks = []
+        if current_seqno < seqno <= current_seqno + window:
+            seqnums[seqno] = seqno
+            for n in sorted(seqnums.keys()):
+                if n == current_seqno + 1:
+                    current_seqno += 1
+                    delivered += 1
+                    del seqnums[n]
+                else:
+                    sacks.append(n)
+    return delivered
+
+def run_ring(arrivals, window):
+    buf = Receiver.ReassemblyBuffer(0, window)
+    delivered = 0
+    for seqno in arrivals:
+        sacks = []
+        run = buf.add(seqno, seqno)
+        if run is not None:
+            delivered += len(run)
+            sacks = buf.get_sacks()
+    return delivered
+
+def make_arrivals(packets, window):
+    arrivals = []
+    for start in xrange(0, packets, window):
+        block = range(start, min(start + window, packets))
+        random.shuffle(block)
+        arrivals.extend(block)
+    return arrivals
+
+if __name__ == "__main__":
+    def usage():
+        print "Reassembly benchmark"
+        print "-n PACKETS | --packets=PACKETS Number of packets to reassemble, defaults to 20000"
+        print "-w WINDOWS | --windows=WINDOWS Comma-separated receive window sizes, defaults to 5,64,512,4096"
+        print "-h | --help Print this usage message"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:w:h", ["packets=", "windows=", "help"])
+    except getopt.GetoptError:
+        usage()
+        exit()
+
+    packets = 20000
+    windows = [5, 64, 512, 4096]
+
+    for o,a in opts:
+        if o in ("-n", "--packets"):
+            packets = int(a)
+        elif o in ("-w", "--windows"):
+            windows = [int(window) for window in a.split(',')]
+        else:
+            usage()
+            exit()
+
+    random.seed(0)
+    for window in windows:
+        arrivals = make_arrivals(packets, window)
+        results = {}
+        for name, run in (("sorted", run_sorted), ("ring", run_ring)):
+            start = time.time()
+            delivered = run(arrivals, window)
+            results[name] = time.time() - start
+            assert delivered == packets
+        print "window %5d: sorted %.2f us/packet, ring %.2f us/packet, speedup: %.2fx" % \
+            (window, results["sorted"] / packets * 1e6, results["ring"] / packets * 1e6,
+             results["sorted"] / results["ring"])
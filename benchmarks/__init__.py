@@ -0,0 +1 @@
+# this file intentionally left blank
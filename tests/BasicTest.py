@@ -14,9 +14,14 @@ class BasicTest(object):
         - handle_tick: a method to be called at every timestemp
         - result: a method to be called when it's time to return a result
     """
-    def __init__(self, forwarder, input_file, sackMode = False):
+    def __init__(self, forwarder, input_file, sackMode = False, binaryMode = False, receiveWindow = None, maxRate = None,
+                 compression = None):
         self.forwarder = forwarder
         self.sackMode = sackMode
+        self.binaryMode = binaryMode
+        self.receiveWindow = receiveWindow
+        self.maxRate = maxRate
+        self.compression = compression
 
         if not os.path.exists(input_file):
             raise ValueError("Could not find input file: %s" % input_file)
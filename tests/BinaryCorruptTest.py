@@ -0,0 +1,11 @@
+from CorruptTest import *
+
+"""
+Runs the random corruption test with the binary packet format. The forwarder
+parses binary packets into the same fields as ASCII ones, so corrupting the
+data, message type and sequence number works just as it does in CorruptTest.
+"""
+class BinaryCorruptTest(CorruptTest):
+    def __init__(self, forwarder, input_file):
+        BasicTest.__init__(self, forwarder, input_file, sackMode = True, binaryMode = True)
+        self.myname = "BinaryRandomCorruptTest"
@@ -0,0 +1,42 @@
+from BasicTest import *
+
+"""
+Drops several packets from the same window at regular intervals, leaving more
+than one hole for the sender to fill in each flight. Only the first
+transmission of a packet is ever dropped, so the sender can always recover by
+resending. The receiver advertises a window big enough to buffer everything
+past the holes, so a sender that resends each hole as the ACKs point at it
+never needs to time out and resend packets that already arrived; the test
+fails if it resends more of those than it had holes to fill.
+"""
+class BurstDropTest(BasicTest):
+    INTERVAL = 64
+    HOLES = (10, 12, 14)
+
+    def __init__(self, forwarder, input_file):
+        super(BurstDropTest, self).__init__(forwarder, input_file, receiveWindow = self.INTERVAL)
+        self.seen = set()
+        self.dropped = set()
+        self.needless_resends = 0
+
+    def handle_packet(self):
+        for p in self.forwarder.in_queue:
+            if p.msg_type == "data" and not p.bogon:
+                if p.seqno not in self.seen:
+                    self.seen.add(p.seqno)
+                    if p.seqno % self.INTERVAL in self.HOLES:
+                        self.dropped.add(p.seqno)
+                        continue
+                elif p.seqno not in self.dropped:
+                    self.needless_resends += 1
+            self.forwarder.out_queue.append(p)
+
+        # empty out the in_queue
+        self.forwarder.in_queue = []
+
+    def result(self, receiver_outfile):
+        if self.needless_resends > len(self.dropped):
+            print "Test fails: resent %d packets that had arrived to fill %d holes" % \
+                (self.needless_resends, len(self.dropped))
+            return False
+        return super(BurstDropTest, self).result(receiver_outfile)
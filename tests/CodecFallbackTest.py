@@ -0,0 +1,44 @@
+from BasicTest import *
+
+"""
+Sends a compressed transfer to a Receiver that never answers its codec packet,
+and checks that the Sender gives up on the codec and sends the file as it is.
+
+By default the codec packets are dropped, as if the Receiver didn't know the
+codec. With acks="drop", the Receiver gets them but its answers to them are
+dropped instead, so it has to switch back to an uncompressed transfer when the
+Sender starts over with a start packet. With acks="late", the answers arrive,
+but only after the Sender has given up on the codec, and the first start
+packet that replaces it is lost; the Sender must not mistake those answers for
+the answer to its start packet.
+"""
+class CodecFallbackTest(BasicTest):
+    # how long acks="late" holds up the answers to the codec packets, in seconds. The Sender gives up on the codec
+    # after about 2 seconds
+    LATE = 2.2
+
+    def __init__(self, forwarder, input_file, acks=None):
+        super(CodecFallbackTest, self).__init__(forwarder, input_file, compression = "zlib")
+        self.acks = acks
+        # type of the last packet 0 that the Sender sent
+        self.start_type = None
+        self.start_dropped = False
+
+    def handle_packet(self):
+        for p in self.forwarder.in_queue:
+            if p.msg_type in ("codec", "start"):
+                self.start_type = p.msg_type
+            if p.msg_type == "codec" and self.acks is None:
+                continue
+            if self.acks == "late" and p.msg_type == "start" and not self.start_dropped:
+                self.start_dropped = True
+                continue
+            # only the answers to the codec packet, not to the start packet that replaces it
+            if self.acks and p.msg_type == "ack" and p.seqno == 1 and self.start_type == "codec":
+                if self.acks == "late":
+                    self.forwarder.send_later(p, self.LATE)
+                continue
+            self.forwarder.out_queue.append(p)
+
+        # empty out the in_queue
+        self.forwarder.in_queue = []
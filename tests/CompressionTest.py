@@ -0,0 +1,34 @@
+import os
+import random
+
+import Sender
+from BasicTest import *
+
+"""
+Sends a compressed transfer through a path that drops some packets, and checks
+that the file still arrives intact and that compressing it took fewer data
+packets than sending it as it is would have.
+"""
+class CompressionTest(BasicTest):
+    def __init__(self, forwarder, input_file):
+        super(CompressionTest, self).__init__(forwarder, input_file, compression = "zlib")
+        self.seen = set()
+
+    def handle_packet(self):
+        for p in self.forwarder.in_queue:
+            if p.msg_type == "data" and not p.bogon:
+                self.seen.add(p.seqno)
+            if random.random() > 0.1:
+                self.forwarder.out_queue.append(p)
+
+        # empty out the in_queue
+        self.forwarder.in_queue = []
+
+    def result(self, receiver_outfile):
+        chunk_size = Sender.Sender.BINARY_CHUNK_SIZE if self.binaryMode else Sender.Sender.CHUNK_SIZE
+        uncompressed = -(-os.path.getsize(self.input_file) // chunk_size)
+        if len(self.seen) >= uncompressed:
+            print "Test fails: sent %d data packets, as many as the file takes uncompressed (%d)" % \
+                (len(self.seen), uncompressed)
+            return False
+        return super(CompressionTest, self).result(receiver_outfile)
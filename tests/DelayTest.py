@@ -1,12 +1,13 @@
 import random
-import time
 
 from BasicTest import *
 
 """
 This tests random packet delays. We randomly decide to delay about half of the
 packets that go through the forwarder in either direction. The delay time ranges
-from 0 to 1 second (1000ms).
+from 0 to 1 second (1000ms). Delayed packets are handed to the forwarder's
+send_later(), so they don't hold up the packets behind them, and can arrive
+after them.
 
 Note that to implement this we just needed to override the handle_packet()
 method -- this gives you an example of how to extend the basic test case to
@@ -22,8 +23,9 @@ class DelayTest(BasicTest):
             if random.choice([True, False]):
                 random_delaytime = random.randrange(1000)/1000.0
                 # print "Packet delayed: "+str(random_delaytime)
-                time.sleep(random_delaytime)
-            self.forwarder.out_queue.append(p)
+                self.forwarder.send_later(p, random_delaytime)
+            else:
+                self.forwarder.out_queue.append(p)
 
         # empty out the in_queue
         self.forwarder.in_queue = []
\ No newline at end of file
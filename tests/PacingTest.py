@@ -0,0 +1,42 @@
+from BasicTest import *
+
+"""
+Runs the sender with a maximum rate and checks that it keeps to it: the new
+data packets that pass through the forwarder must take at least as long as
+the rate allows. The forwarder only sees when packets reach it, which can be
+later than they were sent but never earlier, so a sender that keeps to the
+rate can't fail this.
+"""
+class PacingTest(BasicTest):
+    RATE = 200000 # bytes per second
+    PACKET_SIZE = 1472
+    # Packets that the sender may send at once before the pacing kicks in
+    BURST = 2
+
+    def __init__(self, forwarder, input_file):
+        super(PacingTest, self).__init__(forwarder, input_file, maxRate = self.RATE)
+        self.seen = set()
+        self.first_time = None
+        self.last_time = None
+
+    def handle_packet(self):
+        for p in self.forwarder.in_queue:
+            if p.msg_type == "data" and not p.bogon and p.seqno not in self.seen:
+                self.seen.add(p.seqno)
+                self.last_time = self.forwarder.now()
+                if self.first_time is None:
+                    self.first_time = self.last_time
+            self.forwarder.out_queue.append(p)
+
+        # empty out the in_queue
+        self.forwarder.in_queue = []
+
+    def result(self, receiver_outfile):
+        if self.seen:
+            elapsed = self.last_time - self.first_time
+            expected = (len(self.seen) - self.BURST) * self.PACKET_SIZE / float(self.RATE)
+            if elapsed < expected * 0.9:
+                print "Test fails: sent %d packets in %.2f s, faster than the rate allows (%.2f s)" % \
+                    (len(self.seen), elapsed, expected)
+                return False
+        return super(PacingTest, self).result(receiver_outfile)
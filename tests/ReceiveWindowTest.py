@@ -0,0 +1,36 @@
+import random
+
+from BasicTest import *
+
+"""
+Runs the receiver with a small receive window, drops a few packets so that the
+sender's window has gaps to fill, and checks that the sender never sends a
+packet beyond the window the receiver last advertised to it.
+"""
+class ReceiveWindowTest(BasicTest):
+    WINDOW = 8
+
+    def __init__(self, forwarder, input_file):
+        super(ReceiveWindowTest, self).__init__(forwarder, input_file, sackMode = True, receiveWindow = self.WINDOW)
+        self.highest_ack = None
+        self.violations = 0
+
+    def handle_packet(self):
+        for p in self.forwarder.in_queue:
+            if not p.bogon:
+                if p.msg_type in ("ack", "sack"):
+                    if self.highest_ack is None or p.seqno > self.highest_ack:
+                        self.highest_ack = p.seqno
+                elif self.highest_ack is not None and p.seqno >= self.highest_ack + self.WINDOW:
+                    self.violations += 1
+            if random.random() > 0.1:
+                self.forwarder.out_queue.append(p)
+
+        # empty out the in_queue
+        self.forwarder.in_queue = []
+
+    def result(self, receiver_outfile):
+        if self.violations:
+            print "Test fails: sent %d packets beyond the receive window" % self.violations
+            return False
+        return super(ReceiveWindowTest, self).result(receiver_outfile)
@@ -0,0 +1,57 @@
+import zlib
+import binascii
+import unittest
+
+import BinaryPacket
+
+"""
+Checks which binary packets of a connection that uses Adler-32 are actually
+checksummed with it: only full data packets, never ACKs or short packets.
+"""
+class BinaryPacketTest(unittest.TestCase):
+
+    def checksum(self, packet):
+        return BinaryPacket.CHECKSUM.unpack_from(packet, BinaryPacket.PREFIX.size)[0]
+
+    def crc32(self, packet):
+        prefix, data = packet[:BinaryPacket.PREFIX.size], packet[BinaryPacket.HEADER_SIZE:]
+        return binascii.crc32(data, binascii.crc32(prefix)) & 0xffffffff
+
+    def adler32(self, packet):
+        prefix, data = packet[:BinaryPacket.PREFIX.size], packet[BinaryPacket.HEADER_SIZE:]
+        return zlib.adler32(data, zlib.adler32(prefix)) & 0xffffffff
+
+    def test_full_data_packets_use_adler32(self):
+        packet = BinaryPacket.make_packet('data', 5, "x" * BinaryPacket.ADLER32_MIN_LENGTH, adler32=True)
+        self.assertTrue(BinaryPacket.uses_adler32(packet))
+        self.assertEqual(self.checksum(packet), self.adler32(packet))
+        self.assertTrue(BinaryPacket.validate_checksum(packet))
+
+    def test_short_packets_use_crc32(self):
+        packets = [
+            BinaryPacket.make_packet('data', 5, "x" * (BinaryPacket.ADLER32_MIN_LENGTH - 1), adler32=True),
+            BinaryPacket.make_packet('start', 0, "x" * 1400, adler32=True),
+            BinaryPacket.make_packet('end', 9, '', adler32=True),
+            BinaryPacket.make_ack(6, adler32=True),
+            BinaryPacket.make_ack(6, [8, 9], 32, adler32=True),
+        ]
+        for packet in packets:
+            # still flagged, so that the other end knows the connection uses Adler-32
+            self.assertTrue(BinaryPacket.uses_adler32(packet))
+            self.assertEqual(self.checksum(packet), self.crc32(packet))
+            self.assertTrue(BinaryPacket.validate_checksum(packet))
+
+    def test_codec_answers_are_flagged(self):
+        for sacks in (None, [3]):
+            answer = BinaryPacket.make_ack(1, sacks, 32, codec=True)
+            self.assertTrue(BinaryPacket.validate_checksum(answer))
+            self.assertEqual(BinaryPacket.split_ack(answer)[1:], (1, sacks or [], 32, True))
+            self.assertFalse(BinaryPacket.split_ack(BinaryPacket.make_ack(1, sacks, 32))[4])
+
+    def test_corrupt_packet_fails(self):
+        packet = bytearray(BinaryPacket.make_packet('data', 5, "x" * 1400, adler32=True))
+        packet[-1] ^= 1
+        self.assertFalse(BinaryPacket.validate_checksum(str(packet)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+import Sender
+
+"""
+Checks how the congestion control engines grow the window in congestion
+avoidance.
+"""
+class CongestionControlTest(unittest.TestCase):
+
+    # ACKs a whole window 'rounds' times over, all at the time 'now'
+    def ack_rounds(self, engine, rounds, now=0.0):
+        for _ in xrange(rounds):
+            engine.on_ack(int(engine.cwnd), now)
+
+    def test_aimd_grows_one_packet_per_round_trip(self):
+        engine = Sender.AIMD()
+        engine.cwnd = engine.ssthresh = 10.0
+        self.ack_rounds(engine, 10)
+        self.assertAlmostEqual(engine.cwnd, 20.0, delta=1.0)
+
+    def test_cubic_is_tcp_friendly(self):
+        # Round trips so short that no time passes leave the cubic function where the epoch started, so the
+        # window only grows as fast as the AIMD estimate: ALPHA packets per round trip
+        engine = Sender.Cubic()
+        engine.cwnd = engine.ssthresh = 10.0
+        engine.w_max = 20.0
+        self.ack_rounds(engine, 10)
+        self.assertAlmostEqual(engine.cwnd, 10.0 + 10 * Sender.Cubic.ALPHA, delta=0.5)
+
+    def test_cubic_grows_back_to_plateau(self):
+        engine = Sender.Cubic()
+        engine.cwnd = engine.ssthresh = 10.0
+        engine.w_max = 20.0
+        # by K seconds into the epoch, the cubic function is back at w_max
+        engine.on_ack(1, 0.0)
+        for now in xrange(1, 100):
+            engine.on_ack(int(engine.cwnd), engine.k * now / 50)
+        self.assertGreater(engine.cwnd, 20.0)
+
+if __name__ == "__main__":
+    unittest.main()
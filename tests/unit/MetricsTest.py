@@ -0,0 +1,84 @@
+import os
+import json
+import shutil
+import socket
+import tempfile
+import unittest
+
+import Metrics
+
+class HistogramTest(unittest.TestCase):
+
+    def test_bucket_edges(self):
+        histogram = Metrics.Histogram([4, 1, 2])
+        # a value on a bound counts in that bound's bucket, not the next one
+        for value in [0, 1, 1.5, 2, 4, 4.5]:
+            histogram.observe(value)
+        self.assertEqual(histogram.buckets, [2, 2, 1, 1])
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["buckets"], [[1, 2], [2, 2], [4, 1], [None, 1]])
+        self.assertEqual((snapshot["count"], snapshot["sum"], snapshot["min"], snapshot["max"]), (6, 13, 0, 4.5))
+
+    def test_empty_buckets_are_left_out(self):
+        histogram = Metrics.Histogram([1, 2, 4])
+        histogram.observe(3)
+        self.assertEqual(histogram.snapshot()["buckets"], [[4, 1]])
+
+class ReporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_udp_target(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        reporter = Metrics.Reporter("udp:127.0.0.1:%d" % port, "sender")
+        self.assertEqual(reporter.sock.family, socket.AF_INET)
+        self.assertEqual(reporter.address, ("127.0.0.1", port))
+
+        reporter.report({"packets_sent": 3})
+        report = json.loads(listener.recv(65536))
+        self.assertEqual((report["source"], report["metrics"]), ("sender", {"packets_sent": 3}))
+        reporter.close()
+        listener.close()
+
+    def test_unix_target(self):
+        path = os.path.join(self.dir, "metrics.sock")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        listener.bind(path)
+        reporter = Metrics.Reporter("unix:" + path, "receiver")
+        self.assertEqual(reporter.sock.family, socket.AF_UNIX)
+        self.assertEqual(reporter.address, path)
+
+        reporter.report({"connections": 1})
+        report = json.loads(listener.recv(65536))
+        self.assertEqual((report["source"], report["metrics"]), ("receiver", {"connections": 1}))
+        reporter.close()
+        listener.close()
+
+    def test_nobody_listening(self):
+        reporter = Metrics.Reporter("unix:" + os.path.join(self.dir, "nobody.sock"), "sender")
+        reporter.report({})
+        reporter.close()
+
+    def test_file_target(self):
+        path = os.path.join(self.dir, "sender.metrics")
+        reporter = Metrics.Reporter(path, "sender")
+        reporter.report({"timeouts": 0})
+        reporter.report({"timeouts": 1})
+        reporter.close()
+        reports = [json.loads(line) for line in open(path)]
+        self.assertEqual([report["metrics"]["timeouts"] for report in reports], [0, 1])
+
+    @unittest.skipUnless(os.path.exists("/dev/full"), "needs /dev/full")
+    def test_full_disk(self):
+        reporter = Metrics.Reporter("/dev/full", "sender")
+        reporter.report({"timeouts": 0})
+        reporter.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import zlib
+import select
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+import unittest
+
+import BasicSender
+import Compression
+
+"""
+Checks reading input that can't be mapped, like stdin or a pipe, through
+BasicSender.ReadAhead: on its own from a pipe whose producer is slow, and end
+to end, with Sender.py reading stdin.
+"""
+
+# Writes 'data' to the file descriptor 'fd' in pieces of 'piece' bytes, 'pause' seconds apart, and closes it
+def produce(fd, data, piece, pause):
+    for i in xrange(0, len(data), piece):
+        os.write(fd, data[i:i + piece])
+        time.sleep(pause)
+    os.close(fd)
+
+class ReadAheadTest(unittest.TestCase):
+    CHUNK_SIZE = 1446
+
+    # Reads 'data' from a pipe through a ReadAhead the way the Sender does: filling it whenever the pipe is
+    # readable and there is room, and taking whole chunks out as soon as it has them. Returns the chunks
+    def read_through_pipe(self, data, compressor=None, limit=8 * CHUNK_SIZE):
+        read_fd, write_fd = os.pipe()
+        producer = threading.Thread(target=produce, args=(write_fd, data, 1000, 0.001))
+        producer.start()
+        infile = os.fdopen(read_fd, "rb")
+        read_ahead = BasicSender.ReadAhead(infile, limit, compressor)
+        chunks = []
+        try:
+            while True:
+                if read_ahead.wants_more() and select.select([infile], [], [], 5)[0]:
+                    read_ahead.fill()
+                    # never more than the limit, or one read beyond it
+                    self.assertLess(read_ahead.buffered, limit + BasicSender.ReadAhead.READ_SIZE)
+                while read_ahead.has_chunk(self.CHUNK_SIZE):
+                    chunk = read_ahead.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        return chunks
+                    chunks.append(chunk)
+        finally:
+            producer.join()
+            infile.close()
+
+    def test_slow_producer(self):
+        data = os.urandom(50000)
+        chunks = self.read_through_pipe(data)
+        self.assertEqual(''.join(chunks), data)
+        # every chunk is whole but the last
+        self.assertEqual(set(len(chunk) for chunk in chunks[:-1]), set([self.CHUNK_SIZE]))
+
+    def test_compressed(self):
+        data = "".join("line %d of the input\n" % i for i in xrange(5000))
+        chunks = self.read_through_pipe(data, Compression.make_compressor("zlib", Compression.DEFAULT_LEVEL))
+        self.assertEqual(zlib.decompress(''.join(chunks)), data)
+
+    def test_large_piece(self):
+        # a compressor can hand back far more than we read at once; taking chunks out of it must not copy the
+        # rest of it each time
+        read_ahead = BasicSender.ReadAhead(None, 0)
+        data = os.urandom(1000) * 16384
+        read_ahead.pieces.append(data)
+        read_ahead.buffered = len(data)
+        read_ahead.eof = True
+        start = time.time()
+        chunks = []
+        while read_ahead.buffered:
+            chunks.append(read_ahead.read(self.CHUNK_SIZE))
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(''.join(chunks), data)
+
+class SenderStdinTest(unittest.TestCase):
+    TOP = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        probe.bind(("127.0.0.1", 0))
+        self.port = probe.getsockname()[1]
+        probe.close()
+        self.receiver = subprocess.Popen([sys.executable, os.path.join(self.TOP, "Receiver.py"), "-p", str(self.port)],
+                                         cwd=self.dir)
+        time.sleep(0.3)
+
+    def tearDown(self):
+        self.receiver.terminate()
+        self.receiver.wait()
+        shutil.rmtree(self.dir)
+
+    def send(self, data, *args):
+        sender = subprocess.Popen([sys.executable, os.path.join(self.TOP, "Sender.py"), "-p", str(self.port)] +
+                                  list(args), stdin=subprocess.PIPE)
+        produce(sender.stdin.fileno(), data, 5000, 0.01)
+        # produce() closed the pipe under the file object
+        try:
+            sender.stdin.close()
+        except IOError:
+            pass
+        deadline = time.time() + 30
+        while sender.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if sender.poll() is None:
+            sender.kill()
+            self.fail("the Sender didn't finish")
+        self.assertEqual(sender.returncode, 0)
+        received = os.listdir(self.dir)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(open(os.path.join(self.dir, received[0]), "rb").read(), data)
+
+    def test_slow_stdin(self):
+        self.send(os.urandom(100000))
+
+    def test_slow_stdin_compressed(self):
+        self.send("".join("line %d of the input\n" % i for i in xrange(10000)), "-e", "zlib")
+
+if __name__ == "__main__":
+    unittest.main()
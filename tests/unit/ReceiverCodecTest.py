@@ -0,0 +1,60 @@
+import os
+import bz2
+import zlib
+import shutil
+import tempfile
+import unittest
+
+import Checksum
+import Receiver
+
+"""
+Checks how the Receiver answers the codec packet of a compressed transfer, and
+what it does with data that doesn't decompress.
+"""
+class ReceiverCodecTest(unittest.TestCase):
+    ADDRESS = ("127.0.0.1", 1001)
+
+    def setUp(self):
+        # the Receiver writes its files to the current directory
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        self.receiver = Receiver.Receiver(0)
+
+    def tearDown(self):
+        self.receiver.s.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def send(self, msg_type, seqno, data):
+        body = "%s|%d|%s|" % (msg_type, seqno, data)
+        self.receiver._handle_message(body + Checksum.generate_checksum(body), self.ADDRESS)
+        acks = [message for message, address in self.receiver.send_queue]
+        self.receiver.send_queue = []
+        return acks
+
+    def test_codec_answer_names_the_codec(self):
+        self.assertEqual([ack.rsplit('|', 1)[0] for ack in self.send('codec', 0, 'zlib')], ["ack|1||zlib"])
+        # the start packet that replaces it is answered like any other
+        self.assertEqual([ack.rsplit('|', 1)[0] for ack in self.send('start', 0, '')], ["ack|1"])
+        self.assertIsNone(self.receiver.connections[self.ADDRESS].decompressor)
+
+    def test_end_of_compressed_stream(self):
+        # a bz2 decompressor refuses anything once its stream has ended, even the end packet's empty data
+        self.send('codec', 0, 'bz2')
+        self.send('data', 1, bz2.compress("x" * 100))
+        self.assertEqual(len(self.send('end', 2, '')), 1)
+        self.receiver.connections[self.ADDRESS].end()
+        self.assertEqual(open("%s.%d" % self.ADDRESS).read(), "x" * 100)
+
+    def test_data_that_doesnt_decompress_drops_the_connection(self):
+        self.send('codec', 0, 'zlib')
+        self.assertEqual(len(self.send('data', 1, zlib.compress("x" * 100)[:-4])), 1)
+        self.assertEqual(self.send('data', 2, "not compressed"), [])
+        self.assertNotIn(self.ADDRESS, self.receiver.connections)
+        self.assertFalse(os.path.exists("%s.%d" % self.ADDRESS))
+        self.assertEqual(self.receiver.connections_aborted.value, 1)
+
+if __name__ == "__main__":
+    unittest.main()
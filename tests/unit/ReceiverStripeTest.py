@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import Checksum
+import Receiver
+
+"""
+Feeds the Receiver the packets of a striped transfer (see Sender.run_striped)
+in an unfriendly order, and checks that every stream's range lands where it
+belongs in the one file they share.
+"""
+class ReceiverStripeTest(unittest.TestCase):
+    TRANSFER_ID = 7
+
+    def setUp(self):
+        # the Receiver writes its files to the current directory
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        self.receiver = Receiver.Receiver(0)
+
+    def tearDown(self):
+        self.receiver.s.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def packet(self, msg_type, seqno, data):
+        body = "%s|%d|%s|" % (msg_type, seqno, data)
+        return body + Checksum.generate_checksum(body)
+
+    # Returns the packets of a stream that sends 'chunks' from 'offset' in a file of 'size' bytes
+    def stream(self, offset, size, chunks):
+        packets = [self.packet('stripe', 0, "%d:%d:%d" % (self.TRANSFER_ID, offset, size))]
+        packets += [self.packet('data', i + 1, chunk) for i, chunk in enumerate(chunks)]
+        packets.append(self.packet('end', len(chunks) + 1, ''))
+        return packets
+
+    def receive(self, packets):
+        for port, packet in packets:
+            self.receiver._handle_message(packet, ("127.0.0.1", port))
+        for conn in self.receiver.connections.values():
+            conn.end()
+        return open("127.0.0.1.%d" % self.TRANSFER_ID, "rb").read()
+
+    def test_ranges_land_at_their_offsets(self):
+        contents = "".join(chr(ord('a') + i % 26) * 3 for i in xrange(30))
+        streams = {
+            1001: self.stream(0, len(contents), [contents[0:10], contents[10:20], contents[20:30]]),
+            1002: self.stream(30, len(contents), [contents[30:40], contents[40:50], contents[50:60]]),
+            1003: self.stream(60, len(contents), [contents[60:75], contents[75:90]]),
+        }
+        # the last range starts first, and each stream's data arrives out of order and twice
+        order = [1003, 1002, 1001]
+        packets = []
+        for port in order:
+            start, first, second = streams[port][:3]
+            packets += [(port, start), (port, second), (port, first), (port, second)]
+        for port in order:
+            packets += [(port, packet) for packet in reversed(streams[port][3:])]
+            packets.append((port, streams[port][0]))
+
+        self.assertEqual(self.receive(packets), contents)
+        for conn in self.receiver.connections.values():
+            self.assertTrue(conn.is_finished())
+
+    def test_older_longer_file_is_cut(self):
+        open("127.0.0.1.%d" % self.TRANSFER_ID, "wb").write("x" * 100)
+        packets = [(1002, packet) for packet in self.stream(5, 10, ["fghij"])]
+        packets += [(1001, packet) for packet in self.stream(0, 10, ["abcde"])]
+        self.assertEqual(self.receive(packets), "abcdefghij")
+
+if __name__ == "__main__":
+    unittest.main()
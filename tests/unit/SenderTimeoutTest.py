@@ -0,0 +1,83 @@
+import unittest
+
+import Checksum
+import EventLoop
+import Sender
+
+"""
+Runs a Sender on an EventLoop.FakeClock against a scripted Receiver, so that
+its retransmission timer can be checked without waiting for it.
+"""
+
+# Stands in for the Sender's socket. ACKs packets in order, as soon as they are sent, except that it drops every
+# packet until the clock reaches 'drop_until'
+class FakeReceiver(object):
+    def __init__(self, sender, clock, drop_until):
+        self.sender = sender
+        self.clock = clock
+        self.drop_until = drop_until
+        self.next_seqno = 0
+        self.acks = []
+        # (time, sequence number) of every packet the Sender sent
+        self.sent = []
+
+    def sendmany(self, packets):
+        for packet, address in packets:
+            msg_type, seqno, data, checksum = self.sender.split_packet(packet)
+            seqno = int(seqno)
+            self.sent.append((self.clock.now(), seqno))
+            if self.clock.now() < self.drop_until:
+                continue
+            if seqno == self.next_seqno:
+                self.next_seqno += 1
+            ack = "ack|%d|" % self.next_seqno
+            self.acks.append((ack + Checksum.generate_checksum(ack), address))
+        if self.acks:
+            self.clock.ready.add(self.sender.sock)
+
+    def recvmany(self):
+        acks, self.acks = self.acks, []
+        self.clock.ready.discard(self.sender.sock)
+        return acks
+
+class SenderTimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = EventLoop.FakeClock()
+        self.sender = Sender.Sender("127.0.0.1", 33122, "README", clock=self.clock)
+        # the file can always be read
+        self.clock.ready.add(self.sender.infile)
+        # as if we had measured a short RTT, which takes the RTO down to its floor
+        self.sender.rtt_estimator.add_sample(0.01)
+
+    def tearDown(self):
+        self.sender.sock.close()
+        self.sender.infile.close()
+
+    def test_retransmission_backs_off(self):
+        receiver = self.sender.io = FakeReceiver(self.sender, self.clock, 0.5)
+        self.sender.start()
+
+        # Each timeout resends the window, and doubles the time we wait for the next one
+        resent = [now for now, seqno in receiver.sent if seqno == 0]
+        rto = Sender.RTTEstimator.MIN_RTO
+        self.assertEqual(len(resent), 4)
+        for i, (earlier, later) in enumerate(zip(resent, resent[1:])):
+            self.assertAlmostEqual(later - earlier, rto * 2 ** i)
+        self.assertEqual(self.sender.timeouts.value, 3)
+
+        # the transfer still finishes, and its ACKs end the backoff
+        self.assertEqual(receiver.next_seqno, self.sender.current_sequence_number)
+        self.assertEqual(self.sender.rtt_estimator.backoff, 0)
+
+    def test_backoff_is_capped(self):
+        receiver = self.sender.io = FakeReceiver(self.sender, self.clock, 3.0)
+        self.sender.start()
+
+        resent = [now for now, seqno in receiver.sent if seqno == 0]
+        gaps = [later - earlier for earlier, later in zip(resent, resent[1:])]
+        self.assertAlmostEqual(max(gaps), Sender.RTTEstimator.MAX_BACKOFF_RTO)
+        self.assertAlmostEqual(gaps[-1], Sender.RTTEstimator.MAX_BACKOFF_RTO)
+
+if __name__ == "__main__":
+    unittest.main()
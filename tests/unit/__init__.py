@@ -0,0 +1,4 @@
+# Unit tests for the parts of the Sender and Receiver that the harness can't reach on its own. Run them from
+# the top of the repository with:
+#
+#     python -m unittest discover -s tests/unit -t . -p "*Test.py"